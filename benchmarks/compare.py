@@ -0,0 +1,45 @@
+import argparse
+import json
+from pathlib import Path
+from benchmarks.run import RESULTS_FORMAT
+
+def load_results(path: Path) -> dict:
+    with open(path) as f:
+        results = json.load(f)
+    if results.get("format") != RESULTS_FORMAT:
+        raise ValueError(f"{path} uses results format {results.get('format')}, expected {RESULTS_FORMAT}")
+    return results
+
+def compare(baseline: dict, candidate: dict):
+    """
+    per scenario (name, baseline median, candidate median, % change, baseline accuracy, candidate accuracy)
+    for the scenarios present in both runs
+    """
+    rows = []
+    for name, new in candidate["scenarios"].items():
+        old = baseline["scenarios"].get(name)
+        if old is None:
+            continue
+        old_median, new_median = old["seconds"]["median"], new["seconds"]["median"]
+        change = (new_median - old_median) / old_median * 100 if old_median else None
+        rows.append((name, old_median, new_median, change, old.get("accuracy"), new.get("accuracy")))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Diff two benchmark result files.")
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument("candidate", type=Path)
+    args = parser.parse_args()
+
+    baseline, candidate = load_results(args.baseline), load_results(args.candidate)
+    if baseline["corpus"] != candidate["corpus"]:
+        print(f"⚠️ corpora differ: {baseline['corpus']} vs {candidate['corpus']}")
+
+    print(f"{'scenario':>14}  {'baseline ms':>12}  {'candidate ms':>12}  {'change':>8}  accuracy")
+    for name, old_median, new_median, change, old_accuracy, new_accuracy in compare(baseline, candidate):
+        change_text = f"{change:+7.1f}%" if change is not None else "     n/a"
+        accuracy = f"{old_accuracy} -> {new_accuracy}" if old_accuracy is not None else ""
+        print(f"{name:>14}  {old_median * 1000:12.1f}  {new_median * 1000:12.1f}  {change_text}  {accuracy}")
+
+if __name__ == "__main__":
+    main()
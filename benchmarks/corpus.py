@@ -0,0 +1,211 @@
+import json
+import random
+from pathlib import Path
+from typing import List
+import pymupdf
+
+GROUND_TRUTH_FILENAME = "ground_truth.json"
+
+LAYOUTS = ["numbered", "table", "columns"]
+
+SUPPLIERS = ["SupplierX Pty Ltd", "Acme Electrical Supplies", "Northside Trade Co", "Harbour Wholesale Pty Ltd"]
+
+PRODUCTS = [
+    "Power Outlet", "Data Cable", "Switch Plate", "Conduit", "Junction Box", "Circuit Breaker", "LED Downlight",
+    "Cable Tray", "Smoke Alarm", "Fan Controller", "Patch Panel", "Earth Stake", "Isolator Switch", "Batten Holder",
+]
+VARIANTS = ["GPO", "CAT6", "2 Gang", "20mm", "IP66", "10A", "16A", "Single", "Double", "Weatherproof", "White", "Black"]
+SIZES = ["10m", "5m", "25mm", "Pack of 10", "300mm", "Slim", "Heavy Duty"]
+
+PAGE_MARGIN = 50
+LINE_HEIGHT = 16
+FONT_SIZE = 10
+# x position of each column in the table and columns layouts
+COLUMNS = {"description": 50, "quantity": 330, "unit_price": 400, "line_total": 480}
+
+def make_descriptions(rng: random.Random, count: int) -> List[List[str]]:
+    """
+    unique descriptions as word groups, the docket shows the same groups in a different order
+    """
+    combos = [(variant, product, size) for product in PRODUCTS for variant in VARIANTS for size in SIZES]
+    return [list(combo) for combo in rng.sample(combos, count)]
+
+def invoice_description(words: List[str]) -> str:
+    variant, product, size = words
+    return f"{variant} {product} ({size})"
+
+def docket_description(words: List[str]) -> str:
+    variant, product, size = words
+    return f"{product} - {variant} {size}"
+
+class PageWriter:
+    """
+    writes lines top to bottom, starting a new page when the current one is full
+    """
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.page = None
+        self.y = 0
+        self.new_page()
+
+    def new_page(self):
+        self.page = self.doc.new_page()
+        self.y = PAGE_MARGIN
+
+    def ensure_space(self, lines=1):
+        if self.y + lines * LINE_HEIGHT > self.page.rect.height - PAGE_MARGIN:
+            self.new_page()
+            return True
+        return False
+
+    def line(self, text, x=PAGE_MARGIN):
+        self.ensure_space()
+        self.page.insert_text((x, self.y), text, fontsize=FONT_SIZE)
+        self.y += LINE_HEIGHT
+
+    def row(self, cells: dict, ruled=False):
+        self.ensure_space()
+        for field, text in cells.items():
+            self.page.insert_text((COLUMNS[field], self.y), text, fontsize=FONT_SIZE)
+        if ruled:
+            top = self.y - LINE_HEIGHT + 4
+            self.page.draw_rect(pymupdf.Rect(COLUMNS["description"] - 4, top, 560, self.y + 4), width=0.5)
+            for x in list(COLUMNS.values())[1:]:
+                self.page.draw_line((x - 4, top), (x - 4, self.y + 4), width=0.5)
+        self.y += LINE_HEIGHT
+
+def item_cells(item, priced):
+    cells = {"description": item["description"], "quantity": str(item["quantity"])}
+    if priced:
+        cells["unit_price"] = f"${item['unit_price']:.2f}"
+        cells["line_total"] = f"${item['quantity'] * item['unit_price']:.2f}"
+    return cells
+
+def header_cells(priced):
+    cells = {"description": "Description", "quantity": "Qty"}
+    if priced:
+        cells.update(unit_price="Unit Price", line_total="Amount")
+    return cells
+
+def write_document(path: Path, doc_truth: dict, layout: str):
+    priced = doc_truth["document_type"] == "invoice"
+    doc = pymupdf.open()
+    writer = PageWriter(doc)
+
+    if priced:
+        writer.line("Supplier Invoice")
+        writer.line(f"Supplier: {doc_truth['supplier_name']}")
+        writer.line(f"Invoice Number: {doc_truth['invoice_number']}")
+    else:
+        writer.line("Delivery Docket")
+        writer.line(f"Supplier: {doc_truth['supplier_name']}")
+        writer.line(f"Delivery Docket - Reference {doc_truth['invoice_number']}")
+    writer.line(f"Job Code: {doc_truth['job_code']}")
+    writer.line("")
+
+    items = doc_truth["line_items"]
+    if layout == "numbered":
+        writer.line("Items:" if priced else "Delivered Items:")
+        for number, item in enumerate(items, 1):
+            text = f"{number}. {item['description']} | Qty: {item['quantity']}"
+            if priced:
+                text += f" | Unit Price: ${item['unit_price']:.2f}"
+            writer.line(text)
+    else:
+        ruled = layout == "table"
+        writer.row(header_cells(priced), ruled)
+        for item in items:
+            # tables repeat their header on every page
+            if writer.ensure_space():
+                writer.row(header_cells(priced), ruled)
+            writer.row(item_cells(item, priced), ruled)
+
+    if priced:
+        subtotal = sum(item["quantity"] * item["unit_price"] for item in items)
+        writer.line("")
+        writer.line(f"Subtotal: ${subtotal:.2f}")
+        writer.line(f"GST (10%): ${subtotal * 0.1:.2f}")
+        writer.line(f"Total: ${subtotal * 1.1:.2f}")
+
+    doc.save(path)
+    pages = doc.page_count
+    doc.close()
+    return pages
+
+def make_pair(rng: random.Random, number: int, max_items: int) -> dict:
+    """
+    ground truth for one invoice/docket pair, the docket may carry a short delivery, a missing or an extra line
+    """
+    item_count = rng.randint(3, max_items)
+    words = make_descriptions(rng, item_count + 1)
+    extra_words = words.pop()
+    invoice_items = [
+        {"description": invoice_description(w), "quantity": rng.randint(1, 50), "unit_price": round(rng.uniform(2, 250), 2)}
+        for w in words
+    ]
+    docket_items = [
+        {"description": docket_description(w), "quantity": item["quantity"]}
+        for w, item in zip(words, invoice_items)
+    ]
+
+    expected = {"matched": item_count, "quantity_mismatch": 0, "missing_item": 0, "extra_item": 0}
+    roll = rng.random()
+    if roll < 0.2:
+        docket_items[rng.randrange(item_count)]["quantity"] += rng.randint(1, 5)
+        expected["matched"] -= 1
+        expected["quantity_mismatch"] = 1
+    elif roll < 0.35:
+        docket_items.pop(rng.randrange(item_count))
+        expected["matched"] -= 1
+        expected["missing_item"] = 1
+    elif roll < 0.5:
+        docket_items.append({"description": docket_description(extra_words), "quantity": rng.randint(1, 20)})
+        expected["extra_item"] = 1
+    rng.shuffle(docket_items)
+
+    invoice_number = f"INV-{10000 + number}"
+    job_code = f"JOB-BENCH-{number:04d}"
+    supplier_name = rng.choice(SUPPLIERS)
+    common = {"invoice_number": invoice_number, "job_code": job_code, "supplier_name": supplier_name}
+    return {
+        "invoice": {**common, "document_type": "invoice", "line_items": invoice_items},
+        "docket": {**common, "document_type": "delivery_docket", "line_items": docket_items},
+        "expected": expected,
+    }
+
+def generate_corpus(out_dir: Path, pairs: int = 40, seed: int = 0, max_items: int = 80) -> dict:
+    """
+    writes pairs invoice/docket pdfs in rotating layouts plus ground_truth.json, the same seed always gives the same corpus.
+    item counts run up to max_items so larger documents span several pages
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+
+    truth = {"seed": seed, "max_items": max_items, "pairs": []}
+    for number in range(pairs):
+        pair = make_pair(rng, number, max_items)
+        layout = LAYOUTS[number % len(LAYOUTS)]
+        pair["layout"] = layout
+        for role in ("invoice", "docket"):
+            filename = f"{number:04d}_{role}.pdf"
+            pair[role]["file"] = filename
+            pair[role]["pages"] = write_document(out_dir / filename, pair[role], layout)
+        truth["pairs"].append(pair)
+
+    with open(out_dir / GROUND_TRUTH_FILENAME, "w") as f:
+        json.dump(truth, f, indent=2)
+    return truth
+
+def load_or_generate(out_dir: Path, pairs: int = 40, seed: int = 0, max_items: int = 80) -> dict:
+    """
+    reuses an existing corpus when it was generated with the same settings
+    """
+    truth_path = Path(out_dir) / GROUND_TRUTH_FILENAME
+    if truth_path.exists():
+        with open(truth_path) as f:
+            truth = json.load(f)
+        if truth["seed"] == seed and len(truth["pairs"]) == pairs and truth.get("max_items") == max_items:
+            return truth
+    return generate_corpus(out_dir, pairs, seed, max_items)
@@ -0,0 +1,248 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from benchmarks.corpus import load_or_generate
+from benchmarks.stub_gpt import StubClient
+
+# bump when the results layout changes so compare.py can refuse to diff incompatible files
+RESULTS_FORMAT = 1
+
+DEFAULT_CORPUS_DIR = Path(".cache") / "benchmark_corpus"
+DEFAULT_RESULTS_DIR = Path("benchmarks") / "results"
+
+# gpt modules build an api client at import, the stub replaces it before any call is made
+os.environ.setdefault("OPENAI_API_KEY", "benchmark-stub")
+
+def time_runs(fn, repeat: int):
+    """
+    runs fn once to warm up, then repeat timed runs. returns (seconds per run, result of the last run)
+    """
+    result = fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return timings, result
+
+def summarise(timings, items, **extra):
+    median = statistics.median(timings)
+    return {
+        "items": items,
+        "repeat": len(timings),
+        "seconds": {
+            "min": round(min(timings), 6),
+            "median": round(median, 6),
+            "mean": round(statistics.fmean(timings), 6),
+            "max": round(max(timings), 6),
+        },
+        "per_item_ms": round(median / items * 1000, 4) if items else None,
+        "items_per_second": round(items / median, 2) if median else None,
+        **extra,
+    }
+
+def documents(truth):
+    for pair in truth["pairs"]:
+        yield pair["invoice"]
+        yield pair["docket"]
+
+def same_document(parsed, expected):
+    fields = ("invoice_number", "supplier_name", "job_code", "document_type")
+    if any(parsed.get(field) != expected[field] for field in fields):
+        return False
+    got = [(item["description"], item["quantity"]) for item in parsed.get("line_items", [])]
+    return got == [(item["description"], item["quantity"]) for item in expected["line_items"]]
+
+ISSUE_TYPES = {
+    "Missing from delivery document": "missing_item",
+    "Quantity mismatch": "quantity_mismatch",
+    "Extra item in delivery not invoiced": "extra_item",
+}
+
+def reconcile_outcome(result):
+    outcome = {"matched": len(result["matched_items"]), "quantity_mismatch": 0, "missing_item": 0, "extra_item": 0}
+    for discrepancy in result["discrepancies"]:
+        # anomaly checks (duplicates, line totals, price drift) aren't part of the corpus ground truth
+        if discrepancy["issue"] in ISSUE_TYPES:
+            outcome[ISSUE_TYPES[discrepancy["issue"]]] += 1
+    return outcome
+
+def scenario_extraction(corpus_dir, truth, repeat):
+    from parse_pdfs import extract_text
+    paths = [corpus_dir / doc["file"] for doc in documents(truth)]
+    timings, texts = time_runs(lambda: [extract_text(path)[0] for path in paths], repeat)
+    pages = sum(doc["pages"] for doc in documents(truth))
+    return summarise(timings, len(paths), pages=pages, characters=sum(len(text) for text in texts)), texts
+
+def scenario_native_parse(corpus_dir, truth, texts, repeat):
+    from parse_pdfs import parse_metadata_and_line_items, add_layout_line_items
+    docs = list(documents(truth))
+
+    def run():
+        # layout fallback re-reads the pdf geometry for tabular documents, that's part of the native parse cost
+        return [
+            add_layout_line_items(corpus_dir / doc["file"], parse_metadata_and_line_items(text, "batch_document"))
+            for doc, text in zip(docs, texts)
+        ]
+
+    timings, parsed = time_runs(run, repeat)
+    correct = sum(same_document(result, doc) for result, doc in zip(parsed, docs))
+    return summarise(timings, len(docs), accuracy=round(correct / len(docs), 4))
+
+def scenario_reconcile(truth, repeat):
+    from reconcile import reconcile_batch
+    pairs = truth["pairs"]
+    timings, results = time_runs(lambda: reconcile_batch([(pair["invoice"], pair["docket"]) for pair in pairs]), repeat)
+    correct = sum(reconcile_outcome(result) == pair["expected"] for result, pair in zip(results, pairs))
+    lines = sum(len(pair["invoice"]["line_items"]) for pair in pairs)
+    return summarise(timings, len(pairs), invoice_lines=lines, accuracy=round(correct / len(pairs), 4))
+
+def scenario_pairing(truth, repeat):
+    from utils.document_matcher import DocumentIndex
+    parsed_dir = Path(tempfile.mkdtemp(prefix="benchmark_parsed_"))
+    try:
+        docs = {}
+        for doc in documents(truth):
+            path = parsed_dir / f"{Path(doc['file']).stem}_parsed.json"
+            path.write_text(json.dumps(doc))
+            docs[path.stem] = doc
+
+        def run():
+            index = DocumentIndex(parsed_dir)
+            index.rebuild()
+            return {doc_id: index.lookup(doc, exclude_id=doc_id) for doc_id, doc in docs.items()}
+
+        timings, partners = time_runs(run, repeat)
+    finally:
+        shutil.rmtree(parsed_dir, ignore_errors=True)
+
+    correct = sum(
+        entry is not None and entry["doc_id"] != doc_id and entry["invoice_number"] == docs[doc_id]["invoice_number"]
+        for doc_id, entry in partners.items()
+    )
+    return summarise(timings, len(docs), accuracy=round(correct / len(docs), 4))
+
+def scenario_gpt_parse(truth, texts, repeat, latency):
+    import gpt_parse
+    stub = StubClient(truth, latency)
+    gpt_parse.client = stub
+    docs = list(documents(truth))
+    timings, parsed = time_runs(lambda: [gpt_parse.parse_with_gpt(gpt_parse.clean_text(text)) for text in texts], repeat)
+    correct = sum(same_document(result, doc) for result, doc in zip(parsed, docs))
+    return summarise(timings, len(docs), stub_latency=latency, accuracy=round(correct / len(docs), 4))
+
+def scenario_gpt_reconcile(truth, texts, repeat, latency):
+    import gpt_reconcile
+    from utils.gpt_async import count_tokens
+    gpt_reconcile.client = StubClient(truth, latency)
+    work_dir = Path(tempfile.mkdtemp(prefix="benchmark_reconcile_"))
+    try:
+        jobs = []
+        for number, pair in enumerate(truth["pairs"]):
+            paths = []
+            for role, text in (("invoice", texts[2 * number]), ("docket", texts[2 * number + 1])):
+                json_path = work_dir / f"{number:04d}_{role}_parsed.json"
+                txt_path = work_dir / f"{number:04d}_{role}_text.txt"
+                json_path.write_text(json.dumps(pair[role]))
+                txt_path.write_text(text)
+                paths.append((json_path, txt_path))
+            (invoice_json, invoice_txt), (docket_json, docket_txt) = paths
+            jobs.append((invoice_json, docket_json, invoice_txt, docket_txt))
+
+        timings, _ = time_runs(lambda: [gpt_reconcile.reconcile_with_gpt(*job) for job in jobs], repeat)
+        prompt_tokens = [gpt_reconcile.build_reconcile_prompt(*job)["prompt_tokens"] for job in jobs]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    raw_tokens = [count_tokens(texts[2 * i] + texts[2 * i + 1], gpt_reconcile.GPT_MODEL) for i in range(len(jobs))]
+    return summarise(
+        timings, len(jobs), stub_latency=latency,
+        mean_prompt_tokens=round(statistics.fmean(prompt_tokens), 1),
+        mean_raw_text_tokens=round(statistics.fmean(raw_tokens), 1)
+    )
+
+SCENARIOS = ["extraction", "native_parse", "reconcile", "pairing", "gpt_parse", "gpt_reconcile"]
+
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+def run_benchmarks(corpus_dir, pairs, seed, max_items, repeat, scenarios, stub_latency):
+    corpus_dir = Path(corpus_dir)
+    truth = load_or_generate(corpus_dir, pairs, seed, max_items)
+    commit, dirty = git_revision()
+    results = {
+        "format": RESULTS_FORMAT,
+        "commit": commit,
+        "dirty": dirty,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus": {
+            "seed": seed,
+            "pairs": pairs,
+            "max_items": max_items,
+            "documents": 2 * pairs,
+            "pages": sum(doc["pages"] for doc in documents(truth)),
+        },
+        "scenarios": {},
+    }
+
+    # every later scenario works from the extracted text, so extraction always runs
+    print("⏱️ extraction")
+    results["scenarios"]["extraction"], texts = scenario_extraction(corpus_dir, truth, repeat)
+    runners = {
+        "native_parse": lambda: scenario_native_parse(corpus_dir, truth, texts, repeat),
+        "reconcile": lambda: scenario_reconcile(truth, repeat),
+        "pairing": lambda: scenario_pairing(truth, repeat),
+        "gpt_parse": lambda: scenario_gpt_parse(truth, texts, repeat, stub_latency),
+        "gpt_reconcile": lambda: scenario_gpt_reconcile(truth, texts, repeat, stub_latency),
+    }
+    for name in scenarios:
+        if name in runners:
+            print(f"⏱️ {name}")
+            results["scenarios"][name] = runners[name]()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the pipeline stages on a generated invoice/docket corpus.")
+    parser.add_argument("--corpus", type=Path, default=DEFAULT_CORPUS_DIR, help="where the generated pdfs are kept")
+    parser.add_argument("--pairs", type=int, default=40, help="invoice/docket pairs in the corpus")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-items", type=int, default=80, help="max line items per document")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per scenario")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="run only these scenarios (repeatable)")
+    parser.add_argument("--stub-latency", type=float, default=0.0, help="simulated GPT round trip in seconds")
+    parser.add_argument("--output", type=Path, help="results file, defaults to benchmarks/results/<commit>.json")
+    args = parser.parse_args()
+
+    results = run_benchmarks(
+        args.corpus, args.pairs, args.seed, args.max_items, args.repeat, args.scenario or SCENARIOS, args.stub_latency
+    )
+
+    output = args.output or DEFAULT_RESULTS_DIR / f"{(results['commit'] or 'unknown')[:12]}{'-dirty' if results['dirty'] else ''}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    for name, scenario in results["scenarios"].items():
+        accuracy = f", accuracy {scenario['accuracy']:.1%}" if "accuracy" in scenario else ""
+        print(f"{name:>14}: {scenario['seconds']['median'] * 1000:9.1f} ms median, "
+              f"{scenario['per_item_ms']:.3f} ms/item{accuracy}")
+    print(f"✅ Results saved to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,20 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, not_
+from typing import Iterable, List, Tuple, Union
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy import and_, or_, not_, insert, update
+from utils import metrics
+from utils.reconciliation_state import update_result
 from . import models
 
+DEFAULT_BATCH_SIZE = 500
+
+def _batches(items: list, batch_size: int):
+    for i in range(0, len(items), batch_size):
+        yield items[i:i + batch_size]
+
+def _commit(db: Session, operation: str):
+    with metrics.timer("db_commit", operation=operation):
+        db.commit()
+
 def create_document(db: Session, filename: str, document_type: str, parsed_json: dict):
     """
     creates a new document record in the database
@@ -9,10 +22,12 @@ def create_document(db: Session, filename: str, document_type: str, parsed_json:
     doc = models.Document(
         filename=filename,
         document_type=document_type,
-        parsed_json=parsed_json
+        parsed_json=parsed_json,
+        invoice_number=(parsed_json or {}).get("invoice_number"),
+        job_code=(parsed_json or {}).get("job_code")
     )
     db.add(doc)
-    db.commit()
+    _commit(db, "create_document")
     db.refresh(doc)
     return doc
 
@@ -33,35 +48,220 @@ def find_unmatched_document(db: Session, doc_to_match: models.Document):
         models.Document.reconciliation_id.is_(None), # ---> has not been assigned to a reconciliation yet 
         models.Document.id != doc_to_match.id, # ---> is not the same document we are trying to match
         or_(
-            models.Document.parsed_json['invoice_number'].astext == inv_num if inv_num else False,
-            models.Document.parsed_json['job_code'].astext == job_code if job_code else False
-        ) # ---> has a matching invoice_number or job_code inside its parsed_json
+            models.Document.invoice_number == inv_num if inv_num else False,
+            models.Document.job_code == job_code if job_code else False
+        ) # ---> has a matching invoice_number or job_code (indexed columns promoted from parsed_json)
     )
     
     return query.first()
 
 
-def create_reconciliation(db: Session, doc1: models.Document, doc2: models.Document, result: dict, method: str):
+@metrics.timer("db_query", operation="claim_unreconciled_groups")
+def claim_unreconciled_groups(db: Session, limit: int = 100) -> List[Tuple[models.Document, List[models.Document]]]:
     """
-    creates a reconciliation record and links the two source documents to it
+    claims up to limit unreconciled invoices together with every unreconciled docket sharing their
+    invoice_number or job_code, so an invoice delivered across several dockets is reconciled once.
+    a docket quoting an invoice number only ever goes to that invoice, a docket without one goes to the first
+    invoice with its job code. rows are locked FOR UPDATE SKIP LOCKED, so concurrent workers never claim the
+    same documents; the locks are held until the caller commits (e.g. once the reconciliations are created)
     """
-    # create the reconciliation entry
-    recon = models.Reconciliation(
-        invoice_number=result.get("invoice_number"),
-        supplier_name=result.get("supplier_name"),
-        job_code=result.get("job_code"),
-        reconciliation_status=result.get("reconciliation_status"),
-        summary=result.get("summary"),
-        discrepancies=result.get("discrepancies", []),
-        matched_items=result.get("matched_items", []),
-        processing_method=method
+    docket = aliased(models.Document)
+    has_docket = (
+        db.query(docket.id)
+        .filter(
+            docket.reconciliation_id.is_(None),
+            docket.document_type != "invoice",
+            or_(
+                docket.invoice_number == models.Document.invoice_number,
+                and_(docket.invoice_number.is_(None), docket.job_code == models.Document.job_code)
+            )
+        )
+        .exists()
+    )
+    invoices = (
+        db.query(models.Document)
+        .filter(
+            models.Document.reconciliation_id.is_(None),
+            models.Document.document_type == "invoice",
+            has_docket
+        )
+        .order_by(models.Document.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .all()
     )
+    if not invoices:
+        return []
+
+    invoice_numbers = {doc.invoice_number for doc in invoices if doc.invoice_number}
+    job_codes = {doc.job_code for doc in invoices if doc.job_code}
+    dockets = (
+        db.query(models.Document)
+        .filter(
+            models.Document.reconciliation_id.is_(None),
+            models.Document.document_type != "invoice",
+            or_(
+                models.Document.invoice_number.in_(invoice_numbers),
+                and_(models.Document.invoice_number.is_(None), models.Document.job_code.in_(job_codes))
+            )
+        )
+        .order_by(models.Document.id)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+
+    by_invoice_number = {}
+    by_job_code = {}
+    for invoice_doc in invoices:
+        by_invoice_number.setdefault(invoice_doc.invoice_number, invoice_doc)
+        by_job_code.setdefault(invoice_doc.job_code, invoice_doc)
+
+    deliveries = {}
+    for docket_doc in dockets:
+        # no job code fallback for a docket quoting an invoice number, its own invoice may just not be in this batch
+        if docket_doc.invoice_number:
+            invoice_doc = by_invoice_number.get(docket_doc.invoice_number)
+        else:
+            invoice_doc = by_job_code.get(docket_doc.job_code) if docket_doc.job_code else None
+        if invoice_doc is not None:
+            deliveries.setdefault(invoice_doc.id, []).append(docket_doc)
+
+    # an invoice whose dockets are all locked by another worker is left for a later claim
+    return [(invoice_doc, deliveries[invoice_doc.id]) for invoice_doc in invoices if invoice_doc.id in deliveries]
+
+def _reconciliation_values(result: dict, method: str) -> dict:
+    return {
+        "invoice_number": result.get("invoice_number"),
+        "supplier_name": result.get("supplier_name"),
+        "job_code": result.get("job_code"),
+        "reconciliation_status": result.get("reconciliation_status"),
+        "summary": result.get("summary"),
+        "discrepancies": result.get("discrepancies", []),
+        "matched_items": result.get("matched_items", []),
+        "reconciliation_state": result.get("reconciliation_state"),
+        "processing_method": method
+    }
+
+def create_reconciliation(db: Session, documents: Iterable[models.Document], result: dict, method: str):
+    """
+    creates a reconciliation record and links all of its source documents to it
+    (an invoice and any number of dockets/confirmations)
+    """
+    # create the reconciliation entry
+    recon = models.Reconciliation(**_reconciliation_values(result, method))
     
     # add the docs to the reconciliation
-    recon.documents.append(doc1)
-    recon.documents.append(doc2)
+    recon.documents.extend(documents)
     
     db.add(recon)
-    db.commit()
+    _commit(db, "create_reconciliation")
+    db.refresh(recon)
+    return recon
+
+def find_reconciliation_for_document(db: Session, doc: models.Document):
+    """
+    the latest reconciliation sharing the document's invoice_number or job_code, locked FOR UPDATE so
+    two late documents for the same invoice are folded in one after the other
+    """
+    if not doc.invoice_number and not doc.job_code:
+        return None
+    return (
+        db.query(models.Reconciliation)
+        .filter(or_(
+            models.Reconciliation.invoice_number == doc.invoice_number if doc.invoice_number else False,
+            models.Reconciliation.job_code == doc.job_code if doc.job_code else False
+        ))
+        .order_by(models.Reconciliation.created_at.desc(), models.Reconciliation.id.desc())
+        .with_for_update()
+        .first()
+    )
+
+def apply_late_document(db: Session, doc: models.Document, recon: models.Reconciliation = None,
+                        fuzzy_threshold: float = 0.8):
+    """
+    folds a docket or credit note that arrived after its reconciliation into it: the document's lines are
+    matched against the outstanding lines only and the reconciliation row is updated in place and linked
+    to the document. returns the reconciliation, or None when the document has none to join
+    """
+    recon = recon or find_reconciliation_for_document(db, doc)
+    if recon is None or doc.reconciliation_id == recon.id:
+        return recon
+
+    invoice_doc = next((d for d in recon.documents if d.document_type == "invoice"), None)
+    invoice_data = (invoice_doc.parsed_json if invoice_doc else None) or {}
+    stored = {
+        "matched_items": recon.matched_items,
+        "discrepancies": recon.discrepancies,
+        "reconciliation_state": recon.reconciliation_state
+    }
+    result = update_result(stored, invoice_data, doc.parsed_json or {}, doc.filename, fuzzy_threshold)
+
+    # new objects rather than in place edits, so the json columns are seen as changed
+    recon.reconciliation_status = result["reconciliation_status"]
+    recon.summary = result["summary"]
+    recon.matched_items = result["matched_items"]
+    recon.discrepancies = result["discrepancies"]
+    recon.reconciliation_state = result["reconciliation_state"]
+    recon.documents.append(doc)
+    _commit(db, "apply_late_document")
     db.refresh(recon)
-    return recon
\ No newline at end of file
+    return recon
+
+def bulk_create_documents(db: Session, documents: Iterable[dict], batch_size: int = DEFAULT_BATCH_SIZE) -> List[int]:
+    """
+    inserts many documents (dicts of filename, document_type, parsed_json) with one
+    multi-row insert ... returning per batch, committing at each batch boundary.
+    returns the new ids in input order
+    """
+    rows = [
+        {
+            "filename": doc["filename"],
+            "document_type": doc.get("document_type"),
+            "parsed_json": doc.get("parsed_json"),
+            "invoice_number": (doc.get("parsed_json") or {}).get("invoice_number"),
+            "job_code": (doc.get("parsed_json") or {}).get("job_code")
+        }
+        for doc in documents
+    ]
+
+    ids = []
+    for batch in _batches(rows, batch_size):
+        statement = insert(models.Document).returning(models.Document.id, sort_by_parameter_order=True)
+        ids.extend(db.scalars(statement, batch).all())
+        _commit(db, "bulk_create_documents")
+        metrics.increment("db_rows_inserted_total", len(batch), table="documents")
+    return ids
+
+def _document_id(doc: Union[models.Document, int]) -> int:
+    return doc.id if isinstance(doc, models.Document) else doc
+
+def bulk_create_reconciliations(
+    db: Session,
+    reconciliations: Iterable[Tuple[Iterable[Union[models.Document, int]], dict]],
+    method: str,
+    batch_size: int = DEFAULT_BATCH_SIZE
+) -> List[int]:
+    """
+    inserts many reconciliations from (documents, result) pairs and links their documents,
+    one insert ... returning plus one executemany update per batch, committing at each batch boundary.
+    documents can be Document rows or ids. returns the new reconciliation ids in input order
+    """
+    reconciliations = list(reconciliations)
+
+    ids = []
+    for batch in _batches(reconciliations, batch_size):
+        statement = insert(models.Reconciliation).returning(models.Reconciliation.id, sort_by_parameter_order=True)
+        recon_ids = db.scalars(statement, [_reconciliation_values(result, method) for _, result in batch]).all()
+
+        links = [
+            {"id": _document_id(doc), "reconciliation_id": recon_id}
+            for recon_id, (docs, _) in zip(recon_ids, batch)
+            for doc in docs
+        ]
+        if links:
+            # orm bulk update by primary key -> a single executemany
+            db.execute(update(models.Document), links)
+        _commit(db, "bulk_create_reconciliations")
+        metrics.increment("db_rows_inserted_total", len(recon_ids), table="reconciliations")
+        ids.extend(recon_ids)
+    return ids
@@ -5,7 +5,8 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-DATABASE_URL = os.getenv("DATABASE_URL")
+# falls back to a local sqlite file when no postgres url is configured
+DATABASE_URL = os.getenv("DATABASE_URL") or "sqlite:///reconciler.db"
 
 engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -4,7 +4,7 @@ from dotenv import load_dotenv
 from models import Base
 
 load_dotenv()
-DATABASE_URL = os.getenv("DATABASE_URL")
+DATABASE_URL = os.getenv("DATABASE_URL") or "sqlite:///reconciler.db"
 engine = create_engine(DATABASE_URL)
 
 def drop():
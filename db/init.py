@@ -5,7 +5,7 @@ from models import Base
 
 load_dotenv()
 
-DATABASE_URL = os.getenv("DATABASE_URL")
+DATABASE_URL = os.getenv("DATABASE_URL") or "sqlite:///reconciler.db"
 
 engine = create_engine(DATABASE_URL)
 
@@ -1,10 +1,16 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, JSON, Index, text
 from sqlalchemy.orm import relationship, declarative_base
 from sqlalchemy.dialects.postgresql import JSONB
-from datetime import datetime
+from datetime import datetime, timezone
 
 Base = declarative_base()
 
+# JSONB on postgres, plain JSON on the sqlite fallback used for local runs
+JSONType = JSONB().with_variant(JSON(), "sqlite")
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
 class Document(Base):
     """
     this represents a single ingested pdf document
@@ -16,19 +22,37 @@ class Document(Base):
     document_type = Column(String)  # e.g., 'invoice', 'delivery_docket'
     
     # stores the structured data extracted by the gpt/native parser 
-    parsed_json = Column(JSONB)
+    parsed_json = Column(JSONType)
+
+    # key identifiers promoted out of parsed_json so unreconciled lookups can use an index
+    invoice_number = Column(String)
+    job_code = Column(String)
     
     # reconciliation this document is part of FK
     reconciliation_id = Column(Integer, ForeignKey("reconciliations.id"), nullable=True)
     
-    created_at = Column(DateTime, default=datetime.timezone.utc)
+    created_at = Column(DateTime, default=utcnow)
 
     reconciliation = relationship("Reconciliation", back_populates="documents")
 
+    # partial indexes: only documents still waiting to be paired are ever searched by identifier
+    __table_args__ = (
+        Index(
+            "ix_documents_unreconciled_invoice_number", "invoice_number",
+            postgresql_where=text("reconciliation_id IS NULL"),
+            sqlite_where=text("reconciliation_id IS NULL")
+        ),
+        Index(
+            "ix_documents_unreconciled_job_code", "job_code",
+            postgresql_where=text("reconciliation_id IS NULL"),
+            sqlite_where=text("reconciliation_id IS NULL")
+        ),
+    )
+
 
 class Reconciliation(Base):
     """
-    this represents the outcome of comparing two documents
+    this represents the outcome of comparing an invoice with every document that delivered it
     """
     __tablename__ = "reconciliations"
 
@@ -44,9 +68,14 @@ class Reconciliation(Base):
     summary = Column(String)
     
     # store as lists of objects as json for querying
-    discrepancies = Column(JSONB)
-    matched_items = Column(JSONB)
+    discrepancies = Column(JSONType)
+    matched_items = Column(JSONType)
+
+    # per invoice line deliveries/credits keyed by normalised description, late documents are folded into it
+    reconciliation_state = Column(JSONType)
     
-    created_at = Column(DateTime, default=datetime.timezone.utc)
+    created_at = Column(DateTime, default=utcnow)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
 
-    documents = relationship("Document", back_populates="reconciliation")
\ No newline at end of file
+    # the invoice plus any number of dockets/confirmations, linked through documents.reconciliation_id
+    documents = relationship("Document", back_populates="reconciliation", order_by="Document.id")
\ No newline at end of file
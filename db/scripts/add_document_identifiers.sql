@@ -0,0 +1,19 @@
+-- promotes invoice_number/job_code out of documents.parsed_json into indexed columns
+-- run outside a transaction block (CREATE INDEX CONCURRENTLY), e.g. psql -f add_document_identifiers.sql
+
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS invoice_number VARCHAR;
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS job_code VARCHAR;
+
+-- backfill existing rows from the parsed json
+UPDATE documents
+SET invoice_number = parsed_json ->> 'invoice_number',
+    job_code = parsed_json ->> 'job_code'
+WHERE invoice_number IS DISTINCT FROM parsed_json ->> 'invoice_number'
+   OR job_code IS DISTINCT FROM parsed_json ->> 'job_code';
+
+-- partial indexes: only unreconciled documents are ever searched by identifier
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_documents_unreconciled_invoice_number
+    ON documents (invoice_number) WHERE reconciliation_id IS NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_documents_unreconciled_job_code
+    ON documents (job_code) WHERE reconciliation_id IS NULL;
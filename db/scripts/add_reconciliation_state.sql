@@ -0,0 +1,7 @@
+-- incremental reconciliation state: late dockets/credit notes update the row in place
+-- e.g. psql -f add_reconciliation_state.sql
+
+ALTER TABLE reconciliations ADD COLUMN IF NOT EXISTS reconciliation_state JSONB;
+ALTER TABLE reconciliations ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP;
+
+UPDATE reconciliations SET updated_at = created_at WHERE updated_at IS NULL;
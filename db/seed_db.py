@@ -48,8 +48,7 @@ def seed():
 
     recon = crud.create_reconciliation(
         db=db,
-        doc1=doc1,
-        doc2=doc2,
+        documents=[doc1, doc2],
         result=reconciliation_result,
         method="gpt-4.1"
     )
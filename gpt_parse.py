@@ -6,17 +6,43 @@ from openai import OpenAI
 from dotenv import load_dotenv
 import os
 import argparse
-from utils.email_utils import fetch_relevant_pdf_attachments
+import asyncio
+from functools import partial
+from utils.document_matcher import get_document_index
+from utils.batch_utils import resolve_pdf_paths, run_in_pool, default_worker_count
+from utils.extraction_cache import ExtractionCache
+from utils.gpt_cache import GPTResponseCache, hash_text
+from utils.gpt_async import AsyncGPTRunner
+from utils.ocr import extract_page_texts
+from utils.document_types import detect_document_type
+from utils.gpt_structured import parse_structured, StructuredOutputError
+from utils.schemas import ParsedDocument
+from utils import metrics
 
 load_dotenv()
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
+# bump whenever extraction or cleaning changes so stale cache entries are ignored
+EXTRACTION_VERSION = "gpt-extract-3"
+
+GPT_MODEL = "gpt-4.1"
+GPT_TEMPERATURE = 0.2
+# bump whenever the parse prompt changes so cached responses for the old prompt are ignored
+PROMPT_VERSION = "parse-1"
+# structured responses are cached separately, they are schema validated rather than free-form
+STRUCTURED_PROMPT_VERSION = "parse-structured-1"
+
+@metrics.timer("extract", method="gpt")
 def extract_text(pdf_path):
+    """
+    returns (text, unread): unread lists scanned pages OCR produced no text for
+    """
     try:
-        doc = pymupdf.open(pdf_path)
-        return "\n".join(page.get_text() for page in doc).strip()
+        # scanned pages come back as OCR text, otherwise GPT would be sent an empty prompt
+        texts, unread = extract_page_texts(pdf_path)
+        return "\n".join(texts).strip(), unread
     except Exception as e:
-        return f"error reading {pdf_path}: {e}"
+        return f"error reading {pdf_path}: {e}", []
 
 def clean_text(text):
     return unicodedata.normalize("NFKC", text).replace("\u200b", "").strip()
@@ -25,19 +51,8 @@ def write_to_file(content, out_path):
     out_path.parent.mkdir(parents=True, exist_ok=True)
     out_path.write_text(content, encoding="utf-8")
 
-def detect_document_type(text):
-    lowered = text.lower()
-    if "invoice" in lowered:
-        return "invoice"
-    elif "delivery docket" in lowered:
-        return "delivery_docket"
-    elif "purchase confirmation" in lowered:
-        return "purchase_confirmation"
-    return "unknown"
-
-def parse_with_gpt(raw_text: str) -> dict:
-    doc_type = detect_document_type(raw_text)
-    prompt = f"""
+def build_parse_prompt(raw_text: str) -> str:
+    return f"""
 You are a document parser. Extract the following structured information from this invoice, delivery docket, or purchase confirmation text. Return a clean, valid JSON.
 
 Fields to extract:
@@ -56,32 +71,233 @@ Text:
 {raw_text}
 \"\"\"
 """
-    response = client.chat.completions.create(
-        model="gpt-4.1",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.2
-    )
-    result = response.choices[0].message.content.strip()
+
+def cached_parse(raw_text: str, response_cache: GPTResponseCache = None, structured: bool = False):
+    """
+    (document type, cache key, cached result or None) for raw_text, shared by the sync and async parsers
+    """
+    doc_type = detect_document_type(raw_text)
+    if not response_cache:
+        return doc_type, None, None
+    prompt_version = STRUCTURED_PROMPT_VERSION if structured else PROMPT_VERSION
+    cache_key = GPTResponseCache.make_key(GPT_MODEL, GPT_TEMPERATURE, prompt_version, raw_text)
+    cached = response_cache.get(cache_key)
+    metrics.increment("gpt_response_cache_total", stage="gpt_parse", result="miss" if cached is None else "hit")
+    if cached is not None:
+        cached["document_type"] = doc_type
+    return doc_type, cache_key, cached
+
+def complete_with_gpt(prompt: str) -> str:
+    with metrics.timer("gpt_parse"):
+        response = client.chat.completions.create(
+            model=GPT_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=GPT_TEMPERATURE
+        )
+    metrics.record_gpt_usage(response, GPT_MODEL, "gpt_parse")
+    return response.choices[0].message.content
+
+def parse_with_gpt(raw_text: str, response_cache: GPTResponseCache = None, structured: bool = False) -> dict:
+    doc_type, cache_key, cached = cached_parse(raw_text, response_cache, structured)
+    if cached is not None:
+        return cached
+
+    prompt = build_parse_prompt(raw_text)
+    try:
+        if structured:
+            reply = parse_structured(client, prompt, GPT_MODEL, GPT_TEMPERATURE, ParsedDocument, stage="gpt_parse")
+        else:
+            reply = complete_with_gpt(prompt)
+    except StructuredOutputError as e:
+        print(f"!! {e}")
+        return {}
+    return finish_parse(reply, doc_type, response_cache, cache_key)
+
+async def parse_with_gpt_async(raw_text: str, runner: AsyncGPTRunner, response_cache: GPTResponseCache = None,
+                               structured: bool = False) -> dict:
+    doc_type, cache_key, cached = cached_parse(raw_text, response_cache, structured)
+    if cached is not None:
+        return cached
+
+    prompt = build_parse_prompt(raw_text)
+    try:
+        if structured:
+            reply = await runner.complete_structured(prompt, GPT_MODEL, GPT_TEMPERATURE, ParsedDocument, stage="gpt_parse")
+        else:
+            reply = await runner.complete(prompt, GPT_MODEL, GPT_TEMPERATURE, "gpt_parse")
+    except StructuredOutputError as e:
+        print(f"!! {e}")
+        return {}
+    return finish_parse(reply, doc_type, response_cache, cache_key)
+
+def finish_parse(reply, doc_type: str, response_cache: GPTResponseCache = None, cache_key: str = None) -> dict:
+    """
+    a structured reply is already validated, a free-form one still has to be decoded
+    """
+    if isinstance(reply, ParsedDocument):
+        return store_parsed(reply.model_dump(), doc_type, response_cache, cache_key, STRUCTURED_PROMPT_VERSION)
+    return decode_parse_response(reply, doc_type, response_cache, cache_key)
+
+def decode_parse_response(result: str, doc_type: str, response_cache: GPTResponseCache = None, cache_key: str = None) -> dict:
+    result = result.strip()
     try:
         parsed = json.loads(result)
-        parsed["document_type"] = doc_type
-        return parsed
     except json.JSONDecodeError:
+        metrics.increment("gpt_invalid_responses_total", model=GPT_MODEL, stage="gpt_parse", error="JSONDecodeError")
         print("!! GPT response was not valid JSON. Here's the raw response:")
         print(result)
         return {}
+    return store_parsed(parsed, doc_type, response_cache, cache_key, PROMPT_VERSION)
+
+def store_parsed(parsed: dict, doc_type: str, response_cache: GPTResponseCache, cache_key: str, prompt_version: str) -> dict:
+    parsed["document_type"] = doc_type
+    # only valid responses are cached so a bad answer is retried on the next run
+    if response_cache:
+        response_cache.put(cache_key, GPT_MODEL, prompt_version, parsed)
+    return parsed
 
-def main():
+def extract_clean_text(pdf_path, cache=None):
+    """
+    extracts + cleans a pdf's text, served from the extraction cache when the file bytes were seen before.
+    also the unit of work handed to each batch worker process
+    """
+    pdf_path = Path(pdf_path)
+    key = None
+    if cache:
+        key = cache.key_for(pdf_path)
+        entry = cache.get(key)
+        metrics.increment("extraction_cache_total", method="gpt", result="hit" if entry else "miss")
+        if entry:
+            return pdf_path, entry["text"]
+
+    raw_text, unread = extract_text(pdf_path)
+    text = clean_text(raw_text)
+
+    # never cache extraction failures, or scans OCR couldn't read (tesseract may be fixed by the next run)
+    if cache and not raw_text.startswith("error reading") and not unread:
+        cache.put(key, {"text": text})
+    return pdf_path, text
+
+def coalesce(results: dict, text: str, start):
+    """
+    (result, reused) for text, start(text) only runs for the first document in the batch with that text
+    """
+    text_hash = hash_text(text)
+    if text_hash in results:
+        return results[text_hash], True
+    results[text_hash] = start(text)
+    return results[text_hash], False
+
+def write_parsed(pdf_path, text, parsed, output, index):
+    parsed = dict(parsed)
+    parsed["document_type"] = detect_document_type(text)
+    parsed["document_position"] = "batch_document"
+    parsed["source_file"] = pdf_path.name
+    parsed_path = output / f"{pdf_path.stem}_parsed.json"
+    write_to_file(json.dumps(parsed, indent=2), parsed_path)
+    index.add(parsed_path, parsed)
+
+def run_batch(pdf_paths, output, workers=None, chunksize=4, cache=None, response_cache=None, structured=False):
+    """
+    extracts text across a process pool then sends each document to GPT,
+    writing one text + parsed json file per input.
+    documents with identical text within the batch share a single GPT call
+    """
+    count = 0
+    parsed_by_text = {}
+    index = get_document_index(output)
+    worker = partial(extract_clean_text, cache=cache)
+    for pdf_path, text in run_in_pool(worker, pdf_paths, workers, chunksize):
+        write_to_file(text, output / f"{pdf_path.stem}_text.txt")
+
+        def parse(text):
+            print(f"🤖 Parsing {pdf_path.name} with GPT...")
+            return parse_with_gpt(text, response_cache, structured)
+
+        parsed, reused = coalesce(parsed_by_text, text, parse)
+        if reused:
+            print(f"♻️ {pdf_path.name} is identical to an earlier document, reusing its GPT result")
+        write_parsed(pdf_path, text, parsed, output, index)
+        count += 1
+    return count
+
+async def run_batch_async(pdf_paths, output, workers=None, chunksize=4, cache=None, response_cache=None, runner=None,
+                          structured=False):
+    """
+    extracts text across a process pool then parses every document concurrently through the async runner.
+    each parsed json is written as soon as its response arrives, identical texts share one in-flight request
+    """
+    runner = runner or AsyncGPTRunner()
+    worker = partial(extract_clean_text, cache=cache)
+    index = get_document_index(output)
+    inflight = {}
+
+    def start(text):
+        return asyncio.ensure_future(parse_with_gpt_async(text, runner, response_cache, structured))
+
+    async def parse_document(pdf_path, text):
+        future, _ = coalesce(inflight, text, start)
+        return pdf_path, text, await future
+
+    tasks = []
+    for pdf_path, text in run_in_pool(worker, pdf_paths, workers, chunksize):
+        write_to_file(text, output / f"{pdf_path.stem}_text.txt")
+        tasks.append(parse_document(pdf_path, text))
+
+    count = 0
+    for next_done in asyncio.as_completed(tasks):
+        try:
+            pdf_path, text, parsed = await next_done
+        except Exception as e:
+            print(f"❌ GPT parse failed: {e}")
+            continue
+        write_parsed(pdf_path, text, parsed, output, index)
+        print(f"✅ Parsed {pdf_path.name}")
+        count += 1
+    return count
+
+def main(argv=None):
+    metrics.configure()
     uploads = Path("uploads")
     
     parser = argparse.ArgumentParser()
     parser.add_argument("--source", choices=["uploads", "inbox"], default="uploads")
-    args = parser.parse_args()
+    parser.add_argument("--input", help="directory or glob of pdfs to parse in batch mode")
+    parser.add_argument("--workers", type=int, default=default_worker_count(), help="batch extraction worker processes")
+    parser.add_argument("--chunksize", type=int, default=4, help="pdfs handed to a worker at a time")
+    parser.add_argument("--no-cache", action="store_true", help="always re-extract, ignoring the extraction cache")
+    parser.add_argument("--no-gpt-cache", action="store_true", help="always call GPT, ignoring cached responses")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="send batch GPT requests concurrently")
+    parser.add_argument("--concurrency", type=int, default=8, help="max in-flight GPT requests in async mode")
+    parser.add_argument("--rpm", type=int, default=500, help="GPT requests per minute limit in async mode")
+    parser.add_argument("--tpm", type=int, default=30000, help="GPT tokens per minute limit in async mode")
+    parser.add_argument("--structured", action="store_true", help="use schema validated structured outputs")
+    args = parser.parse_args(argv)
+
+    cache = None if args.no_cache else ExtractionCache(EXTRACTION_VERSION)
+    response_cache = None if args.no_gpt_cache else GPTResponseCache()
 
     base_dir = Path("local_src_gpt_output") if args.source == "uploads" else Path("email_src_gpt_output")
     gpt_parsed_output = base_dir / "parsed"
     gpt_parsed_output.mkdir(parents=True, exist_ok=True)
 
+    if args.input:
+        pdf_paths = resolve_pdf_paths(args.input)
+        if not pdf_paths:
+            print(f"!! no PDF files found for {args.input}")
+            return
+        if args.use_async:
+            runner = AsyncGPTRunner(concurrency=args.concurrency, rpm=args.rpm, tpm=args.tpm)
+            count = asyncio.run(run_batch_async(
+                pdf_paths, gpt_parsed_output, args.workers, args.chunksize, cache, response_cache, runner, args.structured
+            ))
+        else:
+            count = run_batch(pdf_paths, gpt_parsed_output, args.workers, args.chunksize, cache, response_cache, args.structured)
+        if cache:
+            cache.evict()
+        print(f"✅ Done! Batch parsed {count} files saved to {gpt_parsed_output}")
+        return
+
     invoice_path = uploads / "sample_invoice.pdf"
     source_path = uploads / "sample_delivery_docket.pdf"
 
@@ -89,24 +305,28 @@ def main():
         print("!! one or both PDF files are missing.")
         return
 
-    invoice_text = clean_text(extract_text(invoice_path))
-    source_text = clean_text(extract_text(source_path))
+    _, invoice_text = extract_clean_text(invoice_path, cache)
+    _, source_text = extract_clean_text(source_path, cache)
+    if cache:
+        cache.evict()
 
     write_to_file(invoice_text, gpt_parsed_output / "invoice_text.txt")
     write_to_file(source_text, gpt_parsed_output / "source_text.txt")
 
     print("🤖 Parsing invoice with GPT...")
-    invoice_json = parse_with_gpt(invoice_text)
+    invoice_json = parse_with_gpt(invoice_text, response_cache, args.structured)
     invoice_json["document_type"] = detect_document_type(invoice_text)
     invoice_json["document_position"] = "first_document"
     
     print("🤖 Parsing source/docket with GPT...")
-    source_json = parse_with_gpt(source_text)
+    source_json = parse_with_gpt(source_text, response_cache, args.structured)
     source_json["document_type"] = detect_document_type(source_text)
     source_json["document_position"] = "second_document"
     
-    write_to_file(json.dumps(invoice_json, indent=2), gpt_parsed_output / "invoice_parsed.json")
-    write_to_file(json.dumps(source_json, indent=2), gpt_parsed_output / "source_parsed.json")
+    index = get_document_index(gpt_parsed_output)
+    for name, parsed in (("invoice", invoice_json), ("source", source_json)):
+        write_to_file(json.dumps(parsed, indent=2), gpt_parsed_output / f"{name}_parsed.json")
+        index.add(gpt_parsed_output / f"{name}_parsed.json", parsed)
 
     print("✅ Done! Parsed files saved to /gpt_output/parsed")
 
@@ -5,30 +5,180 @@ from dotenv import load_dotenv
 import os
 import os.path
 from sheets_writer import write_reconciliation_to_sheet
-import smtplib
-from email.message import EmailMessage
 import argparse
+import asyncio
+from utils.mailer import DigestMailer, get_default_mailer
+from collections import Counter
+from utils.gpt_async import AsyncGPTRunner, count_tokens
+from utils.line_matching import match_descriptions, normalise_description
+from utils.gpt_structured import parse_structured
+from utils.schemas import ReconciliationResult
+from utils.reconciliation_state import CREDIT_DOCUMENT_TYPES, build_state
+from utils.document_matcher import group_documents, load_parsed_documents
+from reconcile import apply_late_documents, document_label, find_result_path, load_stored_result, write_result
+from utils import metrics
 
 load_dotenv()
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-def reconcile_with_gpt(invoice_json_path, delivery_json_path, invoice_txt_path, delivery_txt_path):
-    try:
-        with open(invoice_json_path) as f:
-            invoice_data = json.load(f)
-        with open(delivery_json_path) as f:
-            delivery_data = json.load(f)
-        with open(invoice_txt_path) as f:
-            invoice_text = f.read()
-        with open(delivery_txt_path) as f:
-            delivery_text = f.read()
-
-        prompt = f"""
+GPT_MODEL = "gpt-4.1"
+GPT_TEMPERATURE = 0
+
+# upper bound on reconciliation prompt size, raw text is trimmed to stay under it
+PROMPT_TOKEN_BUDGET = int(os.getenv("RECONCILE_PROMPT_TOKEN_BUDGET", "6000"))
+
+# lines at least this similar with equal quantities are matched locally and never sent to the model
+PREMATCH_THRESHOLD = 0.9
+
+IDENTIFIER_FIELDS = ["invoice_number", "supplier_name", "job_code"]
+
+# bookkeeping added by the parsers that the model never needs
+LOCAL_FIELDS = ["document_position", "source_file", "parse_route"]
+
+# all the model needs to match lines, a prompt over budget is retried with only these fields
+ESSENTIAL_DOCUMENT_FIELDS = IDENTIFIER_FIELDS + ["document_type"]
+ESSENTIAL_ITEM_FIELDS = ["description", "quantity", "unit_price"]
+
+TRUNCATION_MARKER = "[... truncated to fit the prompt budget]"
+
+class PromptBudgetError(ValueError):
+    """
+    the documents' JSON doesn't fit the reconciliation prompt budget even with only the essential fields
+    """
+
+OUTPUT_INSTRUCTIONS = """
+Return a structured JSON result like this:
+{"invoice_number": "...", "job_code": "...", "supplier_name": "...", "reconciliation_status": "reconciled" | "mismatch",
+"matched_items": [{"invoice_description": "...", "docket_description": "...", "quantity": ...}],
+"discrepancies": [{"type": "missing_item" | "extra_item" | "quantity_mismatch" | "duplicate", "invoice_description": "...",
+"docket_description": "...", "expected_quantity": ..., "found_quantity": ..., "notes": "..."}],
+"summary": "e.g. 3 matched, 1 missing, 0 extra"}
+
+After the JSON, write a plain text explanation (max 200 words) summarising your findings and judgment on the reconciliation outcome.
+This will be used for audit logging and human review.
+""".strip()
+
+# the response schema carries the field layout in structured mode
+STRUCTURED_OUTPUT_INSTRUCTIONS = """
+Put a plain text explanation (max 200 words) summarising your findings and judgment on the reconciliation outcome
+in the explanation field. This will be used for audit logging and human review.
+""".strip()
+
+def structured_complete(doc):
+    """
+    True when the parsed json already has every identifier and well formed line items, so the raw text adds nothing
+    """
+    items = doc.get("line_items") or []
+    return (
+        all(doc.get(field) for field in IDENTIFIER_FIELDS)
+        and bool(items)
+        and all(item.get("description") and item.get("quantity") is not None for item in items)
+    )
+
+def prematch_line_items(invoice_items, delivery_items, threshold=PREMATCH_THRESHOLD):
+    """
+    matches the lines that are unambiguous locally: near identical descriptions, equal quantities and no
+    conflicting unit price. descriptions repeated within either document are left to the model so duplicates
+    are still flagged, as are lines missing a description or quantity.
+    returns (matched_items, remaining_invoice_items, remaining_delivery_items)
+    """
+    def complete(item):
+        return bool(item.get("description")) and item.get("quantity") is not None
+
+    invoice_candidates = [i for i, item in enumerate(invoice_items) if complete(item)]
+    delivery_candidates = [i for i, item in enumerate(delivery_items) if complete(item)]
+    invoice_counts = Counter(normalise_description(invoice_items[i]["description"]) for i in invoice_candidates)
+    delivery_counts = Counter(normalise_description(delivery_items[i]["description"]) for i in delivery_candidates)
+
+    pairs = match_descriptions(
+        [invoice_items[i]["description"] for i in invoice_candidates],
+        [delivery_items[i]["description"] for i in delivery_candidates],
+        threshold
+    )
+
+    matched = []
+    used_invoice, used_delivery = set(), set()
+    for left, right, _ in pairs:
+        inv_idx, del_idx = invoice_candidates[left], delivery_candidates[right]
+        invoice_item, delivery_item = invoice_items[inv_idx], delivery_items[del_idx]
+        invoice_price, delivery_price = invoice_item.get("unit_price"), delivery_item.get("unit_price")
+        if (
+            invoice_item["quantity"] != delivery_item["quantity"]
+            or (invoice_price is not None and delivery_price is not None and invoice_price != delivery_price)
+            or invoice_counts[normalise_description(invoice_item["description"])] > 1
+            or delivery_counts[normalise_description(delivery_item["description"])] > 1
+        ):
+            continue
+        matched.append({
+            "invoice_description": invoice_item["description"],
+            "docket_description": delivery_item["description"],
+            "quantity": invoice_item["quantity"],
+        })
+        used_invoice.add(inv_idx)
+        used_delivery.add(del_idx)
+
+    remaining_invoice = [item for i, item in enumerate(invoice_items) if i not in used_invoice]
+    remaining_delivery = [item for i, item in enumerate(delivery_items) if i not in used_delivery]
+    return matched, remaining_invoice, remaining_delivery
+
+def compact_document(doc, line_items, essential_only=False):
+    # drops the parsers' local bookkeeping and swaps in only the line items the model still has to look at
+    compact = {key: value for key, value in doc.items() if key not in LOCAL_FIELDS and key != "line_items"}
+    if essential_only:
+        compact = {key: value for key, value in compact.items() if key in ESSENTIAL_DOCUMENT_FIELDS}
+        line_items = [
+            {field: item[field] for field in ESSENTIAL_ITEM_FIELDS if item.get(field) is not None} for item in line_items
+        ]
+    compact["line_items"] = line_items
+    return json.dumps(compact, separators=(",", ":"))
+
+def compact_text(text):
+    lines = (" ".join(line.split()) for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+def fit_text(text, max_tokens):
+    """
+    keeps whole lines of text from the top until max_tokens (including the truncation marker) is reached
+    """
+    if count_tokens(text, GPT_MODEL) <= max_tokens:
+        return text
+    max_tokens -= count_tokens(TRUNCATION_MARKER, GPT_MODEL) + 1
+    kept = []
+    used = 0
+    for line in text.splitlines():
+        line_tokens = count_tokens(line, GPT_MODEL) + 1
+        if used + line_tokens > max_tokens:
+            break
+        kept.append(line)
+        used += line_tokens
+    return "\n".join(kept + [TRUNCATION_MARKER])
+
+@metrics.timer("reconcile_prompt")
+def build_reconcile_prompt(invoice_json_path, delivery_json_path, invoice_txt_path, delivery_txt_path, token_budget=PROMPT_TOKEN_BUDGET,
+                           structured=False):
+    """
+    builds a compact reconciliation prompt: each document's json is included once, lines that match exactly
+    are paired locally and left out, and raw text is only added for documents whose json is incomplete,
+    trimmed to whatever is left of token_budget. json over the budget is cut down to the fields line matching
+    needs, if it still doesn't fit PromptBudgetError is raised rather than sending an oversized prompt.
+
+    returns a context dict with the prompt and what merge_local_results needs to restore the full result
+    """
+    with open(invoice_json_path) as f:
+        invoice_data = json.load(f)
+    with open(delivery_json_path) as f:
+        delivery_data = json.load(f)
+
+    prematched, invoice_items, delivery_items = prematch_line_items(
+        invoice_data.get("line_items", []), delivery_data.get("line_items", [])
+    )
+
+    def render(essential_only):
+        return f"""
 You are an accounts reconciliation assistant.
 
-You will be provided two documents — typically a supplier invoice and a delivery docket — each in two formats:
-1. A structured JSON version parsed via regex
-2. The raw text extracted from the original PDF
+You will be provided two documents — typically a supplier invoice and a delivery docket — as structured JSON parsed via regex,
+plus the raw text extracted from the PDF for any document whose JSON is incomplete.
 
 Your objectives are:
 1. Extract any missing key identifiers (e.g. invoice number, supplier name, job code) if absent from the JSON using the raw text.
@@ -43,72 +193,272 @@ Your objectives are:
    - Duplicate charges (multiple lines referring to the same item)
 4. Summarize whether the reconciliation is successful (no discrepancies) or failed (one or more issues found).
 
-Return a structured JSON result like this inside a json file:
-{{
-  "invoice_number": "...",
-  "job_code": "...",
-  "supplier_name": "...",
-  "reconciliation_status": "reconciled" | "mismatch",
-  "matched_items": [
-    {{
-      "invoice_description": "...",
-      "docket_description": "...",
-      "quantity": ...
-    }}
-  ],
-  "discrepancies": [
-    {{
-      "type": "missing_item" | "extra_item" | "quantity_mismatch" | "duplicate",
-      "invoice_description": "...",
-      "docket_description": "...",
-      "expected_quantity": ...,
-      "found_quantity": ...,
-      "notes": "..."
-    }}
-  ],
-  "summary": "e.g. 3 matched, 1 missing, 0 extra",
-  "original_invoice_json": {json.dumps(invoice_data)},
-  "original_delivery_json": {json.dumps(delivery_data)}
-}}
-
-
-Also return a .txt file with the explanation (max 200 words) summarising your findings and judgment on the reconciliation outcome. This will be used for audit logging and human review.
-
-Both the output .json and .txt files should be named with the convention "invoice number" + "reconciled", or "mismatch" respectively depending on the outcome.
-
-Here is the structured invoice:
-```json
-{json.dumps(invoice_data, indent=2)}
-```
-
-Here is the raw invoice text:
-```
-{invoice_text}
-```
-
-Here is the structured delivery docket:
-```json
-{json.dumps(delivery_data, indent=2)}
-```
-
-Here is the raw delivery docket text:
-```
-{delivery_text}
-```
-        """.strip()
-
-        response = client.chat.completions.create(
-            model="gpt-4.1",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0
+{len(prematched)} line item(s) already matched exactly on both documents and are not shown below.
+Count them as matched in the summary, but do not list them in matched_items.
+
+{STRUCTURED_OUTPUT_INSTRUCTIONS if structured else OUTPUT_INSTRUCTIONS}
+
+Structured invoice:
+{compact_document(invoice_data, invoice_items, essential_only)}
+
+Structured delivery docket:
+{compact_document(delivery_data, delivery_items, essential_only)}
+""".strip()
+
+    prompt = render(False)
+    prompt_tokens = count_tokens(prompt, GPT_MODEL)
+    if prompt_tokens > token_budget:
+        prompt = render(True)
+        prompt_tokens = count_tokens(prompt, GPT_MODEL)
+        metrics.increment("reconcile_prompt_essential_only_total")
+    if prompt_tokens > token_budget:
+        raise PromptBudgetError(
+            f"reconciliation JSON needs {prompt_tokens} tokens, over the {token_budget} token budget "
+            f"({len(invoice_items)} invoice and {len(delivery_items)} docket lines left after local matching)"
         )
 
+    # raw text only for documents the json doesn't fully describe, sharing whatever budget is left
+    raw_sections = [
+        (label, path) for label, doc, path in (
+            ("invoice", invoice_data, invoice_txt_path),
+            ("delivery docket", delivery_data, delivery_txt_path),
+        )
+        if not structured_complete(doc)
+    ]
+    for i, (label, path) in enumerate(raw_sections):
+        remaining = (token_budget - prompt_tokens) // (len(raw_sections) - i)
+        header = f"\n\nRaw {label} text:\n"
+        text_budget = remaining - count_tokens(header, GPT_MODEL)
+        if text_budget <= 0:
+            break
+        with open(path) as f:
+            section = header + fit_text(compact_text(f.read()), text_budget)
+        section_tokens = count_tokens(section, GPT_MODEL)
+        # token counts of the pieces don't add up exactly, never let the raw text push the prompt over
+        if prompt_tokens + section_tokens > token_budget:
+            continue
+        prompt += section
+        prompt_tokens += section_tokens
+
+    metrics.observe("reconcile_prompt_tokens", prompt_tokens, metrics.TOKEN_BUCKETS)
+    metrics.increment("reconcile_prematched_items_total", len(prematched))
+
+    return {
+        "prompt": prompt,
+        "prompt_tokens": prompt_tokens,
+        "prematched_items": prematched,
+        "invoice_data": invoice_data,
+        "delivery_data": delivery_data,
+    }
+
+def restore_local_results(parsed, context):
+    """
+    adds the locally matched lines and the original documents back into the model's result
+    """
+    parsed["matched_items"] = context["prematched_items"] + (parsed.get("matched_items") or [])
+    parsed["original_invoice_json"] = context["invoice_data"]
+    parsed["original_delivery_json"] = context["delivery_data"]
+    return parsed
+
+def merge_local_results(result, context):
+    """
+    restore_local_results for a free-form response, returning the response unchanged when it can't be parsed
+    """
+    try:
+        parsed, text_summary = split_gpt_output(result)
+    except Exception:
+        return result
+    return f"{json.dumps(restore_local_results(parsed, context), indent=2)}\n\n{text_summary}"
+
+def reconcile_with_gpt(invoice_json_path, delivery_json_path, invoice_txt_path, delivery_txt_path, token_budget=PROMPT_TOKEN_BUDGET):
+    try:
+        context = build_reconcile_prompt(invoice_json_path, delivery_json_path, invoice_txt_path, delivery_txt_path, token_budget)
+
+        with metrics.timer("gpt_reconcile"):
+            response = client.chat.completions.create(
+                model=GPT_MODEL,
+                messages=[{"role": "user", "content": context["prompt"]}],
+                temperature=GPT_TEMPERATURE
+            )
+        metrics.record_gpt_usage(response, GPT_MODEL, "gpt_reconcile")
+
         gpt_output = response.choices[0].message.content
-        return gpt_output
+        return merge_local_results(gpt_output, context)
 
     except Exception as e:
         return f"!! GPT reconciliation failed: {e}"
 
+def structured_result(result: ReconciliationResult, context):
+    parsed = result.model_dump()
+    text_summary = parsed.pop("explanation")
+    return restore_local_results(parsed, context), text_summary
+
+def reconcile_with_gpt_structured(invoice_json_path, delivery_json_path, invoice_txt_path, delivery_txt_path,
+                                  token_budget=PROMPT_TOKEN_BUDGET):
+    """
+    schema validated reconciliation, returns (parsed, text_summary) with no output scraping.
+    raises StructuredOutputError once the retries for invalid output are used up
+    """
+    context = build_reconcile_prompt(invoice_json_path, delivery_json_path, invoice_txt_path, delivery_txt_path, token_budget, True)
+    result = parse_structured(client, context["prompt"], GPT_MODEL, GPT_TEMPERATURE, ReconciliationResult, stage="gpt_reconcile")
+    return structured_result(result, context)
+
+async def reconcile_with_gpt_async(invoice_json_path, delivery_json_path, invoice_txt_path, delivery_txt_path, runner: AsyncGPTRunner,
+                                   token_budget=PROMPT_TOKEN_BUDGET):
+    """
+    async variant for reconciling many pairs concurrently, shares the runner's concurrency and rate limits
+    """
+    try:
+        context = build_reconcile_prompt(invoice_json_path, delivery_json_path, invoice_txt_path, delivery_txt_path, token_budget)
+        result = await runner.complete(context["prompt"], GPT_MODEL, GPT_TEMPERATURE, "gpt_reconcile")
+        return merge_local_results(result, context)
+    except Exception as e:
+        return f"!! GPT reconciliation failed: {e}"
+
+async def reconcile_with_gpt_structured_async(invoice_json_path, delivery_json_path, invoice_txt_path, delivery_txt_path,
+                                              runner: AsyncGPTRunner, token_budget=PROMPT_TOKEN_BUDGET):
+    context = build_reconcile_prompt(invoice_json_path, delivery_json_path, invoice_txt_path, delivery_txt_path, token_budget, True)
+    result = await runner.complete_structured(
+        context["prompt"], GPT_MODEL, GPT_TEMPERATURE, ReconciliationResult, stage="gpt_reconcile"
+    )
+    return structured_result(result, context)
+
+def text_path_for(parsed_path: Path) -> Path:
+    return parsed_path.with_name(parsed_path.name.replace("_parsed.json", "_text.txt"))
+
+def save_result(parsed, text_summary, invoice_data, delivery_data, delivery_label, reconciled_dir: Path) -> Path:
+    """
+    adds both documents' type/position and the reconciliation state to a GPT result, then writes
+    <invoice_number>_<status>.json and .txt. returns the json path
+    """
+    # stored under the parsed invoice number when there is one, so later dockets find the result again
+    parsed["invoice_number"] = invoice_data.get("invoice_number") or parsed.get("invoice_number")
+    parsed["source_doc_type"] = invoice_data.get("document_type", "unknown")
+    parsed["source_position"] = invoice_data.get("document_position", "unknown")
+    parsed["comparison_doc_type"] = delivery_data.get("document_type", "unknown")
+    parsed["comparison_position"] = delivery_data.get("document_position", "unknown")
+    # late dockets/credit notes are folded into this state locally (reconcile.py --apply), not sent to GPT again
+    parsed["reconciliation_state"] = build_state(invoice_data, parsed, [delivery_label])
+
+    invoice_number = (parsed.get("invoice_number") or "unknown").replace("/", "-")
+    base_name = f"{invoice_number}_{parsed.get('reconciliation_status', 'unknown')}"
+    with open(reconciled_dir / f"{base_name}.json", "w") as f:
+        json.dump(parsed, f, indent=2)
+    with open(reconciled_dir / f"{base_name}.txt", "w") as f:
+        f.write(text_summary)
+    return reconciled_dir / f"{base_name}.json"
+
+def pending_pair(group, reconciled_dir: Path):
+    """
+    what a (invoice_entry, [delivery_entries]) group still needs from GPT. the prompt compares two documents, so
+    an invoice without a stored result is reconciled against its first docket and everything else is folded in
+    locally. returns (stored result path, the delivery entry to send or None when GPT isn't needed)
+    """
+    (_, invoice_data), entries = group
+    previous_path = find_result_path(reconciled_dir, invoice_data.get("invoice_number"))
+    if load_stored_result(previous_path) is not None:
+        return previous_path, None
+    delivery = next(((path, doc) for path, doc in entries if doc.get("document_type") not in CREDIT_DOCUMENT_TYPES), None)
+    return previous_path, delivery
+
+def pair_paths(invoice_path: Path, delivery_path: Path):
+    return invoice_path, delivery_path, text_path_for(invoice_path), text_path_for(delivery_path)
+
+def finish_group(group, reconciled_dir: Path, previous_path, delivery=None, pair_result=None):
+    """
+    saves the (parsed, text_summary) GPT result for the group's delivery when there is one, then folds the group's
+    documents the stored result hasn't seen into it. returns the written result path, None when nothing changed
+    """
+    (_, invoice_data), entries = group
+    if pair_result is not None:
+        parsed, text_summary = pair_result
+        delivery_path, delivery_data = delivery
+        previous_path = save_result(
+            parsed, text_summary, invoice_data, delivery_data, document_label(delivery_path, delivery_data), reconciled_dir
+        )
+    stored = load_stored_result(previous_path)
+    if stored is None:
+        return None
+
+    seen = set(stored["reconciliation_state"]["documents"])
+    late = [(document_label(path, doc), doc) for path, doc in entries if document_label(path, doc) not in seen]
+    if late:
+        return write_result(reconciled_dir, apply_late_documents(stored, invoice_data, late), previous_path)
+    return previous_path if pair_result is not None else None
+
+def free_form_result(result):
+    # "!!" marks a failed call, raised so one group's failure is reported without losing the rest
+    if result.startswith("!!"):
+        raise RuntimeError(result)
+    return split_gpt_output(result)
+
+def reconcile_group(group, reconciled_dir: Path, token_budget=PROMPT_TOKEN_BUDGET, structured=False):
+    """
+    reconciles one (invoice_entry, [delivery_entries]) group, see pending_pair and finish_group.
+    returns the written result path, None when nothing changed
+    """
+    previous_path, delivery = pending_pair(group, reconciled_dir)
+    if delivery is None:
+        return finish_group(group, reconciled_dir, previous_path)
+    paths = pair_paths(group[0][0], delivery[0])
+    if structured:
+        pair_result = reconcile_with_gpt_structured(*paths, token_budget)
+    else:
+        pair_result = free_form_result(reconcile_with_gpt(*paths, token_budget))
+    return finish_group(group, reconciled_dir, previous_path, delivery, pair_result)
+
+async def reconcile_group_async(group, reconciled_dir: Path, runner: AsyncGPTRunner, token_budget=PROMPT_TOKEN_BUDGET,
+                                structured=False):
+    """
+    reconcile_group sharing the runner's concurrency and rate limits
+    """
+    previous_path, delivery = pending_pair(group, reconciled_dir)
+    if delivery is None:
+        return finish_group(group, reconciled_dir, previous_path)
+    paths = pair_paths(group[0][0], delivery[0])
+    if structured:
+        pair_result = await reconcile_with_gpt_structured_async(*paths, runner, token_budget)
+    else:
+        pair_result = free_form_result(await reconcile_with_gpt_async(*paths, runner, token_budget))
+    return finish_group(group, reconciled_dir, previous_path, delivery, pair_result)
+
+async def reconcile_batch_async(groups, reconciled_dir: Path, runner: AsyncGPTRunner = None, token_budget=PROMPT_TOKEN_BUDGET,
+                                structured=False, digest: DigestMailer = None):
+    """
+    reconciles many groups concurrently under the runner's concurrency and rate limits. each result is written,
+    logged to the sheet and mailed as soon as its response arrives. returns the written result paths
+    """
+    runner = runner or AsyncGPTRunner()
+
+    async def reconcile(group):
+        try:
+            return await reconcile_group_async(group, reconciled_dir, runner, token_budget, structured)
+        except Exception as e:
+            raise RuntimeError(f"{group[0][0].name}: {e}") from e
+
+    result_paths = []
+    for next_done in asyncio.as_completed([reconcile(group) for group in groups]):
+        try:
+            result_path = await next_done
+        except Exception as e:
+            print(f"❌ GPT reconciliation failed for {e}")
+            continue
+        if result_path is None:
+            continue
+        with open(result_path) as f:
+            parsed = json.load(f)
+        write_reconciliation_to_sheet(parsed)
+        summary_path = result_path.with_suffix(".txt")
+        send_email(
+            subject=f"Testing Email Logic: Discrepancy in Invoice {parsed.get('invoice_number', 'Unknown')}",
+            body="Reconciliation discrepancies found. Please see attached summary.",
+            attachment_path=summary_path if summary_path.exists() else None,
+            digest=digest
+        )
+        print(f"✅ Reconciled {result_path.name}")
+        result_paths.append(result_path)
+    return result_paths
+
 def clean_gpt_summary(raw_text):
     lines = raw_text.strip().splitlines()
     clean_lines = []
@@ -124,35 +474,57 @@ def clean_gpt_summary(raw_text):
 
     return "\n".join(clean_lines).strip()
 
-def send_email(subject, body, attachment_path=None):
-    user = os.getenv("EMAIL_USER")
-    password = os.getenv("EMAIL_PASS")
-    to_email = os.getenv("EMAIL_RECEIVER")
-
-    msg = EmailMessage()
-    msg["Subject"] = subject
-    msg["From"] = user
-    msg["To"] = to_email
-    msg.set_content(body)
-
-    if attachment_path and os.path.exists(attachment_path):
-        with open(attachment_path, "rb") as f:
-            file_data = f.read()
-            file_name = os.path.basename(attachment_path)
-            msg.add_attachment(file_data, maintype="application", subtype="octet-stream", filename=file_name)
-
+def split_gpt_output(result):
+    """
+    splits a gpt reconciliation response into its json result and the trailing text summary,
+    raises ValueError/JSONDecodeError when no json object can be found
+    """
+    json_start = result.find("{")
+    json_end = result.rfind("}") + 1
+    if json_start == -1 or json_end == 0:
+        raise ValueError("no json object in GPT output")
+    parsed = json.loads(result[json_start:json_end])
+    return parsed, clean_gpt_summary(result[json_end:])
+
+def send_email(subject, body, attachment_path=None, digest: DigestMailer = None):
+    """
+    sends over the shared smtp session, or queues into the digest when one is given
+    """
+    if digest is not None:
+        digest.add(subject, body, attachment_path)
+        print(f"📧 Queued for digest: {subject}")
+        return
+
+    mailer = get_default_mailer()
     try:
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as smtp:
-            smtp.login(user, password)
-            smtp.send_message(msg)
-        print(f"📧 Email sent to {to_email}")
+        mailer.send(subject, body, [attachment_path] if attachment_path else [])
+        print(f"📧 Email sent to {mailer.recipient}")
     except Exception as e:
         print(f"❌ Failed to send email: {e}")
 
-def main():
+def send_digest(digest: DigestMailer):
+    try:
+        count = digest.flush()
+        if count:
+            print(f"📧 Digest with {count} reconciliation(s) sent to {digest.mailer.recipient}")
+    except Exception as e:
+        print(f"❌ Failed to send digest email: {e}")
+
+def main(argv=None):
+    metrics.configure()
     parser = argparse.ArgumentParser()
     parser.add_argument("--source", choices=["uploads", "inbox"], default="uploads")
-    args = parser.parse_args()
+    parser.add_argument("--digest", action="store_true", help="send one summary email for the run instead of one per reconciliation")
+    parser.add_argument("--token-budget", type=int, default=PROMPT_TOKEN_BUDGET, help="max reconciliation prompt tokens")
+    parser.add_argument("--structured", action="store_true", help="use schema validated structured outputs")
+    parser.add_argument("--batch", action="store_true",
+                        help="reconcile every invoice group in the parsed dir concurrently instead of the two sample documents")
+    parser.add_argument("--concurrency", type=int, default=8, help="max in-flight GPT requests in batch mode")
+    parser.add_argument("--rpm", type=int, default=500, help="GPT requests per minute limit in batch mode")
+    parser.add_argument("--tpm", type=int, default=30000, help="GPT tokens per minute limit in batch mode")
+    args = parser.parse_args(argv)
+
+    digest = DigestMailer(get_default_mailer()) if args.digest else None
 
     base_dir = Path("local_src_gpt_output") if args.source == "uploads" else Path("email_src_gpt_output")
     parsed_dir = base_dir / "parsed"
@@ -162,18 +534,42 @@ def main():
     parsed_dir.mkdir(parents=True, exist_ok=True)
     reconciled_dir.mkdir(parents=True, exist_ok=True)
 
+    if args.batch:
+        groups, unmatched = group_documents(load_parsed_documents(parsed_dir))
+        runner = AsyncGPTRunner(concurrency=args.concurrency, rpm=args.rpm, tpm=args.tpm)
+        result_paths = asyncio.run(reconcile_batch_async(
+            groups, reconciled_dir, runner, args.token_budget, args.structured, digest
+        ))
+        print(f"✅ Reconciled {len(result_paths)} invoices, results saved to {reconciled_dir}")
+        if unmatched:
+            print(f"⚠️  {len(unmatched)} documents have no counterpart yet: {', '.join(path.name for path, _ in unmatched)}")
+        if digest is not None:
+            send_digest(digest)
+        return
+
     invoice_json_path = parsed_dir / "invoice_parsed.json"
     delivery_json_path = parsed_dir / "source_parsed.json"
     invoice_txt_path = parsed_dir / "invoice_text.txt"
     delivery_txt_path = parsed_dir / "source_text.txt"
 
-    result = reconcile_with_gpt(invoice_json_path, delivery_json_path, invoice_txt_path, delivery_txt_path)
+    if args.structured:
+        try:
+            parsed, text_summary = reconcile_with_gpt_structured(
+                invoice_json_path, delivery_json_path, invoice_txt_path, delivery_txt_path, args.token_budget
+            )
+        except Exception as e:
+            print(f"❌ Structured GPT reconciliation failed: {e}")
+            return
+        result = json.dumps(parsed, indent=2)
+    else:
+        result = reconcile_with_gpt(invoice_json_path, delivery_json_path, invoice_txt_path, delivery_txt_path, args.token_budget)
+        if result.startswith("!!"):
+            print(f"❌ {result[3:]}")
+            return
 
     try:
-        json_start = result.find("{")
-        json_end = result.rfind("}") + 1
-        json_str = result[json_start:json_end]
-        parsed = json.loads(json_str)
+        if not args.structured:
+            parsed, text_summary = split_gpt_output(result)
         
           # Read original document metadata
         with open(invoice_json_path) as f:
@@ -181,25 +577,11 @@ def main():
         with open(delivery_json_path) as f:
             delivery_data = json.load(f)
 
-        # Add doc type and position to parsed result
-        parsed["source_doc_type"] = invoice_data.get("document_type", "unknown")
-        parsed["source_position"] = invoice_data.get("document_position", "unknown")
-        parsed["comparison_doc_type"] = delivery_data.get("document_type", "unknown")
-        parsed["comparison_position"] = delivery_data.get("document_position", "unknown")
-
-        invoice_number = parsed.get("invoice_number", "unknown").replace("/", "-")
-        status = parsed.get("reconciliation_status", "unknown")
-        base_name = f"{invoice_number}_{status}"
-
-        # save json
-        with open(reconciled_dir / f"{base_name}.json", "w") as f:
-            json.dump(parsed, f, indent=2)
-
-        # save txt
-        raw_text_summary = result[json_end:]
-        text_summary = clean_gpt_summary(raw_text_summary)
-        with open(reconciled_dir / f"{base_name}.txt", "w") as f:
-            f.write(text_summary)
+        # Add doc types, positions and reconciliation state, then save json + txt
+        json_path = save_result(
+            parsed, text_summary, invoice_data, delivery_data, document_label(delivery_json_path, delivery_data), reconciled_dir
+        )
+        base_name = json_path.stem
 
         print(f"✅ Reconciliation complete. Saved:\n- {base_name}.json\n- {base_name}.txt")
 
@@ -210,7 +592,8 @@ def main():
         send_email(
             subject=f"Testing Email Logic: Discrepancy in Invoice {parsed.get('invoice_number', 'Unknown')}",
             body="Reconciliation discrepancies found. Please see attached summary.",
-            attachment_path=reconciled_dir / f"{base_name}.txt"
+            attachment_path=reconciled_dir / f"{base_name}.txt",
+            digest=digest
         )
             
     except Exception as e:
@@ -219,5 +602,8 @@ def main():
             f.write(str(result))
         print("⚠️ GPT output not parsable. Raw output saved:", fallback_path)
 
+    if digest is not None:
+        send_digest(digest)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,155 @@
+from pathlib import Path
+import json
+import re
+import argparse
+from functools import partial
+from parse_pdfs import extract_and_parse, parse_pdf_file, clean_text, write_to_file, PARSER_VERSION
+from utils.batch_utils import resolve_pdf_paths, run_in_pool, default_worker_count
+from utils.document_matcher import get_document_index
+from utils.extraction_cache import ExtractionCache
+from utils.gpt_cache import GPTResponseCache
+from utils import metrics
+
+# documents scoring below this are escalated to GPT
+CONFIDENCE_THRESHOLD = 0.8
+
+# how much each completeness check contributes to the confidence score
+CHECK_WEIGHTS = {
+    "invoice_number": 0.3,
+    "supplier_name": 0.15,
+    "line_items": 0.35,
+    "totals_consistent": 0.2,
+}
+
+SUBTOTAL_PATTERN = re.compile(r"Sub\s*total:\s*\$?([\d,]+(?:\.\d+)?)", re.IGNORECASE)
+
+def totals_consistent(parsed, text, tolerance=0.01):
+    """
+    True/False when the priced line items can be checked against the document subtotal, None when they can't
+    """
+    items = parsed.get("line_items", [])
+    if not items or any("unit_price" not in item for item in items):
+        return None
+    match = SUBTOTAL_PATTERN.search(text)
+    if not match:
+        return None
+    subtotal = float(match.group(1).replace(",", ""))
+    line_sum = sum(item["quantity"] * item["unit_price"] for item in items)
+    return abs(line_sum - subtotal) <= max(tolerance, subtotal * tolerance)
+
+def score_native_result(parsed, text):
+    """
+    scores how complete a native parse is, checks that don't apply (e.g. totals on a docket) are left out
+    """
+    checks = {
+        "invoice_number": bool(parsed.get("invoice_number")),
+        "supplier_name": bool(parsed.get("supplier_name")),
+        "line_items": bool(parsed.get("line_items")),
+        "totals_consistent": totals_consistent(parsed, text),
+    }
+    applicable = {name: passed for name, passed in checks.items() if passed is not None}
+    total_weight = sum(CHECK_WEIGHTS[name] for name in applicable)
+    score = sum(CHECK_WEIGHTS[name] for name, passed in applicable.items() if passed) / total_weight
+    return round(score, 3), checks
+
+def route_document(text, native_json, threshold=CONFIDENCE_THRESHOLD, response_cache=None):
+    """
+    keeps the native result when it is confident enough, otherwise escalates to GPT.
+    the routing decision is recorded on the result under parse_route
+    """
+    confidence, checks = score_native_result(native_json, text)
+    route = {"method": "native", "confidence": confidence, "threshold": threshold, "checks": checks}
+
+    if confidence >= threshold:
+        native_json["parse_route"] = route
+        return native_json
+
+    # only loaded when needed, gpt_parse builds an api client at import
+    from gpt_parse import parse_with_gpt
+    gpt_json = parse_with_gpt(clean_text(text), response_cache)
+    if not gpt_json:
+        route["gpt_failed"] = True
+        native_json["parse_route"] = route
+        return native_json
+
+    gpt_json["document_position"] = native_json.get("document_position")
+    # keep the type the native pass detected, grouping and reconciliation key off it
+    gpt_json["document_type"] = native_json.get("document_type")
+    route["method"] = "gpt"
+    gpt_json["parse_route"] = route
+    return gpt_json
+
+def run_batch(pdf_paths, output, workers=None, chunksize=4, cache=None, threshold=CONFIDENCE_THRESHOLD, response_cache=None):
+    """
+    native extraction + parse across a process pool, escalating only low confidence documents to GPT
+    """
+    counts = {"native": 0, "gpt": 0}
+    index = get_document_index(output)
+    worker = partial(parse_pdf_file, cache=cache)
+    for pdf_path, text, native_json in run_in_pool(worker, pdf_paths, workers, chunksize):
+        parsed = route_document(text, native_json, threshold, response_cache)
+        parsed["source_file"] = pdf_path.name
+        counts[parsed["parse_route"]["method"]] += 1
+        metrics.increment("hybrid_routes_total", route=parsed["parse_route"]["method"])
+
+        parsed_path = output / f"{pdf_path.stem}_parsed.json"
+        write_to_file(text, output / f"{pdf_path.stem}_text.txt")
+        write_to_file(json.dumps(parsed, indent=2), parsed_path)
+        index.add(parsed_path, parsed)
+    return counts
+
+def main(argv=None):
+    metrics.configure()
+    uploads = Path("uploads")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", choices=["uploads", "inbox"], default="uploads")
+    parser.add_argument("--input", help="directory or glob of pdfs to parse in batch mode")
+    parser.add_argument("--workers", type=int, default=default_worker_count(), help="batch worker processes")
+    parser.add_argument("--chunksize", type=int, default=4, help="pdfs handed to a worker at a time")
+    parser.add_argument("--threshold", type=float, default=CONFIDENCE_THRESHOLD, help="min native confidence to skip GPT")
+    parser.add_argument("--no-cache", action="store_true", help="always re-extract, ignoring the extraction cache")
+    parser.add_argument("--no-gpt-cache", action="store_true", help="always call GPT for escalated documents")
+    args = parser.parse_args(argv)
+
+    cache = None if args.no_cache else ExtractionCache(PARSER_VERSION)
+    response_cache = None if args.no_gpt_cache else GPTResponseCache()
+
+    base_dir = Path("local_src_hybrid_output") if args.source == "uploads" else Path("email_src_hybrid_output")
+    output = base_dir / "parsed"
+    output.mkdir(parents=True, exist_ok=True)
+
+    if args.input:
+        pdf_paths = resolve_pdf_paths(args.input)
+        if not pdf_paths:
+            print(f"!! no pdf files found for {args.input}")
+            return
+        counts = run_batch(pdf_paths, output, args.workers, args.chunksize, cache, args.threshold, response_cache)
+        if cache:
+            cache.evict()
+        print(f"✅ batch parsed {sum(counts.values())} files ({counts['native']} native, {counts['gpt']} via GPT) saved to {output}")
+        return
+
+    invoice_path = uploads / "sample_invoice.pdf"
+    source_path = uploads / "sample_delivery_docket.pdf"
+
+    if not invoice_path.exists() or not source_path.exists():
+        print("!! one or both pdf files are missing.")
+        return
+
+    index = get_document_index(output)
+    for pdf_path, label, name in ((invoice_path, "first_document", "invoice"), (source_path, "second_document", "source")):
+        text, native_json = extract_and_parse(pdf_path, label, cache)
+        parsed = route_document(text, native_json, args.threshold, response_cache)
+        route = parsed["parse_route"]
+        print(f"🔀 {pdf_path.name}: {route['method']} (confidence {route['confidence']})")
+
+        write_to_file(text, output / f"{name}_text.txt")
+        write_to_file(json.dumps(parsed, indent=2), output / f"{name}_parsed.json")
+        index.add(output / f"{name}_parsed.json", parsed)
+
+    if cache:
+        cache.evict()
+    print(f"✅ extracted and parsed files saved to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,16 @@
 import argparse
+import asyncio
 from pathlib import Path
 from dotenv import load_dotenv
-from utils.email_utils import fetch_relevant_pdf_attachments
-from utils.document_matcher import find_matching_document
-from gpt_parse import main as gpt_parse_main
-from gpt_reconcile import main as gpt_reconcile_main
-from parse_pdfs import main as native_parse_main
-from reconcile import main as native_reconcile_main
+from utils.email_utils import sync_pdf_attachments
+from gpt_parse import main as gpt_parse_main, run_batch as gpt_parse_batch
+from gpt_reconcile import main as gpt_reconcile_main, reconcile_batch_async, send_digest
+from parse_pdfs import main as native_parse_main, run_batch as native_parse_batch
+from hybrid_parse import main as hybrid_parse_main, run_batch as hybrid_parse_batch
+from reconcile import main as native_reconcile_main, reconcile_parsed_groups
+from utils.document_matcher import group_documents, load_parsed_documents
+from utils.mailer import DigestMailer, get_default_mailer
+from utils.price_checks import SupplierPriceHistory
 
 load_dotenv()
 
@@ -18,32 +22,84 @@ def determine_output_dirs(source: str, method: str):
     reconciled_dir.mkdir(parents=True, exist_ok=True)
     return parsed_dir, reconciled_dir
 
+def reconcile_inbox(method: str, parsed_dir: Path, reconciled_dir: Path, price_history: bool = True, digest: bool = False):
+    """
+    parses every synced attachment, then reconciles each invoice against all dockets sharing its
+    invoice number/job code, however many there are and in whatever order they arrived
+    """
+    paths = sync_pdf_attachments(Path("email_uploads"))
+    if len(paths) < 1:
+        print("No PDFs matched in email inbox.")
+        return
+
+    batch_parsers = {"gpt": gpt_parse_batch, "native": native_parse_batch, "hybrid": hybrid_parse_batch}
+    batch_parsers[method](paths, parsed_dir)
+
+    # only groups gaining a new document are reconciled, earlier attachments are already in parsed_dir
+    changed = [parsed_dir / f"{path.stem}_parsed.json" for path in paths]
+    if method == "gpt":
+        result_paths, unmatched = reconcile_inbox_gpt(parsed_dir, reconciled_dir, changed, digest)
+    else:
+        history = SupplierPriceHistory() if price_history else None
+        try:
+            result_paths, unmatched = reconcile_parsed_groups(parsed_dir, reconciled_dir, history=history, changed=changed)
+        finally:
+            if history:
+                history.close()
+    print(f"✅ Reconciled {len(result_paths)} invoices, results saved to {reconciled_dir}")
+    if unmatched:
+        print(f"⚠️  {len(unmatched)} documents have no counterpart yet: {', '.join(path.name for path, _ in unmatched)}")
+
+def reconcile_inbox_gpt(parsed_dir: Path, reconciled_dir: Path, changed, digest: bool = False):
+    """
+    reconciles the groups containing a changed parsed file with GPT, writing sheet rows and mailing each result.
+    returns (result paths, unmatched documents)
+    """
+    changed = {Path(path).name for path in changed}
+    groups, unmatched = group_documents(load_parsed_documents(parsed_dir))
+    groups = [
+        (invoice, deliveries) for invoice, deliveries in groups
+        if any(path.name in changed for path, _ in [invoice, *deliveries])
+    ]
+    digest_mailer = DigestMailer(get_default_mailer()) if digest else None
+    result_paths = asyncio.run(reconcile_batch_async(groups, reconciled_dir, digest=digest_mailer))
+    if digest_mailer is not None:
+        send_digest(digest_mailer)
+    return result_paths, unmatched
+
 def main():
     parser = argparse.ArgumentParser(description="Run document parsing and reconciliation.")
     parser.add_argument("--source", choices=["uploads", "inbox"], default="uploads", help="PDF input source")
-    parser.add_argument("--method", choices=["gpt", "native"], default="gpt", help="Processing method")
+    parser.add_argument("--method", choices=["gpt", "native", "hybrid"], default="gpt", help="Processing method (hybrid: native first, GPT only for low confidence documents)")
+    parser.add_argument("--no-cache", action="store_true", help="always re-extract, ignoring the extraction cache")
+    parser.add_argument("--no-gpt-cache", action="store_true", help="always call GPT, ignoring cached responses")
+    parser.add_argument("--threshold", type=float, help="hybrid: min native confidence to skip GPT")
+    parser.add_argument("--no-price-history", action="store_true", help="native reconcile: skip supplier price drift checks")
+    parser.add_argument("--digest", action="store_true", help="gpt reconcile: send one summary email for the run")
     args = parser.parse_args()
 
     parsed_dir, reconciled_dir = determine_output_dirs(args.source, args.method)
 
-    if args.source == "uploads":
-        uploads_dir = Path("uploads")
-        invoice_pdf = uploads_dir / "sample_invoice.pdf"
-        delivery_pdf = uploads_dir / "sample_delivery_docket.pdf"
-    else:
-        paths = fetch_relevant_pdf_attachments(Path("email_uploads"))
-        if len(paths) < 1:
-            print("No PDFs matched in email inbox.")
-            return
-        invoice_pdf = paths[0]
-        delivery_pdf = paths[1] if len(paths) > 1 else None
+    if args.source == "inbox":
+        reconcile_inbox(args.method, parsed_dir, reconciled_dir, not args.no_price_history, args.digest)
+        return
+
+    # each step parses its own options, so only forward the ones it accepts
+    source = ["--source", args.source]
+    no_cache = ["--no-cache"] if args.no_cache else []
+    no_gpt_cache = ["--no-gpt-cache"] if args.no_gpt_cache else []
+    reconcile_argv = source + ["--method", args.method] + (["--no-price-history"] if args.no_price_history else [])
 
     if args.method == "gpt":
-        gpt_parse_main()
-        gpt_reconcile_main()
+        gpt_parse_main(source + no_cache + no_gpt_cache)
+        gpt_reconcile_main(source + (["--digest"] if args.digest else []))
+    elif args.method == "hybrid":
+        threshold = ["--threshold", str(args.threshold)] if args.threshold is not None else []
+        hybrid_parse_main(source + no_cache + no_gpt_cache + threshold)
+        native_reconcile_main(reconcile_argv)
     else:
-        native_parse_main()
-        native_reconcile_main()
+        native_parse_main(source + no_cache)
+        native_reconcile_main(reconcile_argv)
 
 if __name__ == "__main__":
     main()
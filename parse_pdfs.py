@@ -1,17 +1,42 @@
 from pathlib import Path
 import pymupdf
 import json
-import re
 import unicodedata
 import argparse
-from utils.email_utils import fetch_relevant_pdf_attachments
+from functools import partial
+from utils.document_matcher import get_document_index
+from utils.batch_utils import resolve_pdf_paths, run_in_pool, default_worker_count
+from utils.extraction_cache import ExtractionCache
+from utils.supplier_templates import select_template
+from utils.layout_extract import extract_layout_line_items
+from utils.ocr import extract_page_texts, page_needs_ocr, ocr_page
+from utils.document_types import detect_document_type
+from utils import metrics
 
+# bump whenever extraction or parsing output changes so stale cache entries are ignored
+PARSER_VERSION = "native-8"
+
+def iter_page_texts(pdf_path):
+    """
+    yields each page's text lazily, the document is closed as soon as iteration finishes or the generator is closed.
+    scanned pages are OCR'd inline so streaming keeps one page in memory
+    """
+    with pymupdf.open(pdf_path) as doc:
+        for page in doc:
+            text = page.get_text()
+            yield ocr_page(page) if page_needs_ocr(page, text) else text
+
+@metrics.timer("extract", method="native")
 def extract_text(pdf_path):
+    """
+    returns (text, unread): unread lists scanned pages OCR produced no text for
+    """
     try:
-        doc = pymupdf.open(pdf_path)
-        return "\n".join(page.get_text() for page in doc).strip()
+        # scanned pages are OCR'd in parallel rather than one at a time
+        texts, unread = extract_page_texts(pdf_path)
+        return "\n".join(texts).strip(), unread
     except Exception as e:
-        return f"error reading {pdf_path}: {e}"
+        return f"error reading {pdf_path}: {e}", []
 
 def clean_text(text):
     return unicodedata.normalize("NFKC", text).replace("\u200b", "").strip()
@@ -20,79 +45,214 @@ def write_to_file(content, out_path):
     out_path.parent.mkdir(parents=True, exist_ok=True)
     out_path.write_text(content, encoding="utf-8")
 
-def detect_document_type(text):
-    lowered = text.lower()
-    if "delivery docket" in lowered:
-        return "delivery_docket"
-    elif "purchase confirmation" in lowered:
-        return "purchase_confirmation"
-    elif "invoice" in lowered:
-        return "invoice"
-    else:
-        return "unknown"
+class PageStreamParser:
+    """
+    incremental version of the native parser, fed one page of text at a time.
+    the supplier template is picked from the first page, each page is scanned in a single pass,
+    and once every header field is found later pages are only scanned for line items,
+    so memory is bounded by the largest page rather than the whole document
+    """
 
-def parse_metadata_and_line_items(text, position_label):
-    result = {
-        "invoice_number": None,
-        "supplier_name": None,
-        "job_code": None,
-        "line_items": [],
-        "document_type": detect_document_type(text),
-        "document_position": position_label
-    }
-
-    match = re.search(r"Supplier:\s*(.+)", text)
-    result["supplier_name"] = clean_text(match.group(1)) if match else None
-
-    invoice_patterns = [
-        r"Invoice\s+(?:Number|No\.?):\s*(INV-\d+)",
-        r"\b(INV-\d+)\b"
-    ]
-    for pattern in invoice_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            result["invoice_number"] = clean_text(match.group(1 if match.lastindex else 0))
-            break
-
-    match = re.search(r"Job Code:\s*(\S+)", text)
-    result["job_code"] = clean_text(match.group(1)) if match else None
-
-    invoice_item_pattern = re.compile(
-        r"\d+\.\s*(.*?)\s*\|\s*Qty:\s*(\d+)\s*\|\s*Unit Price:\s*\$?([\d.]+)", re.IGNORECASE
-    )
-    delivery_item_pattern = re.compile(
-        r"\d+\.\s*(.*?)\s*\|\s*Qty:\s*(\d+)", re.IGNORECASE
-    )
-
-    matches = invoice_item_pattern.findall(text)
-    if matches:
-        for match in matches:
-            description, qty, price = match
-            result["line_items"].append({
-                "description": description.strip(),
-                "quantity": int(qty),
-                "unit_price": float(price)
+    def __init__(self, position_label):
+        self.position_label = position_label
+        self.template = None
+        self.supplier_name = None
+        self.job_code = None
+        self.labelled_invoice_number = None
+        self.bare_invoice_number = None
+        self.seen_types = set()
+        self.invoice_items = []
+        self.delivery_items = []
+
+    def headers_complete(self):
+        # a labelled invoice number makes any bare INV-123 mention irrelevant
+        return None not in (self.supplier_name, self.job_code, self.labelled_invoice_number)
+
+    def feed(self, text):
+        if self.template is None:
+            self.template = select_template(text)
+
+        if "delivery docket" not in self.seen_types:
+            lowered = text.lower()
+            for marker in ("delivery docket", "purchase confirmation", "credit note", "invoice"):
+                if marker in lowered:
+                    self.seen_types.add(marker)
+
+        scanner = self.template.item_scanner if self.headers_complete() else self.template.scanner
+        for match in scanner.finditer(text):
+            fields = match.groupdict()
+            if fields.get("description") is not None:
+                self._add_item(fields)
+            elif fields.get("supplier_name") is not None:
+                self.supplier_name = self.supplier_name or clean_text(fields["supplier_name"])
+            elif fields.get("invoice_number") is not None:
+                self.labelled_invoice_number = self.labelled_invoice_number or clean_text(fields["invoice_number"])
+            elif fields.get("bare_invoice_number") is not None:
+                self.bare_invoice_number = self.bare_invoice_number or clean_text(fields["bare_invoice_number"])
+            elif fields.get("job_code") is not None:
+                self.job_code = self.job_code or clean_text(fields["job_code"])
+
+    def _add_item(self, fields):
+        if fields.get("unit_price") is not None:
+            self.invoice_items.append({
+                "description": fields["description"].strip(),
+                "quantity": int(fields["quantity"]),
+                "unit_price": float(fields["unit_price"])
             })
-    else:
-        for match in delivery_item_pattern.findall(text):
-            description, qty = match
-            result["line_items"].append({
-                "description": description.strip(),
-                "quantity": int(qty)
+        elif not self.invoice_items:
+            # delivery style lines are only used when the document has no priced lines at all
+            self.delivery_items.append({
+                "description": fields["description"].strip(),
+                "quantity": int(fields["quantity"])
             })
 
-    return result
+    def document_type(self):
+        if "delivery docket" in self.seen_types:
+            return "delivery_docket"
+        elif "purchase confirmation" in self.seen_types:
+            return "purchase_confirmation"
+        elif "credit note" in self.seen_types:
+            return "credit_note"
+        elif "invoice" in self.seen_types:
+            return "invoice"
+        return "unknown"
+
+    def result(self):
+        return {
+            "invoice_number": self.labelled_invoice_number or self.bare_invoice_number,
+            "supplier_name": self.supplier_name,
+            "job_code": self.job_code,
+            "line_items": self.invoice_items or self.delivery_items,
+            "document_type": self.document_type(),
+            "document_position": self.position_label
+        }
+
+@metrics.timer("native_parse")
+def parse_metadata_and_line_items(text, position_label):
+    parser = PageStreamParser(position_label)
+    parser.feed(text)
+    return parser.result()
 
-def main():
+def add_layout_line_items(pdf_path, parsed):
+    """
+    tabular layouts don't match the text patterns, so fall back to reading line items from page geometry
+    """
+    if parsed["line_items"]:
+        return parsed
+    try:
+        with metrics.timer("layout_extract"):
+            parsed["line_items"] = extract_layout_line_items(pdf_path)
+    except Exception as e:
+        print(f"!! layout extraction failed for {pdf_path}: {e}")
+    return parsed
+
+def stream_extract_and_parse(pdf_path, position_label, text_out_path):
+    """
+    streaming mode for very large pdfs: pages are parsed and appended to text_out_path one at a time,
+    the full document text is never held in memory
+    """
+    parser = PageStreamParser(position_label)
+    text_out_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(text_out_path, "w", encoding="utf-8") as out:
+        try:
+            for page_number, page_text in enumerate(iter_page_texts(pdf_path)):
+                if page_number:
+                    out.write("\n")
+                out.write(page_text)
+                parser.feed(page_text)
+        except Exception as e:
+            out.write(f"error reading {pdf_path}: {e}")
+    return add_layout_line_items(pdf_path, parser.result())
+
+def stream_parse_pdf_file(pdf_path, output):
+    """
+    batch worker for streaming mode, writes the text file itself so page text never crosses process boundaries
+    """
+    pdf_path = Path(pdf_path)
+    parsed = stream_extract_and_parse(pdf_path, "batch_document", output / f"{pdf_path.stem}_text.txt")
+    parsed["source_file"] = pdf_path.name
+    return pdf_path, None, parsed
+
+def extract_and_parse(pdf_path, position_label, cache=None):
+    """
+    extracts + parses a pdf, served from the extraction cache when the file bytes were seen before
+    """
+    key = None
+    if cache:
+        key = cache.key_for(pdf_path)
+        entry = cache.get(key)
+        metrics.increment("extraction_cache_total", method="native", result="hit" if entry else "miss")
+        if entry:
+            parsed = entry["parsed"]
+            parsed["document_position"] = position_label
+            return entry["text"], parsed
+
+    text, unread = extract_text(pdf_path)
+    parsed = add_layout_line_items(pdf_path, parse_metadata_and_line_items(text, position_label))
+
+    # never cache extraction failures, or scans OCR couldn't read (tesseract may be fixed by the next run)
+    if cache and not text.startswith("error reading") and not unread:
+        cache.put(key, {"text": text, "parsed": parsed})
+    return text, parsed
+
+def parse_pdf_file(pdf_path, cache=None):
+    """
+    extracts + parses a single pdf, this is the unit of work handed to each batch worker process
+    """
+    pdf_path = Path(pdf_path)
+    text, parsed = extract_and_parse(pdf_path, "batch_document", cache)
+    parsed["source_file"] = pdf_path.name
+    return pdf_path, text, parsed
+
+def run_batch(pdf_paths, output, workers=None, chunksize=4, cache=None, stream=False):
+    """
+    parses every pdf across a process pool, writing one text + parsed json file per input
+    """
+    count = 0
+    index = get_document_index(output)
+    if stream:
+        worker = partial(stream_parse_pdf_file, output=output)
+    else:
+        worker = partial(parse_pdf_file, cache=cache)
+    for pdf_path, text, parsed in run_in_pool(worker, pdf_paths, workers, chunksize):
+        parsed_path = output / f"{pdf_path.stem}_parsed.json"
+        if text is not None:
+            write_to_file(text, output / f"{pdf_path.stem}_text.txt")
+        write_to_file(json.dumps(parsed, indent=2), parsed_path)
+        index.add(parsed_path, parsed)
+        metrics.increment("documents_parsed_total", method="native", document_type=parsed.get("document_type"))
+        count += 1
+    return count
+
+def main(argv=None):
+    metrics.configure()
     uploads = Path("uploads")
     parser = argparse.ArgumentParser()
     parser.add_argument("--source", choices=["uploads", "inbox"], default="uploads")
-    args = parser.parse_args()
+    parser.add_argument("--input", help="directory or glob of pdfs to parse in batch mode")
+    parser.add_argument("--workers", type=int, default=default_worker_count(), help="batch worker processes")
+    parser.add_argument("--chunksize", type=int, default=4, help="pdfs handed to a worker at a time")
+    parser.add_argument("--no-cache", action="store_true", help="always re-extract, ignoring the extraction cache")
+    parser.add_argument("--stream", action="store_true", help="parse page by page for very large pdfs (bypasses the cache)")
+    args = parser.parse_args(argv)
+
+    cache = None if args.no_cache or args.stream else ExtractionCache(PARSER_VERSION)
 
     base_dir = Path("local_src_native_output") if args.source == "uploads" else Path("email_src_native_output")
     output = base_dir / "parsed"
     output.mkdir(parents=True, exist_ok=True)
 
+    if args.input:
+        pdf_paths = resolve_pdf_paths(args.input)
+        if not pdf_paths:
+            print(f"!! no pdf files found for {args.input}")
+            return
+        count = run_batch(pdf_paths, output, args.workers, args.chunksize, cache, args.stream)
+        if cache:
+            cache.evict()
+        print(f"✅ batch parsed {count} files saved to {output}")
+        return
+
     invoice_path = uploads / "sample_invoice.pdf"
     source_path = uploads / "sample_delivery_docket.pdf"
 
@@ -100,18 +260,23 @@ def main():
         print("!! one or both pdf files are missing.")
         return
 
-    invoice_text = extract_text(invoice_path)
-    source_text = extract_text(source_path)
-
-    write_to_file(invoice_text, output / "invoice_text.txt")
-    write_to_file(source_text, output / "source_text.txt")
+    if args.stream:
+        invoice_json = stream_extract_and_parse(invoice_path, "first_document", output / "invoice_text.txt")
+        source_json = stream_extract_and_parse(source_path, "second_document", output / "source_text.txt")
+    else:
+        invoice_text, invoice_json = extract_and_parse(invoice_path, "first_document", cache)
+        source_text, source_json = extract_and_parse(source_path, "second_document", cache)
 
-    invoice_json = parse_metadata_and_line_items(invoice_text, "first_document")
-    source_json = parse_metadata_and_line_items(source_text, "second_document")
+        write_to_file(invoice_text, output / "invoice_text.txt")
+        write_to_file(source_text, output / "source_text.txt")
 
-    write_to_file(json.dumps(invoice_json, indent=2), output / "invoice_parsed.json")
-    write_to_file(json.dumps(source_json, indent=2), output / "source_parsed.json")
+    index = get_document_index(output)
+    for name, parsed in (("invoice", invoice_json), ("source", source_json)):
+        write_to_file(json.dumps(parsed, indent=2), output / f"{name}_parsed.json")
+        index.add(output / f"{name}_parsed.json", parsed)
 
+    if cache:
+        cache.evict()
     print("✅ extracted and parsed files saved to /output")
 
 if __name__ == "__main__":
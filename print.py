@@ -1,15 +1,21 @@
 from pathlib import Path
-import pymupdf
+from parse_pdfs import iter_page_texts
 
-def extract_text(pdf_path):
+def print_pages(pdf_path):
+    """
+    prints page by page so large pdfs are never held in memory as one string
+    """
+    printed = False
     try:
-        doc = pymupdf.open(pdf_path)
-        text = ""
-        for page in doc:
-            text += page.get_text()
-        return text.strip()
+        for page_text in iter_page_texts(pdf_path):
+            if page_text.strip():
+                print(page_text.rstrip())
+                printed = True
     except Exception as e:
-        return f"❌ Error reading {pdf_path}: {e}"
+        print(f"❌ Error reading {pdf_path}: {e}")
+        return
+    if not printed:
+        print("[no text found]")
 
 def main():
     invoice_path = Path("uploads") / "sample_invoice.pdf"
@@ -21,14 +27,12 @@ def main():
         return
 
     print(f"\n📄 reading: {invoice_path.name}")
-    invoice_text = extract_text(invoice_path)
-    print(invoice_text or "[no text found]")
+    print_pages(invoice_path)
 
     print("\n" + "=" * 80 + "\n") 
 
     print(f"📄 reading: {source_path.name}")
-    source_text = extract_text(source_path)
-    print(source_text or "[no text found]")
+    print_pages(source_path)
 
 if __name__ == "__main__":
     main()
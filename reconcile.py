@@ -1,29 +1,34 @@
 import json
 from pathlib import Path
-from difflib import SequenceMatcher
 import argparse
+from utils.line_matching import match_descriptions, attribute_lines
+from utils.document_matcher import load_parsed_documents, group_documents, get_document_index
+from utils import metrics
+from utils.price_checks import SupplierPriceHistory, detect_line_anomalies
+from utils.reconciliation_state import CREDIT_DOCUMENT_TYPES, STATE_VERSION, build_state, total_quantity, update_result
 
+@metrics.timer("reconcile", method="native")
 def compare_line_items(invoice_items, delivery_items, fuzzy_threshold=0.8):
+    """
+    pairs invoice and delivery lines with a globally optimal assignment over description similarity,
+    so the outcome no longer depends on line order. pairs scoring under fuzzy_threshold are never matched
+    """
     discrepancies = []
     matched = []
 
-    delivery_pool = delivery_items.copy()
-
-    def find_best_match(inv_desc):
-        best_score = 0
-        best_match = None
-        for d in delivery_pool:
-            score = SequenceMatcher(None, inv_desc.lower(), d['description'].lower()).ratio()
-            if score > best_score:
-                best_score = score
-                best_match = d
-        return best_match if best_score >= fuzzy_threshold else None
+    pairs = match_descriptions(
+        [item['description'] for item in invoice_items],
+        [item['description'] for item in delivery_items],
+        fuzzy_threshold
+    )
+    match_for_invoice = {inv_idx: delivery_items[del_idx] for inv_idx, del_idx, _ in pairs}
+    matched_delivery = {del_idx for _, del_idx, _ in pairs}
 
-    for invoice_item in invoice_items:
+    for inv_idx, invoice_item in enumerate(invoice_items):
         inv_desc = invoice_item['description']
         inv_qty = invoice_item['quantity']
 
-        match = find_best_match(inv_desc)
+        match = match_for_invoice.get(inv_idx)
         if not match:
             discrepancies.append({
                 "description": inv_desc,
@@ -41,26 +46,330 @@ def compare_line_items(invoice_items, delivery_items, fuzzy_threshold=0.8):
         else:
             matched.append(invoice_item)
 
-        delivery_pool.remove(match)
+    for del_idx, leftover in enumerate(delivery_items):
+        if del_idx in matched_delivery:
+            continue
+        discrepancies.append({
+            "description": leftover['description'],
+            "issue": "Extra item in delivery not invoiced"
+        })
+
+    return matched, discrepancies
+
+def delivery_label(delivery_data, position):
+    return delivery_data.get("source_file") or f"delivery document {position + 1}"
+
+@metrics.timer("reconcile", method="native", mode="group")
+def compare_group_line_items(invoice_items, deliveries, fuzzy_threshold=0.8):
+    """
+    compares one invoice against every docket delivering it in a single pass. deliveries is a list of
+    (label, line_items); all docket lines are pooled, optimally paired one-to-one with the invoice lines,
+    then any leftover docket line that still clears fuzzy_threshold is added to its best invoice line.
+    delivered quantities are summed per invoice line, with the per docket breakdown kept on the result
+    """
+    discrepancies = []
+    matched = []
+
+    pooled = [(label, item) for label, items in deliveries for item in items]
+    lines_for_invoice, unattributed = attribute_lines(
+        [item['description'] for item in invoice_items],
+        [item['description'] for _, item in pooled],
+        fuzzy_threshold
+    )
+
+    for inv_idx, invoice_item in enumerate(invoice_items):
+        inv_desc = invoice_item['description']
+        inv_qty = invoice_item['quantity']
 
-    for leftover in delivery_pool:
+        pool_indices = lines_for_invoice.get(inv_idx)
+        if not pool_indices:
+            discrepancies.append({
+                "description": inv_desc,
+                "issue": "Missing from delivery document"
+            })
+            continue
+
+        breakdown = [
+            {"document": pooled[pool_idx][0], "quantity": pooled[pool_idx][1]['quantity']}
+            for pool_idx in sorted(pool_indices)
+        ]
+        delivered_qty = total_quantity(entry["quantity"] for entry in breakdown)
+        if delivered_qty != inv_qty:
+            discrepancies.append({
+                "description": inv_desc,
+                "invoice_qty": inv_qty,
+                "delivered_qty": delivered_qty,
+                "deliveries": breakdown,
+                "issue": "Quantity mismatch"
+            })
+        else:
+            matched.append({**invoice_item, "deliveries": breakdown})
+
+    for pool_idx in unattributed:
+        label, leftover = pooled[pool_idx]
         discrepancies.append({
             "description": leftover['description'],
+            "document": label,
             "issue": "Extra item in delivery not invoiced"
         })
 
     return matched, discrepancies
 
-def main():
+def reconcile_batch(pairs, fuzzy_threshold=0.8, history: SupplierPriceHistory = None, labels=None):
+    """
+    reconciles many (invoice, delivery) pairs. duplicate charges, line total errors and (with a history)
+    supplier price drift are checked over every invoice line in the batch at once, then each pair's lines are matched.
+    labels optionally names each delivery document, defaulting to its source_file
+    """
+    with metrics.timer("line_anomalies", method="native"):
+        anomalies = detect_line_anomalies([invoice_data for invoice_data, _ in pairs], history)
+    return [
+        _reconcile_pair(invoice_data, delivery_data, fuzzy_threshold, invoice_anomalies, label)
+        for (invoice_data, delivery_data), invoice_anomalies, label in zip(pairs, anomalies, labels or [None] * len(pairs))
+    ]
+
+def reconcile_documents(invoice_data, delivery_data, fuzzy_threshold=0.8, history: SupplierPriceHistory = None, label=None):
+    """
+    native reconciliation of two parsed documents into a result dict shaped like the gpt reconciliation output
+    """
+    return reconcile_batch([(invoice_data, delivery_data)], fuzzy_threshold, history, [label])[0]
+
+def reconcile_groups(groups, fuzzy_threshold=0.8, history: SupplierPriceHistory = None, labels=None):
+    """
+    reconciles many (invoice, [deliveries]) groups, each invoice against all of its dockets in one pass.
+    invoice line anomalies are checked across the whole batch like reconcile_batch.
+    labels optionally names each group's deliveries, defaulting to their source_file
+    """
+    with metrics.timer("line_anomalies", method="native"):
+        anomalies = detect_line_anomalies([invoice_data for invoice_data, _ in groups], history)
+    return [
+        _reconcile_group(invoice_data, deliveries, fuzzy_threshold, invoice_anomalies, group_labels)
+        for (invoice_data, deliveries), invoice_anomalies, group_labels
+        in zip(groups, anomalies, labels or [None] * len(groups))
+    ]
+
+def _reconcile_group(invoice_data, deliveries, fuzzy_threshold, anomalies, labels=None):
+    labels = labels or [delivery_label(delivery_data, position) for position, delivery_data in enumerate(deliveries)]
+    matched, discrepancies = compare_group_line_items(
+        invoice_data.get("line_items", []),
+        [(label, delivery_data.get("line_items", [])) for label, delivery_data in zip(labels, deliveries)],
+        fuzzy_threshold
+    )
+    discrepancies.extend(anomalies)
+    status = "mismatch" if discrepancies else "reconciled"
+    metrics.increment("reconciliations_total", method="native", status=status)
+
+    def first(field):
+        return invoice_data.get(field) or next((d.get(field) for d in deliveries if d.get(field)), None)
+
+    result = {
+        "invoice_number": first("invoice_number"),
+        "job_code": first("job_code"),
+        "supplier_name": first("supplier_name"),
+        "reconciliation_status": status,
+        "matched_items": matched,
+        "discrepancies": discrepancies,
+        "summary": f"{len(matched)} matched, {len(discrepancies)} discrepancies across {len(deliveries)} delivery documents",
+        "source_doc_type": invoice_data.get("document_type", "unknown"),
+        "comparison_doc_type": ",".join(sorted({d.get("document_type") or "unknown" for d in deliveries})),
+        "delivery_documents": labels
+    }
+    result["reconciliation_state"] = build_state(invoice_data, result, labels, fuzzy_threshold)
+    return result
+
+def document_label(path: Path, doc: dict) -> str:
+    return doc.get("source_file") or Path(path).name
+
+def result_path_for(reconciled_dir: Path, result: dict) -> Path:
+    invoice_number = (result.get("invoice_number") or "unknown").replace("/", "-")
+    return reconciled_dir / f"{invoice_number}_{result.get('reconciliation_status', 'unknown')}.json"
+
+def find_result_path(reconciled_dir: Path, invoice_number: str):
+    """
+    the stored result for an invoice, whatever status it was saved under
+    """
+    if not invoice_number:
+        return None
+    stored = sorted(reconciled_dir.glob(f"{invoice_number.replace('/', '-')}_*.json"), key=lambda path: path.stat().st_mtime)
+    return stored[-1] if stored else None
+
+def write_result(reconciled_dir: Path, result: dict, previous_path: Path = None) -> Path:
+    """
+    saves a result as <invoice_number>_<status>.json, removing the previous file when the status changed
+    """
+    result_path = result_path_for(reconciled_dir, result)
+    with open(result_path, "w") as f:
+        json.dump(result, f, indent=2)
+    if previous_path and Path(previous_path) != result_path:
+        Path(previous_path).unlink(missing_ok=True)
+    return result_path
+
+def load_stored_result(result_path):
+    if result_path is None:
+        return None
+    with open(result_path) as f:
+        result = json.load(f)
+    state = result.get("reconciliation_state")
+    return result if state and state.get("version") == STATE_VERSION else None
+
+def apply_late_documents(result, invoice_data, documents, fuzzy_threshold=0.8):
+    """
+    folds (label, doc) late dockets/credit notes into a stored result one at a time, each matched against
+    the lines still outstanding. no anomaly checks or price history updates, the invoice hasn't changed
+    """
+    for label, doc in documents:
+        result = update_result(result, invoice_data, doc, label, fuzzy_threshold)
+        metrics.increment("late_documents_total", document_type=doc.get("document_type") or "unknown")
+    metrics.increment("reconciliations_total", method="native", status=result["reconciliation_status"])
+    return result
+
+def reconcile_parsed_groups(parsed_dir: Path, reconciled_dir: Path, fuzzy_threshold=0.8,
+                            history: SupplierPriceHistory = None, changed=None, parsed_docs=None):
+    """
+    groups every parsed document in parsed_dir by invoice_number/job_code and reconciles each invoice
+    against all of its dockets. changed (parsed file paths) limits the run to groups containing one of them.
+    an invoice with a stored result only has its new dockets/credit notes folded in, a new or changed invoice
+    is reconciled in full. parsed_docs ((path, doc) entries) is grouped instead of reading all of parsed_dir.
+    writes one result per invoice, returns (result paths, unmatched documents)
+    """
+    if parsed_docs is None:
+        parsed_docs = load_parsed_documents(parsed_dir)
+    groups, unmatched = group_documents(parsed_docs)
+    if changed is not None:
+        changed = {Path(path).name for path in changed}
+        groups = [
+            (invoice, deliveries) for invoice, deliveries in groups
+            if any(path.name in changed for path, _ in [invoice, *deliveries])
+        ]
+
+    result_paths = []
+    full = []
+    for (invoice_path, invoice_data), entries in groups:
+        labelled = [(document_label(path, doc), doc) for path, doc in entries]
+        previous_path = find_result_path(reconciled_dir, invoice_data.get("invoice_number"))
+        stored = load_stored_result(previous_path)
+        if stored is not None and not (changed and invoice_path.name in changed):
+            seen = set(stored["reconciliation_state"]["documents"])
+            late = [(label, doc) for label, doc in labelled if label not in seen]
+            if late:
+                result = apply_late_documents(stored, invoice_data, late, fuzzy_threshold)
+                result_paths.append(write_result(reconciled_dir, result, previous_path))
+            continue
+
+        deliveries = [(label, doc) for label, doc in labelled if doc.get("document_type") not in CREDIT_DOCUMENT_TYPES]
+        credits = [(label, doc) for label, doc in labelled if doc.get("document_type") in CREDIT_DOCUMENT_TYPES]
+        if not deliveries:
+            # a credit note alone isn't a delivery, wait for the dockets
+            unmatched.append((invoice_path, invoice_data))
+            unmatched.extend(entries)
+            continue
+        full.append((invoice_data, deliveries, credits, previous_path))
+
+    results = reconcile_groups(
+        [(invoice_data, [doc for _, doc in deliveries]) for invoice_data, deliveries, _, _ in full],
+        fuzzy_threshold, history,
+        [[label for label, _ in deliveries] for _, deliveries, _, _ in full]
+    )
+    for result, (invoice_data, _, credits, previous_path) in zip(results, full):
+        for label, credit in credits:
+            result = update_result(result, invoice_data, credit, label, fuzzy_threshold)
+        result_paths.append(write_result(reconciled_dir, result, previous_path))
+    return result_paths, unmatched
+
+def apply_late_document(doc_path: Path, parsed_dir: Path, reconciled_dir: Path, fuzzy_threshold=0.8):
+    """
+    folds one late docket or credit note into its invoice's stored result, looked up through the document index.
+    returns the rewritten result path, or None when there is no stored result to update
+    """
+    doc_path = Path(doc_path)
+    with open(doc_path) as f:
+        doc = json.load(f)
+
+    index = get_document_index(parsed_dir)
+    invoice_entry = next(
+        (entry for entry in index.lookup_all(doc, exclude_id=doc_path.stem) if entry.get("document_type") == "invoice"),
+        None
+    )
+    if invoice_entry is None:
+        print(f"❌ No parsed invoice shares an invoice number or job code with {doc_path.name}")
+        return None
+    with open(invoice_entry["path"]) as f:
+        invoice_data = json.load(f)
+
+    previous_path = find_result_path(reconciled_dir, invoice_data.get("invoice_number"))
+    if previous_path is None:
+        print(f"❌ {invoice_data.get('invoice_number')} hasn't been reconciled yet, reconcile it in full first")
+        return None
+    with open(previous_path) as f:
+        stored = json.load(f)
+
+    label = document_label(doc_path, doc)
+    if label in (stored.get("reconciliation_state") or {}).get("documents", []):
+        print(f"⚠️  {label} is already part of {previous_path.name}")
+        return previous_path
+    result = apply_late_documents(stored, invoice_data, [(label, doc)], fuzzy_threshold)
+    return write_result(reconciled_dir, result, previous_path)
+
+def _reconcile_pair(invoice_data, delivery_data, fuzzy_threshold, anomalies, label=None):
+    matched, discrepancies = compare_line_items(
+        invoice_data.get("line_items", []),
+        delivery_data.get("line_items", []),
+        fuzzy_threshold
+    )
+    discrepancies.extend(anomalies)
+    status = "mismatch" if discrepancies else "reconciled"
+    metrics.increment("reconciliations_total", method="native", status=status)
+    result = {
+        "invoice_number": invoice_data.get("invoice_number") or delivery_data.get("invoice_number"),
+        "job_code": invoice_data.get("job_code") or delivery_data.get("job_code"),
+        "supplier_name": invoice_data.get("supplier_name") or delivery_data.get("supplier_name"),
+        "reconciliation_status": status,
+        "matched_items": matched,
+        "discrepancies": discrepancies,
+        "summary": f"{len(matched)} matched, {len(discrepancies)} discrepancies",
+        "source_doc_type": invoice_data.get("document_type", "unknown"),
+        "comparison_doc_type": delivery_data.get("document_type", "unknown")
+    }
+    label = label or delivery_label(delivery_data, 0)
+    result["reconciliation_state"] = build_state(invoice_data, result, [label], fuzzy_threshold)
+    return result
+
+def main(argv=None):
+    metrics.configure()
     parser = argparse.ArgumentParser()
     parser.add_argument("--source", choices=["uploads", "inbox"], default="uploads")
-    args = parser.parse_args()
+    parser.add_argument("--method", choices=["native", "hybrid", "gpt"], default="native", help="which parser's output to reconcile")
+    parser.add_argument("--no-price-history", action="store_true", help="skip (and don't record) supplier price drift checks")
+    parser.add_argument("--group", action="store_true",
+                        help="reconcile each invoice in the parsed dir against every docket sharing its invoice number/job code")
+    parser.add_argument("--apply", metavar="PARSED_JSON",
+                        help="fold a late docket or credit note into its invoice's stored result instead of reconciling again")
+    args = parser.parse_args(argv)
 
-    base_dir = Path("local_src_native_output") if args.source == "uploads" else Path("email_src_native_output")
+    base_dir = Path(f"{'local_src' if args.source == 'uploads' else 'email_src'}_{args.method}_output")
     parsed_output_dir = base_dir / "parsed"
     reconciled_output_dir = base_dir / "reconciled"
     reconciled_output_dir.mkdir(parents=True, exist_ok=True)
 
+    if args.apply:
+        result_path = apply_late_document(Path(args.apply), parsed_output_dir, reconciled_output_dir)
+        if result_path:
+            with open(result_path) as f:
+                print(f"✅ {json.load(f)['summary']}, saved to {result_path}")
+        return
+
+    if args.group:
+        history = None if args.no_price_history else SupplierPriceHistory()
+        try:
+            result_paths, unmatched = reconcile_parsed_groups(parsed_output_dir, reconciled_output_dir, history=history)
+        finally:
+            if history:
+                history.close()
+        print(f"✅ Reconciled {len(result_paths)} invoices, results saved to {reconciled_output_dir}")
+        if unmatched:
+            print(f"⚠️  {len(unmatched)} documents have no counterpart yet: {', '.join(path.name for path, _ in unmatched)}")
+        return
+
     invoice_json_path = parsed_output_dir / "invoice_parsed.json"
     source_json_path = parsed_output_dir / "source_parsed.json"
 
@@ -74,10 +383,14 @@ def main():
     with open(source_json_path) as f:
         source_data = json.load(f)
 
-    matched, discrepancies = compare_line_items(
-        invoice_data.get("line_items", []),
-        source_data.get("line_items", [])
-    )
+    history = None if args.no_price_history else SupplierPriceHistory()
+    try:
+        result = reconcile_documents(invoice_data, source_data, history=history,
+                                     label=document_label(source_json_path, source_data))
+    finally:
+        if history:
+            history.close()
+    matched, discrepancies = result["matched_items"], result["discrepancies"]
 
     with open(reconciled_output_dir / "matched_items.json", "w") as f:
         json.dump(matched, f, indent=2)
@@ -85,6 +398,9 @@ def main():
     with open(reconciled_output_dir / "discrepancies.json", "w") as f:
         json.dump(discrepancies, f, indent=2)
 
+    # the full result keeps the incremental state a late docket or credit note is applied to
+    write_result(reconciled_output_dir, result, find_result_path(reconciled_output_dir, result.get("invoice_number")))
+
     print("✅ Reconciliation complete.")
     print(f"✅ {len(matched)} matched items")
     print(f"⚠️  {len(discrepancies)} discrepancies found")
@@ -1,28 +1,39 @@
 from pathlib import Path
+import atexit
+import threading
+import time
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
+from utils import metrics
 
-def write_reconciliation_to_sheet(data):
-    # google api scope and credentials path
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    credentials_path = Path("credentials/service_account.json")
-
-    # authorise client
-    creds = ServiceAccountCredentials.from_json_keyfile_name(str(credentials_path), scope)
-    client = gspread.authorize(creds)
-
-    spreadsheet = client.open("ONN1_Reconciliation_Logs")
-    worksheet = spreadsheet.sheet1
-
-    # prep header and data row
-    headers = [
-        "Invoice Number", "Supplier Name", "Job Code",
-        "Source Doc Type", "Comparison Doc Type",
-        "Status", "Matched Items", "Missing Items", "Extra Items",
-        "Discrepancy Count", "Summary"
-    ]
+# google api scope and credentials path
+SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+CREDENTIALS_PATH = Path("credentials/service_account.json")
+SPREADSHEET_NAME = "ONN1_Reconciliation_Logs"
+
+HEADERS = [
+    "Invoice Number", "Supplier Name", "Job Code",
+    "Source Doc Type", "Comparison Doc Type",
+    "Status", "Matched Items", "Missing Items", "Extra Items",
+    "Discrepancy Count", "Summary"
+]
+
+_client = None
+_default_writer = None
+
+def get_client():
+    """
+    authorises once per process and reuses the client for every write
+    """
+    global _client
+    if _client is None:
+        creds = ServiceAccountCredentials.from_json_keyfile_name(str(CREDENTIALS_PATH), SCOPE)
+        _client = gspread.authorize(creds)
+    return _client
 
-    row = [
+def build_row(data):
+    discrepancies = data.get("discrepancies", [])
+    return [
         data.get("invoice_number"),
         data.get("supplier_name"),
         data.get("job_code"),
@@ -30,17 +41,116 @@ def write_reconciliation_to_sheet(data):
         data.get("comparison_doc_type", "unknown"),
         data.get("reconciliation_status"),
         len(data.get("matched_items", [])),
-        len([d for d in data.get("discrepancies", []) if d["type"] == "missing_item"]),
-        len([d for d in data.get("discrepancies", []) if d["type"] == "extra_item"]),
-        len(data.get("discrepancies", [])),
+        len([d for d in discrepancies if d.get("type") == "missing_item"]),
+        len([d for d in discrepancies if d.get("type") == "extra_item"]),
+        len(discrepancies),
         data.get("summary")
-]
+    ]
+
+class SheetsWriter:
+    """
+    buffers reconciliation rows and writes them with a single append_rows call once max_rows
+    are queued or max_interval seconds have passed since the last flush. a daemon thread started with
+    the first row flushes on that interval too, so rows don't wait for the next add when results stop arriving.
+    the header row is checked once per worksheet per process
+    """
+
+    _headers_checked = set()
+
+    def __init__(self, worksheet=None, max_rows=50, max_interval=30.0):
+        self._worksheet = worksheet
+        self.max_rows = max_rows
+        self.max_interval = max_interval
+        self.buffer = []
+        self.last_flush = time.monotonic()
+        self.lock = threading.RLock()
+        self._stop = threading.Event()
+        self._flusher = None
 
+    @property
+    def worksheet(self):
+        if self._worksheet is None:
+            self._worksheet = get_client().open(SPREADSHEET_NAME).sheet1
+        return self._worksheet
 
-    # add headers if first row is empty
-    if not worksheet.cell(1, 1).value:
-        worksheet.append_row(headers)
+    def add(self, data):
+        with self.lock:
+            self.buffer.append(build_row(data))
+            if len(self.buffer) >= self.max_rows or time.monotonic() - self.last_flush >= self.max_interval:
+                self.flush()
+                return
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+                self._flusher.start()
 
-    # append data row
-    worksheet.append_row(row)
-    print("✅ Reconciliation result written to Google Sheet.")
+    def _flush_periodically(self):
+        while True:
+            with self.lock:
+                if self.buffer and time.monotonic() - self.last_flush >= self.max_interval:
+                    try:
+                        self.flush()
+                    except Exception as e:
+                        # rows stay buffered for the next attempt, flush already restarted the interval
+                        print(f"❌ Failed to write reconciliation results to Google Sheet: {e}")
+                due = self.last_flush + self.max_interval - time.monotonic()
+            if self._stop.wait(due if due > 0 else self.max_interval):
+                return
+
+    def _worksheet_key(self):
+        return getattr(self.worksheet, "id", id(self.worksheet))
+
+    def _header_rows(self):
+        if self._worksheet_key() in SheetsWriter._headers_checked:
+            return []
+        # add headers if first row is empty
+        return [] if self.worksheet.cell(1, 1).value else [HEADERS]
+
+    def flush(self):
+        with self.lock:
+            self.last_flush = time.monotonic()
+            if not self.buffer:
+                return 0
+            with metrics.timer("sheets_append"):
+                rows = self._header_rows() + self.buffer
+                self.worksheet.append_rows(rows)
+            # only once the append went through, a failed one must check (and write) the header again
+            SheetsWriter._headers_checked.add(self._worksheet_key())
+            count = len(self.buffer)
+            metrics.increment("sheets_rows_written_total", count)
+            self.buffer = []
+        print(f"✅ {count} reconciliation result(s) written to Google Sheet.")
+        return count
+
+    def close(self):
+        """
+        stops the interval flusher and writes whatever is still buffered
+        """
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        return self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def _flush_default_writer():
+    try:
+        _default_writer.close()
+    except Exception as e:
+        print(f"❌ Failed to write reconciliation results to Google Sheet: {e}")
+
+def get_default_writer():
+    """
+    process wide writer, any rows still buffered are flushed at interpreter exit
+    """
+    global _default_writer
+    if _default_writer is None:
+        _default_writer = SheetsWriter()
+        atexit.register(_flush_default_writer)
+    return _default_writer
+
+def write_reconciliation_to_sheet(data):
+    get_default_writer().add(data)
@@ -0,0 +1,40 @@
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+import pytest
+
+# the pipeline modules live at the repo root and import each other as top level modules
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+class FakeOpenAI:
+    """
+    stands in for OpenAI/AsyncOpenAI: chat.completions.create and beta.chat.completions.parse answer with
+    respond(prompt), which returns a completion or raises. every prompt sent is recorded
+    """
+
+    def __init__(self, respond, is_async=False):
+        self.respond = respond
+        self.prompts = []
+        call = self._acall if is_async else self._call
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=call))
+        self.beta = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(parse=call)))
+
+    @staticmethod
+    def completion(content=None, parsed=None, refusal=None):
+        """
+        a chat completion shaped like the sdk's, for free-form (content) or structured (parsed/refusal) replies
+        """
+        message = SimpleNamespace(content=content, parsed=parsed, refusal=refusal)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")], usage=None)
+
+    def _call(self, model, messages, temperature, response_format=None):
+        prompt = messages[-1]["content"]
+        self.prompts.append(prompt)
+        return self.respond(prompt)
+
+    async def _acall(self, **kwargs):
+        return self._call(**kwargs)
+
+@pytest.fixture
+def fake_openai():
+    return FakeOpenAI
@@ -0,0 +1,70 @@
+import json
+import shutil
+from pathlib import Path
+import parse_pdfs
+from utils import metrics
+from utils.batch_utils import resolve_pdf_paths, run_in_pool
+from utils.document_matcher import DocumentIndex
+
+UPLOADS = Path(__file__).resolve().parent.parent / "uploads"
+
+def make_batch(directory, copies=3):
+    directory.mkdir(parents=True)
+    for i in range(copies):
+        for pdf in sorted(UPLOADS.glob("*.pdf")):
+            shutil.copy(pdf, directory / f"{pdf.stem}_{i}.pdf")
+    return directory
+
+def test_resolve_directory_file_and_glob(tmp_path):
+    batch = make_batch(tmp_path / "batch", copies=1)
+    (batch / "nested").mkdir()
+    shutil.copy(UPLOADS / "sample_invoice.pdf", batch / "nested" / "other.PDF")
+    (batch / "notes.txt").write_text("not a pdf")
+
+    # recursive, case insensitive on the suffix, sorted by path
+    assert [path.name for path in resolve_pdf_paths(str(batch))] == [
+        "other.PDF", "sample_delivery_docket_0.pdf", "sample_invoice_0.pdf"]
+    assert resolve_pdf_paths(str(batch / "sample_invoice_0.pdf")) == [batch / "sample_invoice_0.pdf"]
+    assert [path.name for path in resolve_pdf_paths(str(batch / "sample_*.pdf"))] == [
+        "sample_delivery_docket_0.pdf", "sample_invoice_0.pdf"]
+    assert resolve_pdf_paths(str(tmp_path / "missing" / "*.pdf")) == []
+
+def test_pool_keeps_input_order():
+    items = [-5, 3, -1, 8, -2, 7]
+    assert list(run_in_pool(abs, items, workers=3, chunksize=2)) == [5, 3, 1, 8, 2, 7]
+    assert list(run_in_pool(abs, items, workers=1)) == [5, 3, 1, 8, 2, 7]
+
+def test_pool_batch_matches_inline_batch(tmp_path):
+    batch = make_batch(tmp_path / "batch")
+    pdf_paths = resolve_pdf_paths(str(batch))
+
+    outputs = {}
+    for workers in (1, 2):
+        output = tmp_path / f"parsed_{workers}"
+        assert parse_pdfs.run_batch(pdf_paths, output, workers=workers, chunksize=2) == len(pdf_paths)
+        outputs[workers] = {path.name: json.loads(path.read_text()) for path in output.glob("*_parsed.json")}
+
+    assert len(outputs[2]) == len(pdf_paths)
+    assert outputs[2] == outputs[1]
+    index = DocumentIndex(tmp_path / "parsed_2")
+    index.refresh()
+    assert set(index.documents) == {f"{path.stem}_parsed" for path in pdf_paths}
+
+def counted_abs(item):
+    metrics.increment("test_items_total", parity=item % 2)
+    with metrics.timer("test_abs"):
+        return abs(item)
+
+def test_pool_worker_metrics_reach_the_parent():
+    metrics.reset()
+    # recorded before the pool starts, forked workers must not send it back a second time
+    metrics.increment("test_items_total", parity=0)
+    assert list(run_in_pool(counted_abs, [-5, 3, -1, 8, -2, 7], workers=3, chunksize=2)) == [5, 3, 1, 8, 2, 7]
+
+    snapshot = metrics.REGISTRY.snapshot()
+    counts = {entry["labels"]["parity"]: entry["value"] for entry in snapshot["counters"]["test_items_total"]}
+    assert counts == {"0": 3, "1": 4}
+    [timings] = [entry for entry in snapshot["histograms"]["stage_duration_seconds"]
+                 if entry["labels"] == {"stage": "test_abs"}]
+    assert timings["count"] == 6
+    metrics.reset()
@@ -0,0 +1,38 @@
+import json
+from benchmarks.compare import compare
+from benchmarks.corpus import GROUND_TRUTH_FILENAME, generate_corpus, load_or_generate
+from benchmarks.run import run_benchmarks
+
+def test_corpus_is_deterministic_and_reused(tmp_path):
+    truth = generate_corpus(tmp_path / "a", pairs=3, seed=7, max_items=8)
+    again = generate_corpus(tmp_path / "b", pairs=3, seed=7, max_items=8)
+    assert truth == again
+    assert [pair["layout"] for pair in truth["pairs"]] == ["numbered", "table", "columns"]
+    assert sorted(path.name for path in (tmp_path / "a").glob("*.pdf")) == [
+        f"{number:04d}_{role}.pdf" for number in range(3) for role in ("docket", "invoice")]
+
+    # same settings reuse the files on disk, different ones regenerate
+    (tmp_path / "a" / "0000_invoice.pdf").unlink()
+    assert load_or_generate(tmp_path / "a", pairs=3, seed=7, max_items=8) == truth
+    assert not (tmp_path / "a" / "0000_invoice.pdf").exists()
+    assert load_or_generate(tmp_path / "a", pairs=3, seed=8, max_items=8)["seed"] == 8
+    assert json.loads((tmp_path / "a" / GROUND_TRUTH_FILENAME).read_text())["seed"] == 8
+
+def test_long_documents_span_pages(tmp_path):
+    # seed 0 gives a 111 line numbered pair and a 50 line table pair
+    truth = generate_corpus(tmp_path, pairs=2, seed=0, max_items=120)
+    assert [(len(pair["invoice"]["line_items"]), pair["invoice"]["pages"]) for pair in truth["pairs"]] == [(111, 3), (50, 2)]
+    assert all(pair["docket"]["pages"] > 1 for pair in truth["pairs"])
+
+def test_native_scenarios_reproduce_the_ground_truth(tmp_path):
+    results = run_benchmarks(tmp_path, pairs=3, seed=0, max_items=10, repeat=1,
+                             scenarios=["native_parse", "reconcile", "pairing"], stub_latency=0)
+    scenarios = results["scenarios"]
+    assert results["corpus"]["documents"] == 6
+    assert set(scenarios) == {"extraction", "native_parse", "reconcile", "pairing"}
+    assert scenarios["native_parse"]["accuracy"] == 1.0
+    assert scenarios["reconcile"]["accuracy"] == 1.0
+
+    rows = compare(results, results)
+    assert {name for name, *_ in rows} == set(scenarios)
+    assert all(change in (0, None) for _, _, _, change, _, _ in rows)
@@ -0,0 +1,135 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from db import crud, models
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+    engine.dispose()
+
+def document(name, document_type, invoice_number=None, job_code=None):
+    return {"filename": f"{name}.pdf", "document_type": document_type,
+            "parsed_json": {"invoice_number": invoice_number, "job_code": job_code, "line_items": []}}
+
+def result(invoice_number):
+    return {"invoice_number": invoice_number, "reconciliation_status": "reconciled", "summary": "ok",
+            "matched_items": [], "discrepancies": []}
+
+def test_bulk_insert_returns_ids_in_input_order(db):
+    docs = [document(f"doc{i}", "invoice", f"INV-{i}") for i in range(7)]
+    ids = crud.bulk_create_documents(db, docs, batch_size=3)
+
+    assert len(ids) == 7
+    rows = {doc.id: doc for doc in db.query(models.Document)}
+    assert [rows[doc_id].filename for doc_id in ids] == [doc["filename"] for doc in docs]
+    # identifiers are promoted out of parsed_json for the unreconciled lookups
+    assert rows[ids[4]].invoice_number == "INV-4"
+
+def test_find_unmatched_document_uses_promoted_identifiers(db):
+    invoice = crud.create_document(db, "invoice.pdf", "invoice", {"invoice_number": "INV-1", "job_code": "J1"})
+    assert invoice.invoice_number == "INV-1" and invoice.job_code == "J1"
+    # the document itself never matches
+    assert crud.find_unmatched_document(db, invoice) is None
+
+    by_job = crud.create_document(db, "docket_j1.pdf", "delivery_docket", {"job_code": "J1"})
+    crud.create_document(db, "other.pdf", "delivery_docket", {"invoice_number": "INV-2", "job_code": "J2"})
+    assert crud.find_unmatched_document(db, invoice).id == by_job.id
+
+    # reconciled documents are skipped
+    crud.create_reconciliation(db, [by_job], result("INV-1"), "native")
+    assert crud.find_unmatched_document(db, invoice) is None
+    by_number = crud.create_document(db, "docket_inv1.pdf", "delivery_docket", {"invoice_number": "INV-1"})
+    assert crud.find_unmatched_document(db, invoice).id == by_number.id
+
+    # nothing to match on
+    blank = crud.create_document(db, "blank.pdf", "delivery_docket", {})
+    assert crud.find_unmatched_document(db, blank) is None
+
+def test_bulk_reconciliations_link_their_documents(db):
+    invoice_id, docket_id, other_id = crud.bulk_create_documents(db, [
+        document("invoice", "invoice", "INV-1"),
+        document("docket", "delivery_docket", "INV-1"),
+        document("invoice2", "invoice", "INV-2")
+    ])
+    recon_ids = crud.bulk_create_reconciliations(db, [
+        ([invoice_id, docket_id], result("INV-1")),
+        ([db.get(models.Document, other_id)], result("INV-2"))
+    ], method="native", batch_size=1)
+
+    first, second = (db.get(models.Reconciliation, recon_id) for recon_id in recon_ids)
+    assert first.invoice_number == "INV-1"
+    assert [doc.id for doc in first.documents] == [invoice_id, docket_id]
+    assert [doc.id for doc in second.documents] == [other_id]
+
+def test_claim_groups_every_docket_with_its_invoice(db):
+    crud.bulk_create_documents(db, [
+        document("invoice1", "invoice", "INV-1", "J1"),
+        document("docket1", "delivery_docket", "INV-1"),
+        document("invoice2", "invoice", "INV-2", "J2"),
+        document("docket2", "delivery_docket", job_code="J1"),
+        document("confirmation", "confirmation", "INV-2", "J1"),
+        document("invoice3", "invoice", "INV-3"),
+        document("stray", "delivery_docket", "INV-9")
+    ])
+
+    groups = crud.claim_unreconciled_groups(db)
+    claimed = {invoice.filename: [doc.filename for doc in docs] for invoice, docs in groups}
+    # the invoice number wins over the job code, and an invoice without dockets is not claimed
+    assert claimed == {
+        "invoice1.pdf": ["docket1.pdf", "docket2.pdf"],
+        "invoice2.pdf": ["confirmation.pdf"]
+    }
+
+    for invoice, docs in groups:
+        crud.create_reconciliation(db, [invoice, *docs], result(invoice.invoice_number), "native")
+    assert crud.claim_unreconciled_groups(db) == []
+
+def test_claim_groups_respects_limit(db):
+    crud.bulk_create_documents(db, [
+        document(f"{kind}{i}", kind, f"INV-{i}") for i in range(3) for kind in ("invoice", "delivery_docket")
+    ])
+    groups = crud.claim_unreconciled_groups(db, limit=2)
+    assert [invoice.invoice_number for invoice, _ in groups] == ["INV-0", "INV-1"]
+
+def test_docket_quoting_another_invoice_is_not_claimed_by_job_code(db):
+    crud.bulk_create_documents(db, [
+        document("invoice1", "invoice", "INV-1", "J1"),
+        document("docket1", "delivery_docket", "INV-1"),
+        document("invoice5", "invoice", "INV-5", "J1"),
+        document("docket5", "delivery_docket", "INV-5", "J1")
+    ])
+
+    # INV-5 is outside this batch, its docket shares INV-1's job code but must wait for it
+    [(invoice, docs)] = crud.claim_unreconciled_groups(db, limit=1)
+    assert invoice.filename == "invoice1.pdf"
+    assert [doc.filename for doc in docs] == ["docket1.pdf"]
+    crud.create_reconciliation(db, [invoice, *docs], result("INV-1"), "native")
+
+    [(invoice, docs)] = crud.claim_unreconciled_groups(db)
+    assert (invoice.filename, [doc.filename for doc in docs]) == ("invoice5.pdf", ["docket5.pdf"])
+
+def test_late_document_is_folded_into_its_reconciliation_once(db):
+    from reconcile import reconcile_documents
+    invoice_json = {"invoice_number": "INV-1", "line_items": [{"description": "Concrete 32MPa", "quantity": 6},
+                                                              {"description": "Steel mesh", "quantity": 4}]}
+    docket_json = {"invoice_number": "INV-1", "line_items": [{"description": "Concrete 32MPa", "quantity": 6}]}
+    invoice = crud.create_document(db, "invoice.pdf", "invoice", invoice_json)
+    docket = crud.create_document(db, "docket1.pdf", "delivery_docket", docket_json)
+    result = reconcile_documents(invoice_json, docket_json, label="docket1.pdf")
+    recon = crud.create_reconciliation(db, [invoice, docket], result, "native")
+    assert recon.reconciliation_status == "mismatch"
+
+    late = crud.create_document(db, "docket2.pdf", "delivery_docket",
+                                {"invoice_number": "INV-1", "line_items": [{"description": "Steel mesh", "quantity": 4}]})
+    recon = crud.apply_late_document(db, late)
+    assert recon.reconciliation_status == "reconciled"
+    assert [doc.filename for doc in recon.documents] == ["invoice.pdf", "docket1.pdf", "docket2.pdf"]
+    assert recon.reconciliation_state["documents"] == ["docket1.pdf", "docket2.pdf"]
+
+    # already linked, nothing is applied twice
+    assert crud.apply_late_document(db, late).reconciliation_state["documents"] == ["docket1.pdf", "docket2.pdf"]
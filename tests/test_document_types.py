@@ -0,0 +1,27 @@
+import sys
+import types
+import pytest
+from utils.document_types import detect_document_type
+from hybrid_parse import route_document
+
+@pytest.mark.parametrize("text, document_type", [
+    ("DELIVERY DOCKET\nInvoice Number: INV-1", "delivery_docket"),
+    ("Purchase Confirmation for invoice INV-1", "purchase_confirmation"),
+    ("Credit Note against Invoice INV-1", "credit_note"),
+    ("TAX INVOICE\nInvoice Number: INV-1", "invoice"),
+    ("packing slip", "unknown"),
+])
+def test_detect_document_type(text, document_type):
+    assert detect_document_type(text) == document_type
+
+def test_escalated_document_keeps_native_type(monkeypatch):
+    fake_gpt_parse = types.ModuleType("gpt_parse")
+    fake_gpt_parse.parse_with_gpt = lambda text, response_cache=None: {
+        "invoice_number": "INV-1", "document_type": "invoice", "line_items": []
+    }
+    monkeypatch.setitem(sys.modules, "gpt_parse", fake_gpt_parse)
+
+    native = {"document_type": "delivery_docket", "document_position": "batch_document", "line_items": []}
+    parsed = route_document("DELIVERY DOCKET\nInvoice Number: INV-1", native)
+    assert parsed["parse_route"]["method"] == "gpt"
+    assert parsed["document_type"] == "delivery_docket"
@@ -0,0 +1,132 @@
+import base64
+import json
+from utils.email_utils import find_pdf_parts, parse_imap_list, sync_pdf_attachments
+
+TEXT_PART = '("text" "plain" ("charset" "utf-8") NIL NIL "7bit" 12 1 NIL NIL NIL NIL)'
+
+def pdf_part(filename):
+    return (f'("application" "pdf" ("name" "{filename}") NIL NIL "base64" 100 NIL '
+            f'("attachment" ("filename" "{filename}")) NIL NIL)')
+
+def multipart(*parts):
+    return f'({"".join(parts)} "mixed" ("boundary" "b1") NIL NIL NIL)'
+
+class FakeIMAP:
+    """
+    answers the select/response/uid calls sync_pdf_attachments makes, shaped like imaplib's return values.
+    messages maps uid -> (bodystructure, {part: payload}), every message counts as a keyword match
+    """
+
+    def __init__(self, messages, uidvalidity="1"):
+        self.messages = dict(messages)
+        self.uidvalidity = uidvalidity
+        self.searches = []
+        self.fetched_parts = []
+
+    def select(self, mailbox, readonly=False):
+        assert readonly
+        return "OK", [str(len(self.messages)).encode()]
+
+    def response(self, code):
+        assert code == "UIDVALIDITY"
+        return code, [self.uidvalidity.encode()]
+
+    def uid(self, command, *args):
+        if command == "SEARCH":
+            _, uid_range, _ = args
+            self.searches.append(uid_range)
+            start = int(uid_range.split()[1].split(":")[0])
+            uids = [uid for uid in sorted(self.messages) if uid >= start]
+            # like a real server, n:* always includes the newest message
+            if not uids and self.messages:
+                uids = [max(self.messages)]
+            return "OK", [" ".join(str(uid) for uid in uids).encode()]
+
+        uid_set, query = args
+        if query == "(UID BODYSTRUCTURE)":
+            data = []
+            for seq, uid in enumerate(uid_set.split(","), 1):
+                structure, _ = self.messages[int(uid)]
+                data.append(f"{seq} (UID {uid} BODYSTRUCTURE {structure})".encode())
+            return "OK", data
+
+        part = query[len("(BODY.PEEK["):-len("])")]
+        self.fetched_parts.append((int(uid_set), part))
+        payload = base64.b64encode(self.messages[int(uid_set)][1][part])
+        return "OK", [(f"1 (UID {uid_set} BODY[{part}] {{{len(payload)}}}".encode(), payload), b")"]
+
+def test_multipart_bodystructure_finds_the_attached_pdf():
+    data = [f"1 (UID 7 BODYSTRUCTURE {multipart(TEXT_PART, pdf_part('invoice_1.pdf'))})".encode()]
+    fields = parse_imap_list(data)[1]
+    structure = dict(zip(fields[::2], fields[1::2]))["BODYSTRUCTURE"]
+
+    assert find_pdf_parts(structure) == [{"part": "2", "filename": "invoice_1.pdf", "encoding": "base64"}]
+
+def test_single_part_and_nested_bodystructure():
+    single = parse_imap_list([pdf_part("delivery_docket.pdf").encode()])[0]
+    assert find_pdf_parts(single) == [{"part": "1", "filename": "delivery_docket.pdf", "encoding": "base64"}]
+
+    nested = parse_imap_list([multipart(multipart(TEXT_PART, pdf_part("invoice_2.pdf")), TEXT_PART).encode()])[0]
+    assert [part["part"] for part in find_pdf_parts(nested)] == ["1.2"]
+
+def forwarded(body):
+    envelope = '("Mon, 1 Sep 2025" "Fwd: invoice" NIL NIL NIL NIL NIL NIL NIL NIL)'
+    return f'("message" "rfc822" NIL NIL NIL "7bit" 500 {envelope} {body} 20 NIL ("attachment" NIL) NIL NIL)'
+
+def test_forwarded_email_attachments_are_found():
+    # a forward of a multipart email: the pdf is the second part of the encapsulated message
+    structure = parse_imap_list([multipart(TEXT_PART, forwarded(multipart(TEXT_PART, pdf_part("invoice_4.pdf")))).encode()])[0]
+    assert find_pdf_parts(structure) == [{"part": "2.2", "filename": "invoice_4.pdf", "encoding": "base64"}]
+
+    # a forwarded message whose whole body is the pdf
+    structure = parse_imap_list([multipart(TEXT_PART, forwarded(pdf_part("delivery_5.pdf"))).encode()])[0]
+    assert [part["part"] for part in find_pdf_parts(structure)] == ["2.1"]
+
+def test_attachment_names_cannot_leave_the_download_dir(tmp_path):
+    structure = parse_imap_list([multipart(pdf_part("../../invoice_6.pdf"), pdf_part("..\\\\invoice_7.pdf"),
+                                           pdf_part("..")).encode()])[0]
+    assert [part["filename"] for part in find_pdf_parts(structure)] == ["invoice_6.pdf", "invoice_7.pdf"]
+
+    mail = FakeIMAP({1: (pdf_part("../invoice_8.pdf"), {"1": b"%PDF invoice 8"})})
+    download = tmp_path / "downloads"
+    assert sync_pdf_attachments(download, mail=mail) == [download / "invoice_8.pdf"]
+    assert not (tmp_path / "invoice_8.pdf").exists()
+
+def test_literal_strings_are_parsed():
+    data = [(b'1 (UID 3 BODYSTRUCTURE ("application" "pdf" ("name" {11}', b"invoice.pdf"),
+            b') NIL NIL "base64" 100 NIL ("attachment" ("filename" "invoice.pdf")) NIL NIL))']
+    fields = parse_imap_list(data)[1]
+    assert fields[:2] == ["UID", "3"]
+    assert fields[3][2] == ["name", "invoice.pdf"]
+
+def test_only_new_uids_are_synced(tmp_path):
+    mail = FakeIMAP({
+        1: (multipart(TEXT_PART, pdf_part("invoice_1.pdf")), {"2": b"%PDF invoice 1"}),
+        2: (pdf_part("delivery_docket.pdf"), {"1": b"%PDF docket"})
+    })
+    saved = sync_pdf_attachments(tmp_path, mail=mail)
+    assert [path.name for path in saved] == ["invoice_1.pdf", "delivery_docket.pdf"]
+    assert (tmp_path / "invoice_1.pdf").read_bytes() == b"%PDF invoice 1"
+    assert json.loads((tmp_path / ".imap_sync_state.json").read_text()) == {"uidvalidity": "1", "last_uid": 2}
+
+    # nothing new: the server still returns the newest uid for 3:*, which is skipped
+    assert sync_pdf_attachments(tmp_path, mail=mail) == []
+    assert mail.searches[-1] == "UID 3:*"
+
+    mail.messages[3] = (multipart(TEXT_PART, pdf_part("invoice_3.pdf")), {"2": b"%PDF invoice 3"})
+    saved = sync_pdf_attachments(tmp_path, mail=mail)
+    assert [path.name for path in saved] == ["invoice_3.pdf"]
+    assert mail.fetched_parts == [(1, "2"), (2, "1"), (3, "2")]
+
+def test_uidvalidity_change_resyncs_from_the_start(tmp_path):
+    mail = FakeIMAP({1: (pdf_part("invoice_1.pdf"), {"1": b"%PDF old"})})
+    sync_pdf_attachments(tmp_path, mail=mail)
+
+    # the mailbox was rebuilt, uids restart and the old high-water mark no longer applies
+    mail = FakeIMAP({1: (pdf_part("invoice_1.pdf"), {"1": b"%PDF new"})}, uidvalidity="2")
+    saved = sync_pdf_attachments(tmp_path, mail=mail)
+
+    assert mail.searches == ["UID 1:*"]
+    assert [path.name for path in saved] == ["1_invoice_1.pdf"]
+    assert saved[0].read_bytes() == b"%PDF new"
+    assert json.loads((tmp_path / ".imap_sync_state.json").read_text()) == {"uidvalidity": "2", "last_uid": 1}
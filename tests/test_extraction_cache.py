@@ -0,0 +1,70 @@
+import os
+import shutil
+from pathlib import Path
+import parse_pdfs
+from utils.extraction_cache import ExtractionCache
+
+UPLOADS = Path(__file__).resolve().parent.parent / "uploads"
+
+def counting_extract(monkeypatch):
+    calls = []
+    extract = parse_pdfs.extract_text
+
+    def extract_text(pdf_path):
+        calls.append(Path(pdf_path).name)
+        return extract(pdf_path)
+
+    monkeypatch.setattr(parse_pdfs, "extract_text", extract_text)
+    return calls
+
+def test_unchanged_pdf_is_read_once(tmp_path, monkeypatch):
+    calls = counting_extract(monkeypatch)
+    cache = ExtractionCache("test-1", tmp_path / "cache")
+    pdf = UPLOADS / "sample_invoice.pdf"
+
+    text, parsed = parse_pdfs.extract_and_parse(pdf, "first_document", cache)
+    cached_text, cached = parse_pdfs.extract_and_parse(pdf, "second_document", cache)
+    assert calls == ["sample_invoice.pdf"]
+    assert cached_text == text
+    assert cached == {**parsed, "document_position": "second_document"}
+
+    # keyed by content, a renamed copy is a hit too
+    shutil.copy(pdf, tmp_path / "renamed.pdf")
+    parse_pdfs.extract_and_parse(tmp_path / "renamed.pdf", "batch_document", cache)
+    assert calls == ["sample_invoice.pdf"]
+
+def test_changed_content_or_version_misses(tmp_path, monkeypatch):
+    calls = counting_extract(monkeypatch)
+    pdf = tmp_path / "invoice.pdf"
+    shutil.copy(UPLOADS / "sample_invoice.pdf", pdf)
+    parse_pdfs.extract_and_parse(pdf, "batch_document", ExtractionCache("test-1", tmp_path / "cache"))
+
+    parse_pdfs.extract_and_parse(pdf, "batch_document", ExtractionCache("test-2", tmp_path / "cache"))
+    assert len(calls) == 2
+
+    shutil.copy(UPLOADS / "sample_delivery_docket.pdf", pdf)
+    parse_pdfs.extract_and_parse(pdf, "batch_document", ExtractionCache("test-2", tmp_path / "cache"))
+    assert len(calls) == 3
+
+def test_failed_extraction_is_not_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(parse_pdfs, "extract_text", lambda pdf_path: (f"error reading {pdf_path}: broken", []))
+    cache = ExtractionCache("test-1", tmp_path / "cache")
+    pdf = UPLOADS / "sample_invoice.pdf"
+    parse_pdfs.extract_and_parse(pdf, "batch_document", cache)
+    assert cache.get(cache.key_for(pdf)) is None
+
+def test_evict_removes_least_recently_used(tmp_path):
+    cache = ExtractionCache("test-1", tmp_path / "cache")
+    for i, key in enumerate(["aa-old", "bb-used", "cc-new"]):
+        cache.put(key, {"text": "x" * 1000})
+        entry_path = cache._entry_path(key)
+        os.utime(entry_path, (1000 + i, 1000 + i))
+    # reading an entry makes it the most recently used
+    assert cache.get("aa-old") is not None
+
+    entry_size = cache._entry_path("bb-used").stat().st_size
+    cache.max_bytes = entry_size * 2
+    assert cache.evict() == 1
+    assert cache.get("bb-used") is None
+    assert cache.get("aa-old") is not None and cache.get("cc-new") is not None
+    assert cache.evict() == 0
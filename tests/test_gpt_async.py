@@ -0,0 +1,113 @@
+import asyncio
+import json
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+# gpt modules build an api client at import, requests go to the stub server below
+os.environ.setdefault("OPENAI_API_KEY", "test-stub")
+
+import gpt_reconcile
+from utils.gpt_async import AsyncGPTRunner, make_async_client
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    openai compatible chat completions endpoint: rate limits the first `fail_first` requests,
+    then answers reconcile prompts with a reconciled result for the invoice number in the prompt
+    """
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server = self.server
+        with server.lock:
+            server.calls += 1
+            rate_limited = server.calls <= server.fail_first
+        if rate_limited:
+            self._send(429, {"error": {"message": "rate limited", "type": "rate_limit_error"}}, {"retry-after": "0"})
+            return
+
+        prompt = body["messages"][-1]["content"]
+        invoice_number = re.search(r"INV-\d+", prompt).group(0)
+        result = {"invoice_number": invoice_number, "reconciliation_status": "reconciled",
+                  "matched_items": [], "discrepancies": [], "summary": "stubbed"}
+        self._send(200, {
+            "id": "stub", "object": "chat.completion", "created": 0, "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": f"{json.dumps(result)}\n\nStubbed summary."}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 10, "total_tokens": 20}
+        })
+
+    def _send(self, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.calls = 0
+    server.fail_first = 0
+    server.lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def runner_for(server, **kwargs):
+    client = make_async_client(f"http://127.0.0.1:{server.server_address[1]}/v1")
+    return AsyncGPTRunner(client, base_delay=0.01, **kwargs)
+
+def test_retry_charges_the_rate_limit_per_attempt(stub_server):
+    stub_server.fail_first = 1
+    runner = runner_for(stub_server, rpm=60)
+
+    content = asyncio.run(runner.complete("reconcile INV-1", gpt_reconcile.GPT_MODEL, 0))
+    assert json.loads(content.split("\n\n")[0])["invoice_number"] == "INV-1"
+    assert stub_server.calls == 2
+    # both attempts were taken from the requests per minute bucket
+    assert runner.request_bucket.tokens < 59
+
+def write_group(parsed_dir, number):
+    paths = []
+    for name, document_type in ((f"invoice{number}", "invoice"), (f"docket{number}", "delivery_docket")):
+        doc = {"document_type": document_type, "invoice_number": f"INV-{number}", "supplier_name": "Acme",
+               "job_code": "J1", "source_file": f"{name}.pdf",
+               "line_items": [{"description": "Steel mesh", "quantity": 4}]}
+        path = parsed_dir / f"{name}_parsed.json"
+        path.write_text(json.dumps(doc))
+        (parsed_dir / f"{name}_text.txt").write_text(f"INV-{number} Steel mesh 4")
+        paths.append((path, doc))
+    return paths[0], [paths[1]]
+
+def test_batch_reconcile_streams_results_to_disk(stub_server, tmp_path, monkeypatch):
+    sheet_rows = []
+    monkeypatch.setattr(gpt_reconcile, "write_reconciliation_to_sheet", sheet_rows.append)
+    monkeypatch.setattr(gpt_reconcile, "send_email", lambda *args, **kwargs: None)
+    stub_server.fail_first = 1
+    parsed_dir = tmp_path / "parsed"
+    reconciled_dir = tmp_path / "reconciled"
+    parsed_dir.mkdir()
+    reconciled_dir.mkdir()
+    groups = [write_group(parsed_dir, number) for number in (1, 2)]
+
+    result_paths = asyncio.run(gpt_reconcile.reconcile_batch_async(groups, reconciled_dir, runner_for(stub_server)))
+    assert sorted(path.name for path in result_paths) == ["INV-1_reconciled.json", "INV-2_reconciled.json"]
+    assert len(sheet_rows) == 2
+    result = json.loads((reconciled_dir / "INV-1_reconciled.json").read_text())
+    assert result["reconciliation_state"]["documents"] == ["docket1.pdf"]
+
+    # nothing new in the groups, so a second run sends nothing
+    calls = stub_server.calls
+    assert asyncio.run(gpt_reconcile.reconcile_batch_async(groups, reconciled_dir, runner_for(stub_server))) == []
+    assert stub_server.calls == calls
@@ -0,0 +1,82 @@
+import asyncio
+import json
+import os
+import shutil
+from pathlib import Path
+import pytest
+
+# gpt modules build an api client at import, it is replaced with a fake below
+os.environ.setdefault("OPENAI_API_KEY", "test-stub")
+
+import gpt_parse
+from utils.gpt_async import AsyncGPTRunner
+from utils.gpt_cache import GPTResponseCache
+
+UPLOADS = Path(__file__).resolve().parent.parent / "uploads"
+
+def parse_reply(fake_openai):
+    def respond(prompt):
+        number = "INV-2" if "Delivery Docket" in prompt else "INV-1"
+        return fake_openai.completion(json.dumps({"invoice_number": number, "line_items": []}))
+    return respond
+
+@pytest.fixture
+def response_cache(tmp_path):
+    cache = GPTResponseCache(tmp_path / "responses.sqlite3")
+    yield cache
+    cache.close()
+
+def test_cached_response_skips_the_call(fake_openai, response_cache, monkeypatch):
+    client = fake_openai(parse_reply(fake_openai))
+    monkeypatch.setattr(gpt_parse, "client", client)
+
+    first = gpt_parse.parse_with_gpt("Tax Invoice INV-1", response_cache)
+    second = gpt_parse.parse_with_gpt("Tax Invoice INV-1", response_cache)
+    assert len(client.prompts) == 1
+    assert second == first == {"invoice_number": "INV-1", "line_items": [], "document_type": "invoice"}
+
+    # a different text is a miss
+    gpt_parse.parse_with_gpt("Tax Invoice INV-1 revised", response_cache)
+    assert len(client.prompts) == 2
+
+def test_invalid_response_is_not_cached(fake_openai, response_cache, monkeypatch):
+    client = fake_openai(lambda prompt: fake_openai.completion("not json"))
+    monkeypatch.setattr(gpt_parse, "client", client)
+
+    assert gpt_parse.parse_with_gpt("Tax Invoice INV-1", response_cache) == {}
+    assert gpt_parse.parse_with_gpt("Tax Invoice INV-1", response_cache) == {}
+    assert len(client.prompts) == 2
+
+def copy_batch(tmp_path):
+    batch = tmp_path / "batch"
+    batch.mkdir()
+    for name in ("a", "b"):
+        shutil.copy(UPLOADS / "sample_invoice.pdf", batch / f"invoice_{name}.pdf")
+    shutil.copy(UPLOADS / "sample_delivery_docket.pdf", batch / "docket.pdf")
+    return sorted(batch.glob("*.pdf"))
+
+def test_identical_documents_share_one_call(fake_openai, tmp_path, monkeypatch):
+    client = fake_openai(parse_reply(fake_openai))
+    monkeypatch.setattr(gpt_parse, "client", client)
+    output = tmp_path / "parsed"
+
+    assert gpt_parse.run_batch(copy_batch(tmp_path), output, workers=1) == 3
+    assert len(client.prompts) == 2
+    parsed = {path.name: json.loads(path.read_text()) for path in output.glob("*_parsed.json")}
+    assert parsed["invoice_a_parsed.json"]["source_file"] == "invoice_a.pdf"
+    assert parsed["invoice_b_parsed.json"]["source_file"] == "invoice_b.pdf"
+
+def test_identical_documents_share_one_async_request(fake_openai, response_cache, tmp_path):
+    client = fake_openai(parse_reply(fake_openai), is_async=True)
+    runner = AsyncGPTRunner(client)
+    pdf_paths = copy_batch(tmp_path)
+
+    count = asyncio.run(gpt_parse.run_batch_async(pdf_paths, tmp_path / "parsed", workers=1,
+                                                  response_cache=response_cache, runner=runner))
+    assert count == 3
+    assert len(client.prompts) == 2
+
+    # the responses were cached, so a second run sends nothing
+    asyncio.run(gpt_parse.run_batch_async(pdf_paths, tmp_path / "parsed_again", workers=1,
+                                          response_cache=response_cache, runner=runner))
+    assert len(client.prompts) == 2
@@ -0,0 +1,62 @@
+import json
+import os
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "test-stub")
+
+from gpt_reconcile import PromptBudgetError, build_reconcile_prompt, prematch_line_items
+
+def write_pair(tmp_path, lines, raw_text="", job_code="J1"):
+    paths = []
+    for name, document_type, quantity in (("invoice", "invoice", 1), ("docket", "delivery_docket", 2)):
+        doc = {"document_type": document_type, "invoice_number": "INV-1", "supplier_name": "Acme", "job_code": job_code,
+               "notes": "delivered to site office " * 5,
+               "line_items": [{"description": f"Item {i}", "quantity": quantity, "line_total": 10.0, "sku": f"SKU-{i}"}
+                              for i in range(lines)]}
+        json_path = tmp_path / f"{name}_parsed.json"
+        text_path = tmp_path / f"{name}_text.txt"
+        json_path.write_text(json.dumps(doc))
+        text_path.write_text(raw_text)
+        paths.append((json_path, text_path))
+    (invoice_json, invoice_txt), (docket_json, docket_txt) = paths
+    return invoice_json, docket_json, invoice_txt, docket_txt
+
+def test_json_over_budget_keeps_only_essential_fields(tmp_path):
+    paths = write_pair(tmp_path, 20)
+    full = build_reconcile_prompt(*paths, token_budget=100000)
+    budget = full["prompt_tokens"] - 1
+
+    context = build_reconcile_prompt(*paths, token_budget=budget)
+    assert context["prompt_tokens"] <= budget
+    assert "SKU-0" not in context["prompt"] and "site office" not in context["prompt"]
+    assert "Item 19" in context["prompt"]
+
+def test_json_that_cannot_fit_fails(tmp_path):
+    with pytest.raises(PromptBudgetError):
+        build_reconcile_prompt(*write_pair(tmp_path, 200), token_budget=1000)
+
+def test_raw_text_never_exceeds_budget(tmp_path):
+    raw_text = "\n".join(f"line {i} of the scanned docket text" for i in range(500))
+    paths = write_pair(tmp_path, 3, raw_text, job_code=None)
+    context = build_reconcile_prompt(*paths, token_budget=1500)
+    assert "Raw invoice text" in context["prompt"]
+    assert context["prompt_tokens"] <= 1500
+
+def test_prematch_leaves_incomplete_lines_to_the_model():
+    invoice = [{"description": "Concrete 32MPa", "quantity": 6}, {"description": "Steel mesh"}, {"quantity": 2}]
+    docket = [{"description": "Concrete 32MPa", "quantity": 6}, {"description": "Steel mesh", "quantity": 4}]
+
+    matched, remaining_invoice, remaining_docket = prematch_line_items(invoice, docket)
+    assert [item["invoice_description"] for item in matched] == ["Concrete 32MPa"]
+    assert remaining_invoice == invoice[1:]
+    assert remaining_docket == docket[1:]
+
+def test_prematch_skips_lines_repeated_within_one_document():
+    invoice = [{"description": "Steel mesh", "quantity": 4}, {"description": "Steel mesh", "quantity": 4},
+               {"description": "Tie wire", "quantity": 2}]
+    docket = [{"description": "Steel mesh", "quantity": 4}, {"description": "Tie wire", "quantity": 2}]
+
+    # the repeated mesh line may be a duplicate charge, only the model can flag it
+    matched, remaining_invoice, remaining_docket = prematch_line_items(invoice, docket)
+    assert [item["invoice_description"] for item in matched] == ["Tie wire"]
+    assert len(remaining_invoice) == 2 and remaining_docket == docket[:1]
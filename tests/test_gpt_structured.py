@@ -0,0 +1,71 @@
+import asyncio
+import os
+import pytest
+
+# gpt modules build an api client at import, it is replaced with a fake below
+os.environ.setdefault("OPENAI_API_KEY", "test-stub")
+
+import gpt_parse
+from utils.gpt_async import AsyncGPTRunner
+from utils.gpt_cache import GPTResponseCache
+from utils.gpt_structured import StructuredOutputError, parse_structured
+from utils.schemas import ParsedDocument
+
+VALID = ParsedDocument(invoice_number="INV-1", document_type="invoice",
+                       line_items=[{"description": "Bolts", "quantity": 2}])
+
+def replies(fake_openai, *answers):
+    """
+    answers in order: None is a refusal, "invalid" a reply that fails validation, anything else is parsed
+    """
+    answers = list(answers)
+
+    def respond(prompt):
+        answer = answers.pop(0)
+        if answer == "invalid":
+            ParsedDocument.model_validate({"document_type": "receipt"})
+        if answer is None:
+            return fake_openai.completion(refusal="can't help with that")
+        return fake_openai.completion(parsed=answer)
+    return respond
+
+def test_invalid_and_refused_output_is_retried(fake_openai):
+    client = fake_openai(replies(fake_openai, None, "invalid", VALID))
+    assert parse_structured(client, "prompt", "gpt-4.1", 0.2, ParsedDocument) == VALID
+    assert len(client.prompts) == 3
+
+def test_retries_run_out(fake_openai):
+    client = fake_openai(replies(fake_openai, None, "invalid", VALID))
+    with pytest.raises(StructuredOutputError, match="no valid ParsedDocument after 2 attempts"):
+        parse_structured(client, "prompt", "gpt-4.1", 0.2, ParsedDocument, max_attempts=2)
+    assert len(client.prompts) == 2
+
+def test_async_runner_retries_the_same_way(fake_openai):
+    client = fake_openai(replies(fake_openai, "invalid", VALID), is_async=True)
+    runner = AsyncGPTRunner(client)
+    assert asyncio.run(runner.complete_structured("prompt", "gpt-4.1", 0.2, ParsedDocument)) == VALID
+    assert len(client.prompts) == 2
+
+    client = fake_openai(replies(fake_openai, None, None), is_async=True)
+    runner = AsyncGPTRunner(client)
+    with pytest.raises(StructuredOutputError, match="model refused: can't help with that"):
+        asyncio.run(runner.complete_structured("prompt", "gpt-4.1", 0.2, ParsedDocument, max_attempts=2))
+
+def test_structured_parse_caches_only_valid_documents(fake_openai, tmp_path, monkeypatch):
+    cache = GPTResponseCache(tmp_path / "responses.sqlite3")
+    client = fake_openai(replies(fake_openai, *[None] * 3, VALID))
+    monkeypatch.setattr(gpt_parse, "client", client)
+
+    # every attempt refused, the document is given up on and nothing is cached
+    assert gpt_parse.parse_with_gpt("Tax Invoice INV-1", cache, structured=True) == {}
+    parsed = gpt_parse.parse_with_gpt("Tax Invoice INV-1", cache, structured=True)
+    assert parsed["invoice_number"] == "INV-1"
+    assert parsed["line_items"] == [{"description": "Bolts", "quantity": 2, "unit_price": None, "line_total": None}]
+    assert len(client.prompts) == 4
+
+    assert gpt_parse.parse_with_gpt("Tax Invoice INV-1", cache, structured=True) == parsed
+    # free-form responses are cached under their own prompt version
+    assert cache.get(GPTResponseCache.make_key(gpt_parse.GPT_MODEL, gpt_parse.GPT_TEMPERATURE,
+                                               gpt_parse.PROMPT_VERSION, "Tax Invoice INV-1")) is None
+    assert len(client.prompts) == 4
+    cache.close()
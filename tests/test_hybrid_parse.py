@@ -0,0 +1,75 @@
+import json
+import os
+import pytest
+
+# gpt modules build an api client at import, it is replaced with a fake below
+os.environ.setdefault("OPENAI_API_KEY", "test-stub")
+
+import gpt_parse
+import hybrid_parse
+
+INVOICE_TEXT = "Supplier: Acme\nInvoice Number: INV-1\nSubtotal: $30.00"
+
+def invoice(**overrides):
+    parsed = {"supplier_name": "Acme", "invoice_number": "INV-1", "document_type": "invoice",
+              "document_position": "batch_document",
+              "line_items": [{"description": "Bolts", "quantity": 2, "unit_price": 10.0},
+                             {"description": "Nuts", "quantity": 1, "unit_price": 10.0}]}
+    return {**parsed, **overrides}
+
+def test_complete_invoice_scores_full_marks():
+    score, checks = hybrid_parse.score_native_result(invoice(), INVOICE_TEXT)
+    assert score == 1.0
+    assert checks["totals_consistent"] is True
+
+def test_failed_checks_lose_their_weight():
+    # line items no longer add up to the subtotal
+    score, checks = hybrid_parse.score_native_result(invoice(), INVOICE_TEXT.replace("30.00", "45.00"))
+    assert checks["totals_consistent"] is False
+    assert score == pytest.approx(1 - hybrid_parse.CHECK_WEIGHTS["totals_consistent"])
+
+    # without items the totals can't be checked, so only the remaining weights count
+    score, _ = hybrid_parse.score_native_result(invoice(invoice_number=None, line_items=[]), INVOICE_TEXT)
+    weights = hybrid_parse.CHECK_WEIGHTS
+    assert score == pytest.approx(weights["supplier_name"] / (1 - weights["totals_consistent"]), abs=1e-3)
+
+def test_unpriced_docket_leaves_the_totals_check_out():
+    docket = invoice(line_items=[{"description": "Bolts", "quantity": 2}], document_type="delivery_docket")
+    score, checks = hybrid_parse.score_native_result(docket, "Invoice Number: INV-1")
+    assert checks["totals_consistent"] is None
+    assert score == 1.0
+
+@pytest.fixture
+def gpt_client(fake_openai, monkeypatch):
+    reply = {"invoice_number": "INV-1", "supplier_name": "Acme", "document_type": "other",
+             "line_items": [{"description": "Bolts", "quantity": 2}]}
+    client = fake_openai(lambda prompt: fake_openai.completion(json.dumps(reply)))
+    monkeypatch.setattr(gpt_parse, "client", client)
+    return client
+
+def test_confident_document_stays_native(gpt_client):
+    routed = hybrid_parse.route_document(INVOICE_TEXT, invoice())
+    assert routed["parse_route"]["method"] == "native"
+    assert gpt_client.prompts == []
+
+def test_threshold_decides_escalation(gpt_client):
+    text = INVOICE_TEXT.replace("30.00", "45.00")
+    assert hybrid_parse.route_document(text, invoice(), threshold=0.8)["parse_route"]["method"] == "native"
+
+    routed = hybrid_parse.route_document(text, invoice(), threshold=0.9)
+    assert len(gpt_client.prompts) == 1
+    assert routed["parse_route"] == {"method": "gpt", "confidence": 0.8, "threshold": 0.9,
+                                     "checks": {"invoice_number": True, "supplier_name": True,
+                                                "line_items": True, "totals_consistent": False}}
+    # grouping keys off the natively detected type and position
+    assert routed["document_type"] == "invoice"
+    assert routed["document_position"] == "batch_document"
+    assert routed["line_items"] == [{"description": "Bolts", "quantity": 2}]
+
+def test_failed_escalation_keeps_the_native_result(fake_openai, monkeypatch):
+    monkeypatch.setattr(gpt_parse, "client", fake_openai(lambda prompt: fake_openai.completion("not json")))
+    native = invoice(invoice_number=None)
+    routed = hybrid_parse.route_document(INVOICE_TEXT, native)
+    assert routed["parse_route"]["method"] == "native"
+    assert routed["parse_route"]["gpt_failed"] is True
+    assert routed["supplier_name"] == "Acme" and routed["invoice_number"] is None
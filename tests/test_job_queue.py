@@ -0,0 +1,43 @@
+import time
+from utils.job_queue import JobQueue, PARSED, UNPAIRED
+
+def test_partner_waits_end_in_unpaired(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.sqlite3", max_partner_waits=3)
+    queue.enqueue(tmp_path / "docket.pdf", "native")
+    job = queue.claim("parse")
+    queue.complete(job["id"], PARSED, parsed_path="docket_parsed.json")
+
+    states = []
+    for _ in range(3):
+        job = queue.claim("reconcile")
+        states.append(queue.release(job["id"], "reconcile"))
+
+    assert states == [PARSED, PARSED, UNPAIRED]
+    assert queue.claim("reconcile") is None
+    assert queue.counts() == {UNPAIRED: 1}
+
+def test_release_does_not_use_up_attempts(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.sqlite3", max_attempts=1, max_partner_waits=5)
+    queue.enqueue(tmp_path / "invoice.pdf", "native")
+    queue.complete(queue.claim("parse")["id"], PARSED, parsed_path="invoice_parsed.json")
+
+    for _ in range(2):
+        job = queue.claim("reconcile")
+        assert job is not None
+        queue.release(job["id"], "reconcile")
+
+def test_heartbeat_keeps_job_and_lock_past_the_timeout(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.sqlite3", visibility_timeout=0.3)
+    other = JobQueue(tmp_path / "jobs.sqlite3", visibility_timeout=0.3)
+    queue.enqueue(tmp_path / "invoice.pdf", "native")
+    job = queue.claim("parse")
+
+    with queue.keep_alive(job["id"], interval=0.05), queue.lock("reconcile:native:invoice_parsed.json"):
+        time.sleep(1)
+        assert other.claim("parse") is None
+        lock = other.conn.execute("SELECT owner, expires_at FROM locks").fetchone()
+        assert lock["owner"] == queue.owner and lock["expires_at"] > time.time()
+
+    # without the heartbeat the lease runs out and the job is claimable again
+    time.sleep(0.4)
+    assert other.claim("parse")["id"] == job["id"]
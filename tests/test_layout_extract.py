@@ -0,0 +1,45 @@
+import pymupdf
+from utils.layout_extract import LayoutItemReader, extract_layout_line_items
+
+COLUMNS = (50, 300, 360, 440)
+
+def write_row(page, y, cells):
+    for x, text in zip(COLUMNS, cells):
+        if text:
+            page.insert_text((x, y), text, fontsize=10)
+
+def test_word_layout_across_pages(tmp_path):
+    doc = pymupdf.open()
+    page = doc.new_page()
+    page.insert_text((50, 60), "Page 1 of 2", fontsize=10)
+    write_row(page, 100, ["Description", "Qty", "Unit Price", "Amount"])
+    write_row(page, 120, ["Ready mix concrete 32MPa", "2.5", "210.00", "525.00"])
+    write_row(page, 132, ["with pump hire and washout", None, None, None])
+    write_row(page, 152, ["Steel mesh SL82", "4", "95.00", "380.00"])
+
+    page = doc.new_page()
+    page.insert_text((50, 60), "Page 2 of 2", fontsize=10)
+    write_row(page, 100, ["Bar chairs 50mm", "200", "0.40", "80.00"])
+    write_row(page, 130, ["Subtotal", None, None, "985.00"])
+    write_row(page, 160, ["Thank you for your business", None, None, None])
+    path = tmp_path / "layout.pdf"
+    doc.save(path)
+
+    items = extract_layout_line_items(path)
+    assert items == [
+        {"description": "Ready mix concrete 32MPa with pump hire and washout", "quantity": 2.5,
+         "unit_price": 210.0, "line_total": 525.0},
+        {"description": "Steel mesh SL82", "quantity": 4, "unit_price": 95.0, "line_total": 380.0},
+        {"description": "Bar chairs 50mm", "quantity": 200, "unit_price": 0.4, "line_total": 80.0},
+    ]
+    assert isinstance(items[1]["quantity"], int)
+
+def test_table_continued_without_header_keeps_columns():
+    reader = LayoutItemReader()
+    reader.add_table_rows([["Qty", "Description"], ["3", "Formply sheet"], ["", "17mm F17"]])
+    reader.add_table_rows([["1.5", "Plasterboard"], ["Total", ""]])
+    reader.add_table_rows([["7", "Not an item"]])
+    assert reader.items == [
+        {"description": "Formply sheet 17mm F17", "quantity": 3},
+        {"description": "Plasterboard", "quantity": 1.5},
+    ]
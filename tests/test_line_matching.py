@@ -0,0 +1,66 @@
+import itertools
+import numpy as np
+import pytest
+from reconcile import compare_line_items
+from utils.line_matching import linear_sum_assignment, match_descriptions
+
+def brute_force_cost(cost):
+    """
+    the cheapest total over every way of assigning the smaller side one-to-one into the larger
+    """
+    rows, cols = cost.shape
+    if rows <= cols:
+        return min(sum(cost[r, c] for r, c in enumerate(perm)) for perm in itertools.permutations(range(cols), rows))
+    return min(sum(cost[r, c] for c, r in enumerate(perm)) for perm in itertools.permutations(range(rows), cols))
+
+@pytest.mark.parametrize("shape", [(1, 1), (3, 3), (2, 5), (5, 2), (4, 6), (6, 4)])
+def test_assignment_is_optimal_on_rectangular_matrices(shape):
+    rng = np.random.default_rng(sum(shape))
+    for _ in range(20):
+        cost = rng.integers(0, 10, size=shape).astype(float)
+        rows, cols = linear_sum_assignment(cost)
+
+        assert len(rows) == min(shape)
+        assert len(set(rows)) == len(rows) and len(set(cols)) == len(cols)
+        assert list(rows) == sorted(rows)
+        assert cost[rows, cols].sum() == pytest.approx(brute_force_cost(cost))
+
+def test_empty_cost_matrix():
+    rows, cols = linear_sum_assignment(np.zeros((0, 3)))
+    assert len(rows) == len(cols) == 0
+
+def test_global_assignment_beats_greedy_choice():
+    # greedy would give the first invoice line its best docket line and leave the second one unmatched
+    pairs = match_descriptions(["Steel mesh sheet", "Steel mesh"], ["Steel mesh", "Steel mesh sheets"], 0.5)
+    assert sorted((left, right) for left, right, _ in pairs) == [(0, 1), (1, 0)]
+
+def test_pairs_under_threshold_are_dropped():
+    left, right = ["Concrete 32MPa", "Switch plate 2 gang"], ["Concrete 32 MPa", "Reinforcing bar"]
+    pairs = match_descriptions(left, right, 0.8)
+    assert [(l, r) for l, r, _ in pairs] == [(0, 0)]
+    assert all(score >= 0.8 for _, _, score in pairs)
+
+    # a threshold nothing reaches matches nothing, a zero threshold pairs everything it can
+    assert match_descriptions(left, right, 1.01) == []
+    assert len(match_descriptions(left, right, 0.0)) == 2
+    assert match_descriptions([], right, 0.5) == []
+
+def test_compare_line_items_ignores_line_order():
+    invoice = [{"description": "Concrete 32MPa", "quantity": 6}, {"description": "Steel mesh", "quantity": 4},
+               {"description": "Switch Plate - 2 Gang", "quantity": 10}, {"description": "Tie wire", "quantity": 2}]
+    docket = [{"description": "2-Gang Switch Plate", "quantity": 10}, {"description": "STEEL MESH", "quantity": 3},
+              {"description": "Concrete 32 MPa", "quantity": 6}, {"description": "Formwork ply", "quantity": 1}]
+
+    def outcome(invoice_items, docket_items):
+        matched, discrepancies = compare_line_items(invoice_items, docket_items)
+        return (sorted(item["description"] for item in matched),
+                sorted((d["description"], d["issue"]) for d in discrepancies))
+
+    expected = outcome(invoice, docket)
+    assert expected == (
+        ["Concrete 32MPa", "Switch Plate - 2 Gang"],
+        [("Formwork ply", "Extra item in delivery not invoiced"), ("Steel mesh", "Quantity mismatch"),
+         ("Tie wire", "Missing from delivery document")]
+    )
+    for invoice_order, docket_order in zip(itertools.permutations(invoice), itertools.permutations(docket)):
+        assert outcome(list(invoice_order), list(docket_order)) == expected
@@ -0,0 +1,103 @@
+import email
+import smtplib
+import socket
+import pytest
+from utils.mailer import DigestMailer, Mailer
+
+# local smtp server for the tests, not a runtime dependency
+Controller = pytest.importorskip("aiosmtpd.controller").Controller
+
+class RecordingHandler:
+    def __init__(self):
+        self.messages = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if not address.endswith("@example.com"):
+            return "550 unknown recipient"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(email.message_from_bytes(envelope.content))
+        return "250 OK"
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+@pytest.fixture
+def smtp_server():
+    handler = RecordingHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    yield controller
+    controller.stop()
+
+def counting_smtp():
+    """
+    plain smtp client class that records every connection it opens
+    """
+    connections = []
+
+    class CountingSMTP(smtplib.SMTP):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            connections.append(self)
+
+    return CountingSMTP, connections
+
+def mailer_for(server, smtp_class):
+    # no password, so the local server is not asked to authenticate
+    return Mailer("sender@example.com", "", "accounts@example.com", host=server.hostname, port=server.port,
+                  smtp_class=smtp_class)
+
+def test_one_session_is_reused_across_sends(smtp_server):
+    smtp_class, connections = counting_smtp()
+    with mailer_for(smtp_server, smtp_class) as mailer:
+        for number in range(3):
+            mailer.send(f"Reconciliation INV-{number}", "ok")
+
+    assert len(connections) == 1
+    assert [msg["Subject"] for msg in smtp_server.handler.messages] == [
+        "Reconciliation INV-0", "Reconciliation INV-1", "Reconciliation INV-2"]
+
+def test_dropped_session_reconnects_once(smtp_server):
+    smtp_class, connections = counting_smtp()
+    with mailer_for(smtp_server, smtp_class) as mailer:
+        mailer.send("first", "ok")
+        # the server side going away looks like a dead socket to the client
+        mailer.smtp.sock.shutdown(socket.SHUT_RDWR)
+        mailer.send("second", "ok")
+
+    assert len(connections) == 2
+    assert [msg["Subject"] for msg in smtp_server.handler.messages] == ["first", "second"]
+
+def test_refused_recipient_is_not_retried(smtp_server):
+    smtp_class, connections = counting_smtp()
+    mailer = mailer_for(smtp_server, smtp_class)
+    mailer.recipient = "someone@elsewhere.test"
+    with pytest.raises(smtplib.SMTPRecipientsRefused):
+        mailer.send("refused", "ok")
+    assert len(connections) == 1
+    mailer.close()
+
+def test_digest_sends_one_message_with_every_attachment(smtp_server, tmp_path):
+    smtp_class, _ = counting_smtp()
+    digest = DigestMailer(mailer_for(smtp_server, smtp_class), subject="Nightly digest")
+    for number in (1, 2):
+        path = tmp_path / f"INV-{number}_reconciled.json"
+        path.write_text("{}")
+        digest.add(f"Reconciliation INV-{number}", "reconciled", path)
+    digest.add("Reconciliation INV-3", "no attachment")
+
+    assert digest.flush() == 3
+    assert digest.flush() == 0
+    digest.mailer.close()
+
+    [msg] = smtp_server.handler.messages
+    assert msg["Subject"] == "Nightly digest: 3 reconciliation(s)"
+    body = next(part for part in msg.walk() if part.get_content_type() == "text/plain").get_payload()
+    assert "Reconciliation INV-3" in body
+    assert [part.get_filename() for part in msg.walk() if part.get_filename()] == [
+        "INV-1_reconciled.json", "INV-2_reconciled.json"]
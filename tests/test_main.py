@@ -0,0 +1,40 @@
+import json
+import os
+from pathlib import Path
+
+# gpt modules build an api client at import, nothing here reaches it
+os.environ.setdefault("OPENAI_API_KEY", "test-stub")
+
+import main
+
+def write_parsed(parsed_dir, name, document_type, invoice_number):
+    doc = {"document_type": document_type, "invoice_number": invoice_number, "source_file": f"{name}.pdf",
+           "line_items": [{"description": "Steel mesh", "quantity": 4}]}
+    (parsed_dir / f"{name}_parsed.json").write_text(json.dumps(doc))
+
+def test_inbox_gpt_groups_are_reconciled_with_gpt(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    parsed_dir, reconciled_dir = main.determine_output_dirs("inbox", "gpt")
+    # INV-1 was reconciled on an earlier run, only INV-2 gained a document
+    write_parsed(parsed_dir, "invoice1", "invoice", "INV-1")
+    write_parsed(parsed_dir, "docket1", "delivery_docket", "INV-1")
+    write_parsed(parsed_dir, "invoice2", "invoice", "INV-2")
+
+    def parse_batch(paths, parsed_dir):
+        write_parsed(parsed_dir, "docket2", "delivery_docket", "INV-2")
+
+    batches = []
+    async def reconcile_batch(groups, reconciled_dir, runner=None, token_budget=None, structured=False, digest=None):
+        batches.append([invoice_path.name for (invoice_path, _), _ in groups])
+        return [reconciled_dir / "INV-2_reconciled.json"]
+
+    monkeypatch.setattr(main, "sync_pdf_attachments", lambda path: [Path("email_uploads/docket2.pdf")])
+    monkeypatch.setattr(main, "gpt_parse_batch", parse_batch)
+    monkeypatch.setattr(main, "reconcile_batch_async", reconcile_batch)
+    monkeypatch.setattr(main, "reconcile_parsed_groups", matched_natively)
+
+    main.reconcile_inbox("gpt", parsed_dir, reconciled_dir)
+    assert batches == [["invoice2_parsed.json"]]
+
+def matched_natively(*args, **kwargs):
+    raise AssertionError("gpt inbox groups must not be matched natively")
@@ -0,0 +1,74 @@
+import os
+import pytest
+from utils import ocr
+from utils.batch_utils import run_in_pool
+
+class FakePixmap:
+    width = 10
+    height = 10
+    samples = b"scan"
+
+    def __init__(self, error):
+        self.error = error
+
+    def pdfocr_tobytes(self, language):
+        raise self.error
+
+class FakePage:
+    number = 0
+
+    def __init__(self, error):
+        self.error = error
+
+    def get_pixmap(self, dpi):
+        return FakePixmap(self.error)
+
+@pytest.fixture(autouse=True)
+def isolated_ocr(tmp_path, monkeypatch):
+    monkeypatch.setattr(ocr, "OCR_CACHE_DIR", tmp_path / "ocr")
+    monkeypatch.setattr(ocr, "_ocr_unavailable", False)
+    monkeypatch.setattr(ocr, "_tesseract_checked", False)
+
+def test_missing_tesseract_disables_ocr():
+    error = RuntimeError("No tessdata specified and Tesseract is not installed")
+    assert ocr.ocr_page(FakePage(error)) == ""
+    assert ocr._ocr_unavailable
+
+def test_page_error_only_skips_the_page(tmp_path):
+    assert ocr.ocr_page(FakePage(ValueError("corrupt image data"))) == ""
+    assert not ocr._ocr_unavailable
+    # failures are never cached
+    assert not (tmp_path / "ocr").exists()
+
+def scanned_pdf(path):
+    doc = ocr.pymupdf.open()
+    page = doc.new_page()
+    pixmap = ocr.pymupdf.Pixmap(ocr.pymupdf.csRGB, ocr.pymupdf.IRect(0, 0, 10, 10))
+    pixmap.clear_with(255)
+    page.insert_image(page.rect, pixmap=pixmap)
+    doc.save(path)
+    doc.close()
+    return path
+
+def test_tesseract_is_looked_for_once_before_the_pool(tmp_path, monkeypatch):
+    lookups = []
+
+    def get_tessdata():
+        lookups.append(1)
+        raise RuntimeError("No tessdata specified and Tesseract is not installed")
+
+    monkeypatch.setattr(ocr.pymupdf, "get_tessdata", get_tessdata)
+    monkeypatch.setattr(ocr, "ocr_pages", lambda *args, **kwargs: pytest.fail("no workers without tesseract"))
+    pdf = scanned_pdf(tmp_path / "scan.pdf")
+    assert ocr.extract_page_texts(pdf) == ([""], [0])
+    assert ocr.extract_page_texts(pdf) == ([""], [0])
+    assert len(lookups) == 1
+
+def test_thread_limit_is_set_in_the_workers_only(monkeypatch):
+    monkeypatch.delenv("OMP_THREAD_LIMIT", raising=False)
+    limits = list(run_in_pool(thread_limit, [0, 1], workers=2, initializer=ocr._limit_tesseract_threads))
+    assert limits == ["1", "1"]
+    assert "OMP_THREAD_LIMIT" not in os.environ
+
+def thread_limit(_):
+    return os.environ.get("OMP_THREAD_LIMIT")
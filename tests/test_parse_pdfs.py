@@ -0,0 +1,15 @@
+import shutil
+from pathlib import Path
+import parse_pdfs
+from utils.document_matcher import DocumentIndex
+
+UPLOADS = Path(__file__).resolve().parent.parent / "uploads"
+
+def test_two_document_run_is_indexed(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    shutil.copytree(UPLOADS, tmp_path / "uploads")
+    parse_pdfs.main(["--no-cache"])
+
+    index = DocumentIndex(Path("local_src_native_output") / "parsed")
+    index.refresh()
+    assert {"invoice_parsed", "source_parsed"} <= set(index.documents)
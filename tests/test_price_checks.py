@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+from utils.price_checks import SupplierPriceHistory, detect_line_anomalies, line_items_frame
+
+def invoice(number, *prices):
+    return {"invoice_number": number, "supplier_name": "Acme",
+            "line_items": [{"description": "Steel mesh", "quantity": 1, "unit_price": price} for price in prices]}
+
+def stored(history):
+    row = history.load(["acme"]).iloc[0]
+    return int(row["count"]), row["mean"], row["m2"]
+
+def test_batches_merge_to_overall_mean_and_variance(tmp_path):
+    history = SupplierPriceHistory(tmp_path / "prices.db")
+    history.update(line_items_frame([invoice("INV-1", 10, 12, 11)]))
+    # a second connection, like another reconcile worker
+    other = SupplierPriceHistory(tmp_path / "prices.db")
+    other.update(line_items_frame([invoice("INV-2", 14, 9)]))
+
+    prices = np.array([10, 12, 11, 14, 9], dtype=float)
+    count, mean, m2 = stored(history)
+    assert count == 5
+    assert mean == pytest.approx(prices.mean())
+    assert m2 == pytest.approx(((prices - prices.mean()) ** 2).sum())
+
+def test_invoice_is_only_counted_once(tmp_path):
+    history = SupplierPriceHistory(tmp_path / "prices.db")
+    detect_line_anomalies([invoice("INV-1", 10, 12)], history)
+    # a re-run, and the same invoice twice within one batch
+    detect_line_anomalies([invoice("INV-1", 10, 12), invoice("INV-2", 11), invoice("INV-2", 11)], history)
+
+    count, mean, _ = stored(history)
+    assert count == 3
+    assert mean == pytest.approx(11)
@@ -0,0 +1,95 @@
+import json
+import reconcile
+from utils.document_matcher import get_document_index
+from utils.reconciliation_state import update_result
+
+def document(document_type, *items, number="INV-1"):
+    return {"document_type": document_type, "invoice_number": number, "supplier_name": "Acme",
+            "line_items": [{"description": description, "quantity": quantity} for description, quantity in items]}
+
+INVOICE = document("invoice", ("Concrete 32MPa", 6), ("Steel mesh", 4))
+
+def issues(result):
+    return sorted((d["description"], d["issue"]) for d in result["discrepancies"])
+
+def test_late_docket_completes_a_partial_delivery():
+    result = reconcile.reconcile_documents(INVOICE, document("delivery_docket", ("Concrete 32MPa", 6), ("Steel mesh", 1)),
+                                           label="docket1.pdf")
+    assert result["reconciliation_status"] == "mismatch"
+
+    result = update_result(result, INVOICE, document("delivery_docket", ("Steel mesh", 3)), "docket2.pdf")
+    assert result["reconciliation_status"] == "reconciled"
+    [steel] = [item for item in result["matched_items"] if item["description"] == "Steel mesh"]
+    assert steel["deliveries"] == [{"document": "docket1.pdf", "quantity": 1}, {"document": "docket2.pdf", "quantity": 3}]
+    assert result["reconciliation_state"]["documents"] == ["docket1.pdf", "docket2.pdf"]
+
+def test_credit_note_reduces_the_quantity_owed():
+    result = reconcile.reconcile_documents(INVOICE, document("delivery_docket", ("Concrete 32MPa", 6), ("Steel mesh", 3)),
+                                           label="docket1.pdf")
+    assert issues(result) == [("Steel mesh", "Quantity mismatch")]
+
+    # credited quantities may be written as negatives
+    result = update_result(result, INVOICE, document("credit_note", ("Steel mesh", -1)), "credit1.pdf")
+    assert result["reconciliation_status"] == "reconciled"
+    [steel] = [item for item in result["matched_items"] if item["description"] == "Steel mesh"]
+    assert steel["credits"] == [{"document": "credit1.pdf", "quantity": 1}]
+
+def test_credit_for_an_item_not_invoiced():
+    result = reconcile.reconcile_documents(INVOICE, document("delivery_docket", ("Concrete 32MPa", 6), ("Steel mesh", 4)),
+                                           label="docket1.pdf")
+    result = update_result(result, INVOICE, document("credit_note", ("Formwork ply", 2)), "credit1.pdf")
+
+    assert result["reconciliation_status"] == "mismatch"
+    [credit] = result["discrepancies"]
+    assert credit == {"description": "Formwork ply", "document": "credit1.pdf", "credited_qty": 2,
+                      "issue": "Credit for item not invoiced"}
+
+def test_credit_after_full_delivery_is_a_mismatch():
+    result = reconcile.reconcile_documents(INVOICE, document("delivery_docket", ("Concrete 32MPa", 6), ("Steel mesh", 4)),
+                                           label="docket1.pdf")
+    assert result["reconciliation_status"] == "reconciled"
+
+    # every mesh sheet was delivered, yet one is no longer paid for
+    result = update_result(result, INVOICE, document("credit_note", ("Steel mesh", 1)), "credit1.pdf")
+    assert result["reconciliation_status"] == "mismatch"
+    [steel] = result["discrepancies"]
+    assert (steel["issue"], steel["invoice_qty"], steel["credited_qty"], steel["delivered_qty"]) == \
+        ("Quantity mismatch", 4, 1, 4)
+
+def test_reapplying_a_document_changes_nothing():
+    result = reconcile.reconcile_documents(INVOICE, document("delivery_docket", ("Concrete 32MPa", 6)), label="docket1.pdf")
+    docket2 = document("delivery_docket", ("Steel mesh", 4))
+    once = update_result(result, INVOICE, docket2, "docket2.pdf")
+    twice = update_result(once, INVOICE, docket2, "docket2.pdf")
+    assert twice == once
+    # the first docket is already part of the state too
+    again = update_result(result, INVOICE, document("delivery_docket", ("Concrete 32MPa", 6)), "docket1.pdf")
+    assert again["reconciliation_state"] == result["reconciliation_state"]
+    assert issues(again) == issues(result)
+
+def write_parsed(parsed_dir, name, doc):
+    path = parsed_dir / f"{name}_parsed.json"
+    doc = {**doc, "source_file": f"{name}.pdf"}
+    path.write_text(json.dumps(doc))
+    get_document_index(parsed_dir).add(path, doc)
+    return path
+
+def test_apply_cli_folds_a_late_docket_once(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    parsed_dir = tmp_path / "local_src_native_output" / "parsed"
+    reconciled_dir = tmp_path / "local_src_native_output" / "reconciled"
+    parsed_dir.mkdir(parents=True)
+    reconciled_dir.mkdir(parents=True)
+    write_parsed(parsed_dir, "invoice", INVOICE)
+    write_parsed(parsed_dir, "docket1", document("delivery_docket", ("Concrete 32MPa", 6)))
+    reconcile.main(["--group", "--no-price-history"])
+    assert [path.name for path in reconciled_dir.glob("*.json")] == ["INV-1_mismatch.json"]
+
+    late = write_parsed(parsed_dir, "docket2", document("delivery_docket", ("Steel mesh", 4)))
+    reconcile.main(["--apply", str(late)])
+    assert [path.name for path in reconciled_dir.glob("*.json")] == ["INV-1_reconciled.json"]
+    stored = (reconciled_dir / "INV-1_reconciled.json").read_text()
+
+    reconcile.main(["--apply", str(late)])
+    assert "already part of INV-1_reconciled.json" in capsys.readouterr().out
+    assert (reconciled_dir / "INV-1_reconciled.json").read_text() == stored
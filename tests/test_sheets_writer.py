@@ -0,0 +1,112 @@
+import itertools
+import time
+import pytest
+from sheets_writer import HEADERS, SheetsWriter
+
+_ids = itertools.count()
+
+class FakeCell:
+    def __init__(self, value):
+        self.value = value
+
+class FakeWorksheet:
+    """
+    records append_rows and cell calls like a gspread worksheet, optionally failing the first appends
+    """
+
+    def __init__(self, rows=None, failures=0):
+        self.id = f"sheet-{next(_ids)}"
+        self.rows = list(rows or [])
+        self.failures = failures
+        self.append_calls = []
+        self.cell_calls = []
+
+    def cell(self, row, col):
+        self.cell_calls.append((row, col))
+        return FakeCell(self.rows[row - 1][col - 1] if len(self.rows) >= row else None)
+
+    def append_rows(self, rows):
+        self.append_calls.append(rows)
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("sheets api unavailable")
+        self.rows.extend(rows)
+
+def result(number):
+    return {"invoice_number": f"INV-{number}", "reconciliation_status": "reconciled", "matched_items": [{}],
+            "discrepancies": [], "summary": "ok"}
+
+def test_rows_are_buffered_until_max_rows():
+    worksheet = FakeWorksheet()
+    writer = SheetsWriter(worksheet, max_rows=3, max_interval=3600)
+    writer.add(result(1))
+    writer.add(result(2))
+    assert worksheet.append_calls == []
+
+    writer.add(result(3))
+    assert len(worksheet.append_calls) == 1
+    assert [row[0] for row in worksheet.rows[1:]] == ["INV-1", "INV-2", "INV-3"]
+    assert writer.buffer == []
+
+def test_flush_after_max_interval():
+    worksheet = FakeWorksheet()
+    writer = SheetsWriter(worksheet, max_rows=50, max_interval=30)
+    writer.add(result(1))
+    assert worksheet.append_calls == []
+
+    writer.last_flush -= 31
+    writer.add(result(2))
+    assert len(worksheet.append_calls) == 1
+    assert [row[0] for row in worksheet.rows[1:]] == ["INV-1", "INV-2"]
+
+def test_header_written_once():
+    worksheet = FakeWorksheet()
+    writer = SheetsWriter(worksheet, max_rows=1)
+    writer.add(result(1))
+    writer.add(result(2))
+    SheetsWriter(worksheet, max_rows=1).add(result(3))
+
+    assert worksheet.rows[0] == HEADERS
+    assert sum(row == HEADERS for row in worksheet.rows) == 1
+    # the first row is only read once per worksheet
+    assert worksheet.cell_calls == [(1, 1)]
+
+def test_existing_header_not_repeated():
+    worksheet = FakeWorksheet(rows=[HEADERS])
+    SheetsWriter(worksheet, max_rows=1).add(result(1))
+    assert worksheet.rows == [HEADERS, worksheet.rows[1]]
+    assert worksheet.rows[1][0] == "INV-1"
+
+def test_failed_append_keeps_header_and_rows():
+    worksheet = FakeWorksheet(failures=1)
+    writer = SheetsWriter(worksheet, max_rows=1)
+    with pytest.raises(ConnectionError):
+        writer.add(result(1))
+    assert worksheet.rows == []
+
+    writer.flush()
+    assert worksheet.rows[0] == HEADERS
+    assert worksheet.rows[1][0] == "INV-1"
+
+def test_interval_flush_runs_without_another_add():
+    worksheet = FakeWorksheet()
+    writer = SheetsWriter(worksheet, max_rows=50, max_interval=0.05)
+    writer.add(result(1))
+    assert worksheet.append_calls == []
+
+    deadline = time.monotonic() + 5
+    while not worksheet.append_calls and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert [row[0] for row in worksheet.rows[1:]] == ["INV-1"]
+    assert writer.buffer == []
+
+    writer.close()
+    assert not writer._flusher.is_alive()
+
+def test_close_writes_what_is_buffered():
+    worksheet = FakeWorksheet()
+    with SheetsWriter(worksheet, max_rows=50, max_interval=3600) as writer:
+        writer.add(result(1))
+        assert worksheet.append_calls == []
+    assert [row[0] for row in worksheet.rows[1:]] == ["INV-1"]
+    assert not writer._flusher.is_alive()
@@ -0,0 +1,62 @@
+from pathlib import Path
+import pymupdf
+import pytest
+import parse_pdfs
+
+UPLOADS = Path(__file__).resolve().parent.parent / "uploads"
+
+@pytest.mark.parametrize("name", ["sample_invoice.pdf", "sample_delivery_docket.pdf"])
+def test_streaming_matches_whole_document_parse(name, tmp_path):
+    text, parsed = parse_pdfs.extract_and_parse(UPLOADS / name, "first_document")
+    streamed = parse_pdfs.stream_extract_and_parse(UPLOADS / name, "first_document", tmp_path / "text.txt")
+
+    assert streamed == parsed
+    assert (tmp_path / "text.txt").read_text(encoding="utf-8").strip() == text
+
+def write_pages(path, pages):
+    doc = pymupdf.open()
+    for lines in pages:
+        page = doc.new_page()
+        page.insert_text((50, 72), "\n".join(lines), fontsize=10)
+    doc.save(path)
+    doc.close()
+
+def test_headers_and_items_spread_over_pages(tmp_path):
+    pdf = tmp_path / "long_invoice.pdf"
+    # header fields on the first page only, a bare invoice number later must not replace the labelled one
+    write_pages(pdf, [
+        ["TAX INVOICE", "Supplier: Acme Concrete", "Invoice Number: INV-1001", "Job Code: J-77"],
+        ["Items:", "1. Concrete 32MPa | Qty: 6 | Unit Price: $210.00", "See also INV-9999"],
+        ["2. Steel mesh | Qty: 4 | Unit Price: $55.00"],
+    ])
+
+    streamed = parse_pdfs.stream_extract_and_parse(pdf, "batch_document", tmp_path / "text.txt")
+    _, parsed = parse_pdfs.extract_and_parse(pdf, "batch_document")
+    assert streamed == parsed
+    assert streamed["invoice_number"] == "INV-1001"
+    assert streamed["job_code"] == "J-77"
+    assert [item["description"] for item in streamed["line_items"]] == ["Concrete 32MPa", "Steel mesh"]
+
+def test_page_generator_closes_the_document_early(tmp_path, monkeypatch):
+    pdf = tmp_path / "pages.pdf"
+    write_pages(pdf, [[f"page {i}"] for i in range(5)])
+    opened = []
+    real_open = pymupdf.open
+
+    def tracking_open(*args, **kwargs):
+        doc = real_open(*args, **kwargs)
+        opened.append(doc)
+        return doc
+
+    monkeypatch.setattr(pymupdf, "open", tracking_open)
+    pages = parse_pdfs.iter_page_texts(pdf)
+    assert next(pages).strip() == "page 0"
+    pages.close()
+    assert opened[0].is_closed
+
+def test_streaming_batch_writes_text_and_json(tmp_path):
+    output = tmp_path / "parsed"
+    assert parse_pdfs.run_batch(sorted(UPLOADS.glob("*.pdf")), output, workers=1, stream=True) == 2
+    assert sorted(path.name for path in output.iterdir() if path.suffix in (".txt", ".json")) == [
+        "sample_delivery_docket_parsed.json", "sample_delivery_docket_text.txt",
+        "sample_invoice_parsed.json", "sample_invoice_text.txt"]
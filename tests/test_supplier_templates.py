@@ -0,0 +1,73 @@
+import re
+import unicodedata
+from pathlib import Path
+import pytest
+from parse_pdfs import parse_metadata_and_line_items, extract_text
+from utils.supplier_templates import SupplierTemplate
+
+UPLOADS = Path(__file__).resolve().parent.parent / "uploads"
+
+def clean_text(text):
+    return unicodedata.normalize("NFKC", text).replace("\u200b", "").strip()
+
+def baseline_parse(text):
+    """
+    the original one-search-per-field native parser, the single pass scanner must agree with it
+    """
+    result = {"invoice_number": None, "supplier_name": None, "job_code": None, "line_items": []}
+
+    match = re.search(r"Supplier:\s*(.+)", text)
+    result["supplier_name"] = clean_text(match.group(1)) if match else None
+
+    for pattern in (r"Invoice\s+(?:Number|No\.?):\s*(INV-\d+)", r"\b(INV-\d+)\b"):
+        match = re.search(pattern, text, re.IGNORECASE)
+        if match:
+            result["invoice_number"] = clean_text(match.group(1))
+            break
+
+    match = re.search(r"Job Code:\s*(\S+)", text)
+    result["job_code"] = clean_text(match.group(1)) if match else None
+
+    priced = re.findall(r"\d+\.\s*(.*?)\s*\|\s*Qty:\s*(\d+)\s*\|\s*Unit Price:\s*\$?([\d.]+)", text, re.IGNORECASE)
+    if priced:
+        result["line_items"] = [
+            {"description": d.strip(), "quantity": int(q), "unit_price": float(p)} for d, q, p in priced
+        ]
+    else:
+        result["line_items"] = [
+            {"description": d.strip(), "quantity": int(q)}
+            for d, q in re.findall(r"\d+\.\s*(.*?)\s*\|\s*Qty:\s*(\d+)", text, re.IGNORECASE)
+        ]
+    return result
+
+def head_parse(text):
+    parsed = parse_metadata_and_line_items(text, "first_document")
+    return {field: parsed[field] for field in ("invoice_number", "supplier_name", "job_code", "line_items")}
+
+TEXTS = [
+    "Invoice\nSupplier: Foo Job Code: X1\n1. Widget | Qty: 3 | Unit Price: $2.00",
+    "Invoice\nSupplier:\n1. Widget | Qty: 3 | Unit Price: $2.00",
+    "Invoice Number: INV-1001\nSupplier: Acme Pty Ltd\nJob Code: JOB-7\n"
+    "1. Copper Cable | Qty: 10 | Unit Price: $1.50\n2. Conduit | Qty: 4 | Unit Price: $3.00",
+    "Delivery Docket\nRef INV-1001\nJob Code: JOB-7\n1. Copper Cable | Qty: 10\n2. Conduit | Qty: 4",
+    "Invoice\nSee INV-22 and Invoice No.: INV-23\nJob Code: J9 Supplier: Bar\n1. A | Qty: 1",
+]
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_single_pass_scanner_matches_baseline(text):
+    assert head_parse(text) == baseline_parse(text)
+
+@pytest.mark.parametrize("name", ["sample_invoice.pdf", "sample_delivery_docket.pdf"])
+def test_sample_documents_match_baseline(name):
+    text, _ = extract_text(UPLOADS / name)
+    assert head_parse(text) == baseline_parse(text)
+
+def test_supplier_value_does_not_swallow_job_code():
+    parsed = head_parse("Invoice\nSupplier: Foo Job Code: X1\n")
+    assert parsed["job_code"] == "X1"
+
+def test_template_override_keeps_header_fields_zero_width():
+    template = SupplierTemplate("custom", {"job_code": r"Project:\s*(?P<job_code>\S+)"})
+    matches = [match for match in template.scanner.finditer("Supplier: Foo Project: P-1") if match.group("job_code")]
+    assert [match.group("job_code") for match in matches] == ["P-1"]
+    assert all(match.group(0) == "" for match in matches)
@@ -0,0 +1,100 @@
+import json
+import os
+import time
+from pathlib import Path
+
+# gpt modules build an api client at import, the gpt calls below are replaced
+os.environ.setdefault("OPENAI_API_KEY", "test-stub")
+
+import gpt_reconcile
+import worker
+from utils.document_matcher import get_document_index
+from utils.job_queue import JobQueue, DONE, PARSED
+
+def invoice(*items):
+    return {"document_type": "invoice", "invoice_number": "INV-1", "supplier_name": "Acme",
+            "line_items": [{"description": description, "quantity": quantity} for description, quantity in items]}
+
+def docket(*items):
+    return {"document_type": "delivery_docket", "invoice_number": "INV-1",
+            "line_items": [{"description": description, "quantity": quantity} for description, quantity in items]}
+
+def add_parsed(queue, name, doc, method="native"):
+    parsed_dir, _ = worker.output_dirs(method)
+    parsed_path = parsed_dir / f"{name}_parsed.json"
+    doc = {**doc, "source_file": f"{name}.pdf"}
+    parsed_path.write_text(json.dumps(doc))
+    get_document_index(parsed_dir).add(parsed_path, doc)
+    queue.enqueue(Path(f"{name}.pdf"), method)
+    job = queue.claim("parse")
+    queue.complete(job["id"], PARSED, parsed_path=str(parsed_path))
+
+def test_every_docket_of_an_invoice_is_reconciled(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    queue = JobQueue(tmp_path / "jobs.sqlite3")
+    add_parsed(queue, "invoice", invoice(("Concrete 32MPa", 6), ("Steel mesh", 4)))
+    add_parsed(queue, "docket1", docket(("Concrete 32MPa", 6)))
+
+    assert worker.reconcile_job(queue, queue.claim("reconcile"))
+    # the group's docket job was completed along with the invoice job
+    assert queue.claim("reconcile") is None
+
+    add_parsed(queue, "docket2", docket(("Steel mesh", 4)))
+    assert worker.reconcile_job(queue, queue.claim("reconcile"))
+    assert queue.counts() == {DONE: 3}
+
+    _, reconciled_dir = worker.output_dirs("native")
+    results = list(reconciled_dir.glob("INV-1_*.json"))
+    assert [path.name for path in results] == ["INV-1_reconciled.json"]
+    result = json.loads(results[0].read_text())
+    assert result["reconciliation_state"]["documents"] == ["docket1.pdf", "docket2.pdf"]
+
+def test_document_without_counterpart_waits(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    queue = JobQueue(tmp_path / "jobs.sqlite3")
+    add_parsed(queue, "docket1", docket(("Concrete 32MPa", 6)))
+
+    assert not worker.reconcile_job(queue, queue.claim("reconcile"))
+
+def test_gpt_group_reconciles_first_docket_and_folds_the_rest(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    calls = []
+    def structured_reconcile(invoice_path, delivery_path, invoice_txt, delivery_txt, token_budget):
+        calls.append((delivery_path.name, token_budget))
+        return {"invoice_number": "INV-1", "reconciliation_status": "reconciled", "discrepancies": [],
+                "matched_items": [{"invoice_description": "Concrete 32MPa", "docket_description": "Concrete 32MPa",
+                                   "quantity": 6}]}, "stubbed"
+    monkeypatch.setattr(gpt_reconcile, "reconcile_with_gpt_structured", structured_reconcile)
+
+    queue = JobQueue(tmp_path / "jobs.sqlite3")
+    add_parsed(queue, "invoice", invoice(("Concrete 32MPa", 6), ("Steel mesh", 4)), "gpt")
+    add_parsed(queue, "docket1", docket(("Concrete 32MPa", 6)), "gpt")
+    add_parsed(queue, "docket2", docket(("Steel mesh", 4)), "gpt")
+
+    assert worker.reconcile_job(queue, queue.claim("reconcile"), token_budget=1234, structured=True)
+    assert calls == [("docket1_parsed.json", 1234)]
+    assert queue.counts() == {DONE: 3}
+
+    _, reconciled_dir = worker.output_dirs("gpt")
+    [result_path] = reconciled_dir.glob("INV-1_*.json")
+    result = json.loads(result_path.read_text())
+    assert result["reconciliation_state"]["documents"] == ["docket1.pdf", "docket2.pdf"]
+
+def test_long_running_job_is_not_reclaimed(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    queue = JobQueue(tmp_path / "jobs.sqlite3", visibility_timeout=0.3)
+    other = JobQueue(tmp_path / "jobs.sqlite3", visibility_timeout=0.3)
+    queue.enqueue(Path("scanned.pdf"), "native")
+
+    claimed_meanwhile = []
+    def slow_parse(job, response_cache=None):
+        # an ocr heavy parse running for several visibility timeouts
+        time.sleep(1)
+        claimed_meanwhile.append(other.claim("parse"))
+        return tmp_path / "scanned_parsed.json"
+
+    monkeypatch.setattr(worker, "parse_job", slow_parse)
+    worker._work("parse", queue, None, poll_interval=0.01, exit_when_idle=True)
+
+    assert claimed_meanwhile == [None]
+    assert queue.counts() == {PARSED: 1}
@@ -0,0 +1,52 @@
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List
+from utils import metrics
+
+def resolve_pdf_paths(source: str) -> List[Path]:
+    """
+    resolves a directory, single file or glob pattern into a sorted list of pdf paths
+    """
+    path = Path(source)
+    if path.is_dir():
+        return sorted(p for p in path.rglob("*") if p.suffix.lower() == ".pdf")
+    if path.is_file():
+        return [path]
+    return sorted(
+        Path(p) for p in glob.glob(source, recursive=True)
+        if p.lower().endswith(".pdf")
+    )
+
+def default_worker_count() -> int:
+    return os.cpu_count() or 1
+
+def _call_collecting_metrics(fn: Callable, item):
+    # runs in the pool worker, its metrics travel back to the parent with the result
+    result = fn(item)
+    return result, metrics.REGISTRY.drain()
+
+def _start_worker(initializer: Callable = None):
+    metrics.reset()
+    if initializer:
+        initializer()
+
+def run_in_pool(fn: Callable, items: Iterable, workers: int = None, chunksize: int = 1,
+                initializer: Callable = None) -> Iterator:
+    """
+    yields fn(item) for every item (in input order), fanning the calls out across a process pool.
+    fn (and initializer, run once in each worker process) must be module level functions so they can be pickled.
+    metrics recorded inside the workers are merged into this process' registry as each result arrives
+    """
+    workers = workers or default_worker_count()
+    if workers == 1:
+        # skip the pool overhead entirely for single worker runs
+        yield from map(fn, items)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=partial(_start_worker, initializer)) as pool:
+        for result, worker_metrics in pool.map(partial(_call_collecting_metrics, fn), items, chunksize=chunksize):
+            metrics.REGISTRY.merge(worker_metrics)
+            yield result
@@ -1,6 +1,9 @@
 from pathlib import Path
 import json
-from typing import Optional, Tuple
+import os
+from typing import Dict, List, Optional, Tuple
+
+INDEX_FILENAME = ".document_index.jsonl"
 
 def load_parsed_documents(parsed_dir: Path):
     parsed_docs = []
@@ -23,8 +26,218 @@ def documents_match(doc1: dict, doc2: dict) -> bool:
         job1 and job1 == job2
     ])
 
-def find_matching_document(new_doc: dict, parsed_dir: Path) -> Optional[Tuple[Path, dict]]:
-    for existing_path, existing_doc in load_parsed_documents(parsed_dir):
-        if documents_match(new_doc, existing_doc):
-            return existing_path, existing_doc
-    return None, None
+def group_documents(parsed_docs: List[Tuple[Path, dict]]):
+    """
+    groups parsed (path, doc) entries so each invoice comes with every docket/confirmation that delivers it.
+    a docket quoting an invoice's number goes to that invoice, otherwise to the first invoice its identifiers
+    cross match (same rules as documents_match). returns (groups, unmatched): groups are
+    (invoice_entry, [delivery_entries]), unmatched holds invoices with no dockets yet and orphan dockets
+    """
+    parsed_docs = sorted(parsed_docs, key=lambda entry: str(entry[0]))
+    invoices = [entry for entry in parsed_docs if entry[1].get("document_type") == "invoice"]
+
+    by_invoice_number: Dict[str, int] = {}
+    by_identifier: Dict[str, int] = {}
+    for position, (_, doc) in enumerate(invoices):
+        inv, job = extract_identifiers(doc)
+        if inv:
+            by_invoice_number.setdefault(inv, position)
+        for identifier in (inv, job):
+            if identifier:
+                by_identifier.setdefault(identifier, position)
+
+    deliveries: Dict[int, list] = {}
+    unmatched = []
+    for entry in parsed_docs:
+        if entry[1].get("document_type") == "invoice":
+            continue
+        inv, job = extract_identifiers(entry[1])
+        position = by_invoice_number.get(inv) if inv else None
+        if position is None:
+            candidates = [by_identifier[identifier] for identifier in (inv, job) if identifier in by_identifier]
+            position = min(candidates) if candidates else None
+        if position is None:
+            unmatched.append(entry)
+        else:
+            deliveries.setdefault(position, []).append(entry)
+
+    groups = []
+    for position, invoice in enumerate(invoices):
+        if position in deliveries:
+            groups.append((invoice, deliveries[position]))
+        else:
+            unmatched.append(invoice)
+    return groups, unmatched
+
+class DocumentIndex:
+    """
+    persistent inverted index of invoice_number/job_code -> parsed documents for a parsed directory.
+
+    invoice numbers and job codes share one key space, so a lookup on both identifiers of a
+    document gives the same invoice <-> job code cross matching as documents_match.
+    the index is an append-only jsonl log next to the parsed files, each add is one appended line
+    and other processes' additions are picked up by reading only the new tail of the log
+    """
+
+    def __init__(self, parsed_dir: Path):
+        self.parsed_dir = Path(parsed_dir)
+        self.index_path = self.parsed_dir / INDEX_FILENAME
+        self.documents: Dict[str, dict] = {}
+        self.identifiers: Dict[str, Dict[str, None]] = {}
+        self._offset = 0
+        self._inode = None
+
+    def _apply(self, entry: dict):
+        doc_id = entry["doc_id"]
+        self._unlink(doc_id)
+        if entry.get("removed"):
+            return
+        self.documents[doc_id] = entry
+        for identifier in (entry.get("invoice_number"), entry.get("job_code")):
+            if identifier:
+                self.identifiers.setdefault(identifier, {})[doc_id] = None
+
+    def _unlink(self, doc_id: str):
+        old = self.documents.pop(doc_id, None)
+        if not old:
+            return
+        for identifier in (old.get("invoice_number"), old.get("job_code")):
+            if identifier in self.identifiers:
+                self.identifiers[identifier].pop(doc_id, None)
+                if not self.identifiers[identifier]:
+                    del self.identifiers[identifier]
+
+    def _append(self, entry: dict):
+        self.parsed_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.index_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def refresh(self):
+        """
+        reads entries appended since the last refresh, or reloads from scratch if the log was rebuilt
+        """
+        try:
+            stat = self.index_path.stat()
+        except FileNotFoundError:
+            return
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            self.documents.clear()
+            self.identifiers.clear()
+            self._offset = 0
+            self._inode = stat.st_ino
+
+        with open(self.index_path, "rb") as f:
+            f.seek(self._offset)
+            for line in f:
+                # a partially written trailing line is picked up on the next refresh
+                if not line.endswith(b"\n"):
+                    break
+                self._offset += len(line)
+                if line.strip():
+                    self._apply(json.loads(line))
+
+    def add(self, path: Path, doc: dict):
+        path = Path(path)
+        inv, job = extract_identifiers(doc)
+        entry = {"doc_id": path.stem, "path": str(path), "invoice_number": inv, "job_code": job,
+                 "document_type": doc.get("document_type")}
+        self._append(entry)
+        self._apply(entry)
+
+    def remove(self, path: Path):
+        entry = {"doc_id": Path(path).stem, "removed": True}
+        self._append(entry)
+        self._apply(entry)
+
+    def rebuild(self):
+        """
+        rewrites the index from the parsed json files currently on disk
+        """
+        self.documents.clear()
+        self.identifiers.clear()
+        lines = []
+        for file, data in load_parsed_documents(self.parsed_dir):
+            inv, job = extract_identifiers(data)
+            entry = {"doc_id": file.stem, "path": str(file), "invoice_number": inv, "job_code": job,
+                     "document_type": data.get("document_type")}
+            self._apply(entry)
+            lines.append(json.dumps(entry) + "\n")
+
+        self.parsed_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.index_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text("".join(lines), encoding="utf-8")
+        os.replace(tmp_path, self.index_path)
+        stat = self.index_path.stat()
+        self._inode = stat.st_ino
+        self._offset = stat.st_size
+
+    def lookup_all(self, doc: dict, exclude_id: str = None) -> List[dict]:
+        """
+        every indexed entry sharing an invoice number or job code with doc
+        """
+        entries = {}
+        for identifier in extract_identifiers(doc):
+            if not identifier:
+                continue
+            for doc_id in self.identifiers.get(identifier, {}):
+                if doc_id != exclude_id:
+                    entries.setdefault(doc_id, self.documents[doc_id])
+        return list(entries.values())
+
+    def lookup(self, doc: dict, exclude_id: str = None) -> Optional[dict]:
+        """
+        returns the first indexed entry sharing an invoice number or job code with doc
+        """
+        for identifier in extract_identifiers(doc):
+            if not identifier:
+                continue
+            for doc_id in self.identifiers.get(identifier, {}):
+                if doc_id != exclude_id:
+                    return self.documents[doc_id]
+        return None
+
+_indexes: Dict[Path, DocumentIndex] = {}
+
+def get_document_index(parsed_dir: Path) -> DocumentIndex:
+    """
+    process wide index per parsed directory, built from the directory on first use if no log exists yet
+    """
+    parsed_dir = Path(parsed_dir)
+    index = _indexes.get(parsed_dir)
+    if index is None:
+        index = DocumentIndex(parsed_dir)
+        if index.index_path.exists():
+            index.refresh()
+        else:
+            index.rebuild()
+        _indexes[parsed_dir] = index
+    else:
+        index.refresh()
+    return index
+
+def load_related_documents(parsed_dir: Path, doc_path: Path, doc: dict, max_hops: int = 3) -> List[Tuple[Path, dict]]:
+    """
+    (path, doc) entries for doc and every parsed document linked to it through shared identifiers, followed
+    through the index for up to max_hops links (docket -> its invoice -> the invoice's other dockets -> any
+    invoice those quote), so group_documents can group them without reading the whole directory
+    """
+    index = get_document_index(parsed_dir)
+    related = {Path(doc_path).stem: (Path(doc_path), doc)}
+    frontier = [doc]
+    for _ in range(max_hops):
+        next_frontier = []
+        for current in frontier:
+            for entry in index.lookup_all(current):
+                if entry["doc_id"] in related:
+                    continue
+                try:
+                    with open(entry["path"]) as f:
+                        related[entry["doc_id"]] = (Path(entry["path"]), json.load(f))
+                except (OSError, json.JSONDecodeError):
+                    index.remove(entry["path"])
+                    continue
+                next_frontier.append(entry)
+        if not next_frontier:
+            break
+        frontier = next_frontier
+    return list(related.values())
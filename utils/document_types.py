@@ -0,0 +1,17 @@
+def detect_document_type(text):
+    """
+    document type from keywords in the extracted text, shared by every parser so native, gpt and hybrid
+    results agree. dockets and confirmations usually quote the invoice they deliver, and credit notes the
+    invoice they credit, so those are checked before "invoice"
+    """
+    lowered = text.lower()
+    if "delivery docket" in lowered:
+        return "delivery_docket"
+    elif "purchase confirmation" in lowered:
+        return "purchase_confirmation"
+    elif "credit note" in lowered:
+        return "credit_note"
+    elif "invoice" in lowered:
+        return "invoice"
+    else:
+        return "unknown"
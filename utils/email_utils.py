@@ -1,66 +1,259 @@
 import imaplib
-import email
-from email.header import decode_header
+from email.header import decode_header, make_header
+import base64
+import json
 import os
+import quopri
+import re
 from pathlib import Path
+from typing import List
 from dotenv import load_dotenv
 
 load_dotenv()
 
-def fetch_relevant_pdf_attachments(download_path: Path):
-    from_email = os.getenv("EMAIL_USER")
-    password = os.getenv("EMAIL_PASS")
+IMAP_SERVER = "imap.gmail.com"
+KEYWORDS = ["invoice", "purchase", "delivery"]
+SYNC_STATE_FILENAME = ".imap_sync_state.json"
+FETCH_BATCH_SIZE = 100
 
-    imap_server = "imap.gmail.com"
-    mail = imaplib.IMAP4_SSL(imap_server)
-    mail.login(from_email, password)
-    mail.select("inbox")
+def load_sync_state(state_path: Path) -> dict:
+    try:
+        with open(state_path) as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {"uidvalidity": None, "last_uid": 0}
 
-    # Search all emails (newest first)
-    status, messages = mail.search(None, "ALL")
-    email_ids = messages[0].split()[::-1]  # reverse for latest first
+def save_sync_state(state_path: Path, state: dict):
+    state_path.parent.mkdir(parents=True, exist_ok=True)
+    state_path.write_text(json.dumps(state), encoding="utf-8")
 
-    saved_files = []
-    keywords = ["invoice", "purchase", "delivery"]
-
-    for email_id in email_ids:
-        status, msg_data = mail.fetch(email_id, "(RFC822)")
-        raw_email = msg_data[0][1]
-        msg = email.message_from_bytes(raw_email)
-
-        subject = msg.get("Subject", "")
-        body = ""
-        if msg.is_multipart():
-            for part in msg.walk():
-                if part.get_content_type() == "text/plain":
-                    body += part.get_payload(decode=True).decode(errors="ignore")
+def build_keyword_search(keywords: List[str]) -> str:
+    """
+    server side search matching any keyword in the subject or body, e.g. (OR SUBJECT "a" OR BODY "a" ...)
+    """
+    criteria = []
+    for kw in keywords:
+        criteria.append(f'SUBJECT "{kw}"')
+        criteria.append(f'BODY "{kw}"')
+    query = criteria[-1]
+    for criterion in reversed(criteria[:-1]):
+        query = f"OR {criterion} {query}"
+    return f"({query})"
+
+def _flatten_fetch_response(data) -> list:
+    """
+    turns imaplib's mix of bytes and (header, literal) tuples into text segments and literal strings
+    """
+    segments = []
+    for item in data:
+        if isinstance(item, tuple):
+            header, literal = item
+            segments.append(("text", re.sub(rb"\{\d+\}$", b"", header).decode(errors="ignore")))
+            segments.append(("literal", literal.decode(errors="ignore")))
+        elif isinstance(item, bytes):
+            segments.append(("text", item.decode(errors="ignore")))
+    return segments
+
+def parse_imap_list(data) -> list:
+    """
+    parses an imap fetch response into nested python lists (NIL -> None, literals -> strings)
+    """
+    tokens = []
+    for kind, value in _flatten_fetch_response(data):
+        if kind == "literal":
+            tokens.append(("atom", value))
+            continue
+        i = 0
+        while i < len(value):
+            char = value[i]
+            if char in " \r\n":
+                i += 1
+            elif char in "()":
+                tokens.append((char, None))
+                i += 1
+            elif char == '"':
+                i += 1
+                chars = []
+                while i < len(value) and value[i] != '"':
+                    if value[i] == "\\":
+                        i += 1
+                    chars.append(value[i])
+                    i += 1
+                tokens.append(("atom", "".join(chars)))
+                i += 1
+            else:
+                start = i
+                while i < len(value) and value[i] not in ' ()"\r\n':
+                    # BODY[1.2] style atoms contain brackets, keep them whole
+                    i += 1
+                atom = value[start:i]
+                tokens.append(("atom", None if atom.upper() == "NIL" else atom))
+
+    root = []
+    stack = [root]
+    for kind, value in tokens:
+        if kind == "(":
+            child = []
+            stack[-1].append(child)
+            stack.append(child)
+        elif kind == ")":
+            if len(stack) > 1:
+                stack.pop()
         else:
-            body = msg.get_payload(decode=True).decode(errors="ignore")
-
-        if any(kw in subject.lower() for kw in keywords) or any(kw in body.lower() for kw in keywords):
-            for part in msg.walk():
-                content_disposition = str(part.get("Content-Disposition", ""))
-                content_type = part.get_content_type()
-                filename = part.get_filename()
-
-                if (
-                    "attachment" in content_disposition
-                    and content_type == "application/pdf"
-                    and filename
-                    and any(kw in filename.lower() for kw in keywords)
-                ):
+            stack[-1].append(value)
+    return root
+
+def _decode_header_value(value: str) -> str:
+    if not value:
+        return value
+    return str(make_header(decode_header(value)))
+
+def _param_value(params, name: str):
+    if not isinstance(params, list):
+        return None
+    for key, value in zip(params[::2], params[1::2]):
+        if isinstance(key, str) and key.lower() == name:
+            return value
+    return None
+
+def safe_filename(filename: str):
+    """
+    the bare file name of an attachment, so a name like ../../x.pdf can't be written outside the download dir.
+    None when nothing usable is left
+    """
+    name = Path(filename.replace("\\", "/")).name
+    return name if name not in ("", ".", "..") else None
+
+def find_pdf_parts(structure: list, prefix: str = "") -> List[dict]:
+    """
+    walks a BODYSTRUCTURE and returns the attached pdf parts as {part, filename, encoding} dicts,
+    including those inside forwarded (message/rfc822) emails
+    """
+    if structure and isinstance(structure[0], list):
+        # multipart: child parts come first, followed by the subtype and extension data
+        parts = []
+        for i, child in enumerate(structure):
+            if not isinstance(child, list):
+                break
+            part_number = f"{prefix}.{i + 1}" if prefix else str(i + 1)
+            parts.extend(find_pdf_parts(child, part_number))
+        return parts
+
+    if len(structure) < 7:
+        return []
+
+    content_type = f"{structure[0]}/{structure[1]}".lower()
+    if content_type == "message/rfc822":
+        # the encapsulated message's body follows the envelope, a single part body is numbered <part>.1
+        if len(structure) < 9 or not isinstance(structure[8], list):
+            return []
+        inner = structure[8]
+        part_number = prefix or "1"
+        if inner and isinstance(inner[0], list):
+            return find_pdf_parts(inner, part_number)
+        return find_pdf_parts(inner, f"{part_number}.1")
+
+    filename = _param_value(structure[2], "name")
+    disposition = None
+    for extension in structure[7:]:
+        if isinstance(extension, list) and extension and isinstance(extension[0], str) and len(extension) == 2:
+            disposition = extension[0].lower()
+            filename = _param_value(extension[1], "filename") or filename
+            break
+
+    if content_type != "application/pdf" or disposition != "attachment" or not filename:
+        return []
+    filename = safe_filename(_decode_header_value(filename))
+    if not filename:
+        return []
+    return [{
+        "part": prefix or "1",
+        "filename": filename,
+        "encoding": (structure[5] or "7bit").lower()
+    }]
+
+def _decode_part(payload: bytes, encoding: str) -> bytes:
+    if encoding == "base64":
+        return base64.b64decode(payload)
+    if encoding == "quoted-printable":
+        return quopri.decodestring(payload)
+    return payload
+
+def _chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def sync_pdf_attachments(download_path: Path, state_path: Path = None, mail=None, keywords: List[str] = KEYWORDS) -> List[Path]:
+    """
+    incremental inbox sync: only messages newer than the last seen UID are searched (server side, by keyword),
+    only their BODYSTRUCTURE is fetched, and only the matching pdf parts are downloaded.
+    returns every new qualifying attachment, the UIDVALIDITY/UID high-water mark is kept in state_path
+    """
+    download_path.mkdir(parents=True, exist_ok=True)
+    state_path = state_path or download_path / SYNC_STATE_FILENAME
+    state = load_sync_state(state_path)
+
+    owns_connection = mail is None
+    if owns_connection:
+        mail = imaplib.IMAP4_SSL(IMAP_SERVER)
+        mail.login(os.getenv("EMAIL_USER"), os.getenv("EMAIL_PASS"))
+
+    saved_files = []
+    try:
+        mail.select("inbox", readonly=True)
+        _, uidvalidity = mail.response("UIDVALIDITY")
+        uidvalidity = uidvalidity[0].decode() if uidvalidity and uidvalidity[0] else None
+
+        # a changed UIDVALIDITY means old UIDs are meaningless, so start over
+        if uidvalidity != state.get("uidvalidity"):
+            state = {"uidvalidity": uidvalidity, "last_uid": 0}
+
+        last_uid = state["last_uid"]
+        _, data = mail.uid("SEARCH", None, f"UID {last_uid + 1}:*", build_keyword_search(keywords))
+        # "n:*" always includes the newest message, even when it is older than n
+        uids = sorted(int(uid) for uid in (data[0] or b"").split() if int(uid) > last_uid)
+
+        for uid_batch in _chunks(uids, FETCH_BATCH_SIZE):
+            uid_set = ",".join(str(uid) for uid in uid_batch)
+            _, data = mail.uid("FETCH", uid_set, "(UID BODYSTRUCTURE)")
+            parsed = parse_imap_list(data)
+
+            for item in parsed:
+                if not isinstance(item, list):
+                    continue
+                fields = dict(zip(item[::2], item[1::2]))
+                uid = fields.get("UID")
+                structure = fields.get("BODYSTRUCTURE")
+                if not uid or not isinstance(structure, list):
+                    continue
+
+                for part in find_pdf_parts(structure):
+                    filename = part["filename"]
+                    if not any(kw in filename.lower() for kw in keywords):
+                        continue
+
+                    _, part_data = mail.uid("FETCH", uid, f"(BODY.PEEK[{part['part']}])")
+                    payload = next((p[1] for p in part_data if isinstance(p, tuple)), None)
+                    if payload is None:
+                        continue
+
                     file_path = download_path / filename
-                    if not file_path.exists():
-                        with open(file_path, "wb") as f:
-                            f.write(part.get_payload(decode=True))
-                        print(f"✅ Saved: {file_path}")
-                    else:
-                        print(f"⚠️ File already exists: {file_path}")
+                    # UIDs are never re-synced, so a name clash is a different document
+                    if file_path.exists():
+                        file_path = download_path / f"{uid}_{filename}"
+                    with open(file_path, "wb") as f:
+                        f.write(_decode_part(payload, part["encoding"]))
+                    print(f"✅ Saved: {file_path}")
                     saved_files.append(file_path)
 
-            if saved_files:
-                print(f"📧 Used email with subject: {subject}")
-                break  # stop after first relevant email with attachment
+            state["last_uid"] = max(uid_batch)
+            save_sync_state(state_path, state)
+
+        if not uids:
+            save_sync_state(state_path, state)
+    finally:
+        if owns_connection:
+            mail.logout()
 
-    mail.logout()
-    return saved_files if saved_files else None
+    print(f"📧 Synced {len(uids)} new matching emails, {len(saved_files)} pdf attachments")
+    return saved_files
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Optional
+
+DEFAULT_CACHE_DIR = Path(".cache") / "extraction"
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+def hash_file(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    """
+    sha256 of the file bytes, read in chunks so large pdfs are never fully loaded
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ExtractionCache:
+    """
+    on-disk cache of extracted text + parsed dicts keyed by pdf content hash and parser version.
+    entries are plain json files, the file mtime doubles as the last-used time for LRU eviction
+    """
+
+    def __init__(self, version: str, cache_dir: Path = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.version = version
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+
+    def key_for(self, pdf_path: Path) -> str:
+        return f"{hash_file(pdf_path)}-{self.version}"
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[dict]:
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        # bump the mtime so recently used entries survive eviction
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key: str, entry: dict):
+        entry_path = self._entry_path(key)
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        # write then rename so concurrent workers never read a half written entry
+        tmp_path = entry_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(entry), encoding="utf-8")
+        os.replace(tmp_path, entry_path)
+
+    def evict(self) -> int:
+        """
+        removes least recently used entries until the cache fits in max_bytes, returns the number removed
+        """
+        if not self.cache_dir.exists():
+            return 0
+
+        entries = []
+        total = 0
+        for entry_path in self.cache_dir.glob("*/*.json"):
+            try:
+                stat = entry_path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+            total += stat.st_size
+
+        removed = 0
+        for _, size, entry_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                entry_path.unlink()
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
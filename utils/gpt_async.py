@@ -0,0 +1,156 @@
+import asyncio
+import os
+import random
+import time
+from functools import lru_cache
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError
+from utils import metrics
+from utils.gpt_structured import (
+    INVALID_OUTPUT_ERRORS, STRUCTURED_MAX_ATTEMPTS, retry_invalid_output, structured_request, structured_response
+)
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+def estimate_tokens(text: str) -> int:
+    """
+    rough token estimate (~4 chars per token), only used for rate limit budgeting
+    """
+    return max(1, len(text) // 4)
+
+@lru_cache(maxsize=None)
+def _encoding_for(model: str):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+def count_tokens(text: str, model: str) -> int:
+    """
+    exact prompt token count when tiktoken is installed, the rough estimate otherwise
+    """
+    if tiktoken is None:
+        return estimate_tokens(text)
+    return len(_encoding_for(model).encode(text))
+
+def make_async_client(base_url: str = None) -> AsyncOpenAI:
+    """
+    async client with the sdk's own retries disabled so AsyncGPTRunner owns backoff.
+    base_url (or OPENAI_BASE_URL) can point at a local stub server for testing
+    """
+    return AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        base_url=base_url or os.getenv("OPENAI_BASE_URL"),
+        max_retries=0
+    )
+
+class TokenBucket:
+    """
+    async token bucket refilled continuously at rate_per_minute, capacity defaults to one minute of budget
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, amount: float = 1):
+        # a single request larger than the bucket would wait forever, so cap it at capacity
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+
+class AsyncGPTRunner:
+    """
+    runs chat completions concurrently under a semaphore, requests/tokens per minute buckets
+    and jittered exponential backoff on 429s, 5xxs and connection errors
+    """
+
+    def __init__(self, client: AsyncOpenAI = None, concurrency: int = 8, rpm: int = 500, tpm: int = 30000,
+                 max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 30.0,
+                 expected_output_tokens: int = 1000):
+        self.client = client or make_async_client()
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.request_bucket = TokenBucket(rpm)
+        self.token_bucket = TokenBucket(tpm)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.expected_output_tokens = expected_output_tokens
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        # honour the server's retry-after hint when it sends one
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return random.uniform(0, delay)
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        if isinstance(error, APIStatusError):
+            return error.status_code == 429 or error.status_code >= 500
+        return isinstance(error, APIConnectionError)
+
+    async def _request(self, prompt: str, send, stage: str, **labels):
+        """
+        awaits send() under the rate limits and concurrency bound, retrying transient api errors.
+        every attempt is a request against the limits, so the buckets are charged per attempt, and the
+        backoff sleep happens outside the semaphore so a waiting retry doesn't hold a concurrency slot
+        """
+        tokens = estimate_tokens(prompt) + self.expected_output_tokens
+        for attempt in range(self.max_retries + 1):
+            await self.request_bucket.acquire(1)
+            await self.token_bucket.acquire(tokens)
+            try:
+                async with self.semaphore:
+                    with metrics.timer(stage, **labels):
+                        return await send()
+            except Exception as e:
+                if attempt == self.max_retries or not self._is_retryable(e):
+                    raise
+                metrics.increment("gpt_retries_total", stage=stage, error=e.__class__.__name__)
+                delay = self._backoff(attempt, e)
+                print(f"⏳ GPT request failed ({e.__class__.__name__}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def complete(self, prompt: str, model: str, temperature: float, stage: str = "gpt") -> str:
+        response = await self._request(prompt, lambda: self.client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature
+        ), stage)
+        metrics.record_gpt_usage(response, model, stage)
+        return response.choices[0].message.content
+
+    async def complete_structured(self, prompt: str, model: str, temperature: float, response_model,
+                                  max_attempts: int = STRUCTURED_MAX_ATTEMPTS, stage: str = "gpt"):
+        """
+        structured output variant of complete, returns a validated response_model instance.
+        invalid or refused output is re-requested up to max_attempts, then StructuredOutputError is raised
+        """
+        for attempt in range(1, max_attempts + 1):
+            try:
+                response = await self._request(prompt, lambda: self.client.beta.chat.completions.parse(
+                    **structured_request(prompt, model, temperature, response_model)
+                ), stage, structured=True)
+                return structured_response(response, model, stage)
+            except INVALID_OUTPUT_ERRORS as e:
+                retry_invalid_output(e, attempt, max_attempts, response_model, model, stage)
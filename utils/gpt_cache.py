@@ -0,0 +1,53 @@
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Optional
+
+DEFAULT_DB_PATH = Path(".cache") / "gpt_responses.sqlite3"
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class GPTResponseCache:
+    """
+    persistent sqlite cache of parsed GPT responses keyed on model, temperature, prompt version and input text hash
+    """
+
+    def __init__(self, db_path: Path = DEFAULT_DB_PATH):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS gpt_responses (
+                cache_key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(model: str, temperature: float, prompt_version: str, text: str) -> str:
+        return hash_text(f"{model}|{temperature}|{prompt_version}|{hash_text(text)}")
+
+    def get(self, key: str) -> Optional[dict]:
+        row = self.conn.execute(
+            "SELECT response FROM gpt_responses WHERE cache_key = ?", (key,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key: str, model: str, prompt_version: str, response: dict):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO gpt_responses VALUES (?, ?, ?, ?, ?)",
+            (key, model, prompt_version, json.dumps(response), time.time())
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
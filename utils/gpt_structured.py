@@ -0,0 +1,66 @@
+from typing import Type, TypeVar
+from openai import OpenAI, LengthFinishReasonError, ContentFilterFinishReasonError
+from pydantic import BaseModel, ValidationError
+from utils import metrics
+
+# attempts per document before a structured call is given up on
+STRUCTURED_MAX_ATTEMPTS = 3
+
+Model = TypeVar("Model", bound=BaseModel)
+
+class StructuredOutputError(ValueError):
+    """
+    raised when the model refuses or keeps returning output that doesn't validate against the schema
+    """
+
+# output problems worth re-asking for, api errors are left to the sdk/runner retries
+INVALID_OUTPUT_ERRORS = (ValidationError, LengthFinishReasonError, ContentFilterFinishReasonError, StructuredOutputError)
+
+def parsed_message(response):
+    message = response.choices[0].message
+    if message.parsed is None:
+        raise StructuredOutputError(f"model refused: {message.refusal}")
+    return message.parsed
+
+def structured_request(prompt: str, model: str, temperature: float, response_model: Type[Model]) -> dict:
+    """
+    keyword arguments for client.beta.chat.completions.parse, shared by the sync and async callers
+    """
+    return {
+        "model": model,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": temperature,
+        "response_format": response_model,
+    }
+
+def structured_response(response, model: str, stage: str):
+    metrics.record_gpt_usage(response, model, stage)
+    return parsed_message(response)
+
+def retry_invalid_output(error: Exception, attempt: int, max_attempts: int, response_model: Type[Model], model: str,
+                         stage: str):
+    """
+    counts an invalid reply, raising StructuredOutputError once it was the last attempt
+    """
+    metrics.increment("gpt_invalid_responses_total", model=model, stage=stage, error=error.__class__.__name__)
+    if attempt == max_attempts:
+        raise StructuredOutputError(
+            f"no valid {response_model.__name__} after {max_attempts} attempts: {error}"
+        ) from error
+    print(f"⏳ Invalid {response_model.__name__} from GPT ({error.__class__.__name__}), retrying")
+
+def parse_structured(client: OpenAI, prompt: str, model: str, temperature: float, response_model: Type[Model],
+                     max_attempts: int = STRUCTURED_MAX_ATTEMPTS, stage: str = "gpt") -> Model:
+    """
+    chat completion constrained to response_model's json schema, validated straight into the pydantic model.
+    invalid or refused output is retried up to max_attempts, then StructuredOutputError is raised
+    """
+    for attempt in range(1, max_attempts + 1):
+        try:
+            with metrics.timer(stage, structured=True):
+                response = client.beta.chat.completions.parse(
+                    **structured_request(prompt, model, temperature, response_model)
+                )
+            return structured_response(response, model, stage)
+        except INVALID_OUTPUT_ERRORS as e:
+            retry_invalid_output(e, attempt, max_attempts, response_model, model, stage)
@@ -0,0 +1,271 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Optional
+
+DEFAULT_QUEUE_PATH = Path("queue") / "jobs.sqlite3"
+
+PENDING = "pending"
+PARSING = "parsing"
+PARSED = "parsed"
+RECONCILING = "reconciling"
+DONE = "done"
+FAILED = "failed"
+# terminal: the partner document never turned up within max_partner_waits releases
+UNPAIRED = "unpaired"
+
+# stage -> (state a job waits in, state while a worker holds it)
+STAGES = {
+    "parse": (PENDING, PARSING),
+    "reconcile": (PARSED, RECONCILING),
+}
+
+class JobQueue:
+    """
+    durable sqlite backed job queue for the parse -> reconcile pipeline.
+
+    a claimed job is leased for visibility_timeout seconds; if the worker crashes the lease expires
+    and the job becomes claimable again, until it has used up max_attempts for its current stage.
+    a job released while waiting on a partner is counted separately and ends up unpaired after
+    max_partner_waits releases. each worker process should open its own JobQueue
+    """
+
+    def __init__(self, db_path: Path = DEFAULT_QUEUE_PATH, visibility_timeout: float = 300, max_attempts: int = 3,
+                 max_partner_waits: int = 20):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.max_partner_waits = max_partner_waits
+
+        # autocommit mode, transactions are opened explicitly with BEGIN IMMEDIATE where it matters
+        self.conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY,
+                pdf_path TEXT NOT NULL UNIQUE,
+                method TEXT NOT NULL,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                partner_waits INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL DEFAULT 0,
+                lease_expires_at REAL,
+                parsed_path TEXT,
+                result_path TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        # queues created before partner waits were counted
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(jobs)")}
+        if "partner_waits" not in columns:
+            self.conn.execute("ALTER TABLE jobs ADD COLUMN partner_waits INTEGER NOT NULL DEFAULT 0")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS ix_jobs_state ON jobs (state, available_at)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS ix_jobs_parsed_path ON jobs (parsed_path)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS locks (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self.owner = f"{os.getpid()}-{id(self)}"
+
+    def enqueue(self, pdf_path: Path, method: str) -> bool:
+        """
+        adds a pdf to the queue, returns False if it was already queued
+        """
+        now = time.time()
+        cursor = self.conn.execute(
+            "INSERT OR IGNORE INTO jobs (pdf_path, method, state, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (str(pdf_path), method, PENDING, now, now)
+        )
+        return cursor.rowcount == 1
+
+    def claim(self, stage: str) -> Optional[dict]:
+        """
+        leases the oldest job ready for the stage (or whose lease for it expired), None if there is nothing to do
+        """
+        ready_state, active_state = STAGES[stage]
+        while True:
+            now = time.time()
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    """
+                    SELECT * FROM jobs
+                    WHERE (state = ? AND available_at <= ?) OR (state = ? AND lease_expires_at < ?)
+                    ORDER BY id LIMIT 1
+                    """,
+                    (ready_state, now, active_state, now)
+                ).fetchone()
+                if row is None:
+                    self.conn.execute("COMMIT")
+                    return None
+
+                if row["attempts"] >= self.max_attempts:
+                    # crashed on every attempt, give up on it and look for the next job
+                    self.conn.execute(
+                        "UPDATE jobs SET state = ?, error = ?, updated_at = ? WHERE id = ?",
+                        (FAILED, row["error"] or f"{stage} lease expired {row['attempts']} times", now, row["id"])
+                    )
+                    self.conn.execute("COMMIT")
+                    continue
+
+                self.conn.execute(
+                    """
+                    UPDATE jobs SET state = ?, attempts = attempts + 1, lease_expires_at = ?, updated_at = ?
+                    WHERE id = ?
+                    """,
+                    (active_state, now + self.visibility_timeout, now, row["id"])
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+            job = dict(row)
+            job["state"] = active_state
+            job["attempts"] += 1
+            return job
+
+    @contextmanager
+    def lock(self, key: str, poll_interval: float = 0.2):
+        """
+        cross process mutex kept in the queue database, e.g. so two reconcile workers never rewrite the same
+        invoice's result at once. it is leased for visibility_timeout so a crashed holder can't keep it forever
+        """
+        while True:
+            now = time.time()
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute("DELETE FROM locks WHERE key = ? AND expires_at < ?", (key, now))
+                acquired = self.conn.execute(
+                    "INSERT OR IGNORE INTO locks (key, owner, expires_at) VALUES (?, ?, ?)",
+                    (key, self.owner, now + self.visibility_timeout)
+                ).rowcount == 1
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            if acquired:
+                break
+            time.sleep(poll_interval)
+        try:
+            yield
+        finally:
+            self.conn.execute("DELETE FROM locks WHERE key = ? AND owner = ?", (key, self.owner))
+
+    def heartbeat(self, job_id: int):
+        """
+        extends the lease of a long running job and of every lock this queue holds
+        """
+        self._renew(self.conn, job_id)
+
+    def _renew(self, conn, job_id: int):
+        now = time.time()
+        expires_at = now + self.visibility_timeout
+        conn.execute(
+            "UPDATE jobs SET lease_expires_at = ?, updated_at = ? WHERE id = ? AND lease_expires_at IS NOT NULL",
+            (expires_at, now, job_id)
+        )
+        conn.execute("UPDATE locks SET expires_at = ? WHERE owner = ?", (expires_at, self.owner))
+
+    @contextmanager
+    def keep_alive(self, job_id: int, interval: float = None):
+        """
+        heartbeats the job (and this queue's locks) from a background thread while the block runs, so a parse
+        or reconcile that takes longer than visibility_timeout isn't reclaimed by another worker.
+        renews every third of the timeout by default, over its own connection
+        """
+        interval = interval or self.visibility_timeout / 3
+        stopped = threading.Event()
+
+        def beat():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            try:
+                while not stopped.wait(interval):
+                    self._renew(conn, job_id)
+            finally:
+                conn.close()
+
+        thread = threading.Thread(target=beat, name=f"heartbeat-{job_id}", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stopped.set()
+            thread.join()
+
+    def complete(self, job_id: int, next_state: str, **fields):
+        """
+        moves a job on to next_state, resetting its attempts for the new stage
+        """
+        columns = {"state": next_state, "attempts": 0, "lease_expires_at": None, "error": None,
+                   "updated_at": time.time(), **fields}
+        assignments = ", ".join(f"{column} = ?" for column in columns)
+        self.conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*columns.values(), job_id))
+
+    def complete_parsed(self, parsed_paths: Iterable[str], result_path: str) -> int:
+        """
+        marks the waiting (parsed or unpaired) jobs of parsed files another job has just reconciled as done,
+        returns how many were updated
+        """
+        parsed_paths = [str(path) for path in parsed_paths]
+        if not parsed_paths:
+            return 0
+        placeholders = ", ".join("?" for _ in parsed_paths)
+        cursor = self.conn.execute(
+            f"""
+            UPDATE jobs SET state = ?, result_path = ?, attempts = 0, lease_expires_at = NULL, error = NULL,
+                updated_at = ?
+            WHERE parsed_path IN ({placeholders}) AND state IN (?, ?)
+            """,
+            (DONE, str(result_path), time.time(), *parsed_paths, PARSED, UNPAIRED)
+        )
+        return cursor.rowcount
+
+    def release(self, job_id: int, stage: str, delay: float = 0) -> str:
+        """
+        hands a job back to the stage without counting the attempt, e.g. while waiting on a partner document.
+        each release counts as a partner wait, after max_partner_waits the job is parked as unpaired instead.
+        returns the job's new state
+        """
+        ready_state, _ = STAGES[stage]
+        now = time.time()
+        self.conn.execute(
+            """
+            UPDATE jobs SET state = CASE WHEN partner_waits + 1 >= ? THEN ? ELSE ? END,
+                attempts = attempts - 1, partner_waits = partner_waits + 1, available_at = ?,
+                lease_expires_at = NULL, updated_at = ?
+            WHERE id = ?
+            """,
+            (self.max_partner_waits, UNPAIRED, ready_state, now + delay, now, job_id)
+        )
+        return self.conn.execute("SELECT state FROM jobs WHERE id = ?", (job_id,)).fetchone()["state"]
+
+    def fail(self, job_id: int, stage: str, error: str):
+        """
+        records an error, the job is retried until it runs out of attempts for the stage
+        """
+        ready_state, _ = STAGES[stage]
+        now = time.time()
+        self.conn.execute(
+            """
+            UPDATE jobs SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END,
+                error = ?, lease_expires_at = NULL, updated_at = ?
+            WHERE id = ?
+            """,
+            (self.max_attempts, FAILED, ready_state, error, now, job_id)
+        )
+
+    def counts(self) -> dict:
+        rows = self.conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        return {state: count for state, count in rows}
+
+    def close(self):
+        self.conn.close()
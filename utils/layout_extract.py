@@ -0,0 +1,197 @@
+import re
+from typing import Dict, List, Optional
+import pymupdf
+
+# header cell text -> line item field, matched on the lowercased, whitespace collapsed cell
+HEADER_ALIASES = {
+    "description": ["description", "item description", "item", "product", "details", "particulars"],
+    "quantity": ["qty", "quantity", "qty delivered", "qty supplied", "units"],
+    "unit_price": ["unit price", "price", "rate", "unit cost", "price each"],
+    "line_total": ["line total", "total", "amount", "ext price", "extended"],
+}
+
+# rows starting with these end the item table
+FOOTER_PATTERN = re.compile(r"^(sub\s*total|total|gst|tax|balance)\b", re.IGNORECASE)
+NUMBER_PATTERN = re.compile(r"-?\d[\d,]*(?:\.\d+)?")
+
+# words whose vertical centres are this close (in points) belong to the same row
+ROW_TOLERANCE = 3
+
+def _normalise(text: str) -> str:
+    return " ".join((text or "").lower().replace(":", "").split())
+
+def header_field(cell: str) -> Optional[str]:
+    normalised = _normalise(cell)
+    for field, aliases in HEADER_ALIASES.items():
+        if normalised in aliases:
+            return field
+    return None
+
+def map_header(cells: List[str]) -> Dict[int, str]:
+    """
+    column index -> field for a candidate header row, empty unless it has at least a description and quantity
+    """
+    columns = {}
+    for i, cell in enumerate(cells):
+        field = header_field(cell)
+        if field and field not in columns.values():
+            columns[i] = field
+    if {"description", "quantity"} <= set(columns.values()):
+        return columns
+    return {}
+
+def parse_number(text: str) -> Optional[float]:
+    match = NUMBER_PATTERN.search((text or "").replace("$", ""))
+    return float(match.group(0).replace(",", "")) if match else None
+
+def row_to_item(cells: List[str], columns: Dict[int, str]) -> Optional[dict]:
+    values = {field: (cells[i] if i < len(cells) else None) for i, field in columns.items()}
+    description = " ".join((values.get("description") or "").split())
+    quantity = parse_number(values.get("quantity"))
+    if not description or quantity is None:
+        return None
+
+    # fractional quantities (2.5 m3, 0.75 t) are kept as floats
+    item = {"description": description, "quantity": int(quantity) if quantity.is_integer() else quantity}
+    for field in ("unit_price", "line_total"):
+        value = parse_number(values.get(field))
+        if value is not None:
+            item[field] = value
+    return item
+
+def continuation_text(cells: List[str], columns: Dict[int, str]) -> Optional[str]:
+    """
+    the description text of a row that only holds description text, i.e. a wrapped line of the item above
+    """
+    values = {field: (cells[i] if i < len(cells) else None) or "" for i, field in columns.items()}
+    description = " ".join(values.get("description", "").split())
+    if description and not any(value.strip() for field, value in values.items() if field != "description"):
+        return description
+    return None
+
+def cluster_rows(words) -> List[List[tuple]]:
+    """
+    groups get_text("words") tuples into visual rows by vertical centre, each row sorted left to right
+    """
+    rows = []
+    for word in sorted(words, key=lambda w: ((w[1] + w[3]) / 2, w[0])):
+        centre = (word[1] + word[3]) / 2
+        if rows and abs(rows[-1][0] - centre) <= ROW_TOLERANCE:
+            rows[-1][1].append(word)
+        else:
+            rows.append([centre, [word]])
+    return [sorted(row, key=lambda w: w[0]) for _, row in rows]
+
+def _header_columns(row) -> List[tuple]:
+    """
+    (x0, field) column anchors for a word row that reads like a table header, multi word headers
+    such as 'Unit Price' are joined when their words are adjacent
+    """
+    anchors = []
+    i = 0
+    while i < len(row):
+        for span in (3, 2, 1):
+            words = row[i:i + span]
+            field = header_field(" ".join(w[4] for w in words))
+            if field and len(words) == span:
+                anchors.append((words[0][0], field))
+                i += span
+                break
+        else:
+            i += 1
+    fields = [field for _, field in anchors]
+    if {"description", "quantity"} <= set(fields) and len(fields) == len(set(fields)):
+        return anchors
+    return []
+
+class LayoutItemReader:
+    """
+    reads line items from page geometry one page at a time: ruled tables via find_tables, otherwise words
+    clustered into rows and assigned to the header's columns. the column map carries over to the next page
+    so a table continued without its header keeps its columns (a repeated header just resets it), a totals
+    row ends the table, and a row holding only description text is joined onto the item above
+    """
+
+    def __init__(self):
+        self.items: List[dict] = []
+        # ruled tables: cell index -> field
+        self.columns: Dict[int, str] = {}
+        # word layout: (x0, field) anchors
+        self.anchors: List[tuple] = []
+
+    def _add_row(self, cells: List[str], columns: Dict[int, str], can_continue: bool = True) -> bool:
+        """
+        adds the row as an item, or joins it onto the previous item when it is a wrapped description line.
+        returns whether the row was used
+        """
+        item = row_to_item(cells, columns)
+        if item:
+            self.items.append(item)
+            return True
+        wrapped = continuation_text(cells, columns)
+        if wrapped and can_continue and self.items:
+            self.items[-1]["description"] = f"{self.items[-1]['description']} {wrapped}"
+            return True
+        return False
+
+    def add_table_rows(self, rows: List[List[str]]):
+        # a wrapped line only continues an item from the same table
+        can_continue = False
+        for cells in rows:
+            cells = [cell or "" for cell in cells]
+            header = map_header(cells)
+            if header:
+                self.columns = header
+                continue
+            if not self.columns:
+                continue
+            first_cell = next((cell for cell in cells if cell.strip()), "")
+            if FOOTER_PATTERN.match(first_cell.strip()):
+                self.columns = {}
+                return
+            can_continue = self._add_row(cells, self.columns, can_continue) or can_continue
+
+    def add_word_rows(self, rows: List[List[tuple]]):
+        # a wrapped line has to sit directly under the row it continues, not be a page header or a note further down
+        previous_bottom = None
+        for row in rows:
+            top, bottom = min(word[1] for word in row), max(word[3] for word in row)
+            can_continue = previous_bottom is not None and top - previous_bottom <= bottom - top
+            previous_bottom = None
+            header = _header_columns(row)
+            if header:
+                self.anchors = header
+                continue
+            if not self.anchors:
+                continue
+            if FOOTER_PATTERN.match(" ".join(word[4] for word in row)):
+                self.anchors = []
+                return
+
+            cells = [[] for _ in self.anchors]
+            for word in row:
+                # tolerate values that start slightly left of their header (e.g. right aligned numbers)
+                column = 0
+                for i, (x0, _) in enumerate(self.anchors):
+                    if word[0] >= x0 - 5:
+                        column = i
+                cells[column].append(word[4])
+            if self._add_row([" ".join(cell) for cell in cells], dict(enumerate(field for _, field in self.anchors)), can_continue):
+                previous_bottom = bottom
+
+    def add_page(self, page):
+        count = len(self.items)
+        for table in page.find_tables().tables:
+            self.add_table_rows(table.extract())
+        if len(self.items) == count:
+            self.add_word_rows(cluster_rows(page.get_text("words")))
+
+def extract_layout_line_items(pdf_path) -> List[dict]:
+    """
+    layout aware line items straight from page geometry: ruled tables first, word column clustering otherwise
+    """
+    reader = LayoutItemReader()
+    with pymupdf.open(pdf_path) as doc:
+        for page in doc:
+            reader.add_page(page)
+    return reader.items
@@ -0,0 +1,150 @@
+import re
+import unicodedata
+from typing import Dict, List, Tuple
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+def normalise_description(description: str) -> str:
+    """
+    lowercases and strips punctuation so 'Switch Plate - 2 Gang' and '2-Gang Switch Plate' share tokens
+    """
+    text = unicodedata.normalize("NFKC", description or "").lower()
+    return " ".join(TOKEN_PATTERN.findall(text))
+
+def description_ngrams(description: str, n: int = 3) -> List[str]:
+    """
+    character n-grams of each normalised token (padded with word boundaries), so word order does not matter
+    """
+    grams = []
+    for token in normalise_description(description).split():
+        padded = f" {token} "
+        if len(padded) <= n:
+            grams.append(padded)
+            continue
+        grams.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+    return grams
+
+def _ngram_matrix(descriptions: List[str], vocab: dict) -> np.ndarray:
+    matrix = np.zeros((len(descriptions), len(vocab)))
+    for row, description in enumerate(descriptions):
+        for gram in description_ngrams(description):
+            matrix[row, vocab[gram]] += 1
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+def similarity_matrix(left: List[str], right: List[str]) -> np.ndarray:
+    """
+    cosine similarity of character n-gram count vectors for every left x right description pair, in [0, 1]
+    """
+    vocab = {}
+    for description in left + right:
+        for gram in description_ngrams(description):
+            vocab.setdefault(gram, len(vocab))
+    if not vocab:
+        return np.zeros((len(left), len(right)))
+    return _ngram_matrix(left, vocab) @ _ngram_matrix(right, vocab).T
+
+def linear_sum_assignment(cost: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    minimum cost assignment of rows to columns (hungarian / shortest augmenting path, O(n^2 m)).
+    returns (row_indices, col_indices) like scipy.optimize.linear_sum_assignment, for rectangular matrices too
+    """
+    cost = np.asarray(cost, dtype=float)
+    if cost.size == 0:
+        return np.array([], dtype=int), np.array([], dtype=int)
+
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+
+    # potentials and matching are 1-indexed, column 0 is a virtual column used to start each augmentation
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    row_for_col = np.zeros(m + 1, dtype=int)
+    way = np.zeros(m + 1, dtype=int)
+
+    for row in range(1, n + 1):
+        row_for_col[0] = row
+        col = 0
+        min_slack = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+
+        while True:
+            used[col] = True
+            current_row = row_for_col[col]
+            free = ~used[1:]
+
+            slack = cost[current_row - 1] - u[current_row] - v[1:]
+            improved = free & (slack < min_slack[1:])
+            min_slack[1:][improved] = slack[improved]
+            way[1:][improved] = col
+
+            candidates = np.where(free, min_slack[1:], np.inf)
+            next_col = int(np.argmin(candidates)) + 1
+            delta = candidates[next_col - 1]
+
+            u[row_for_col[used]] += delta
+            v[used] -= delta
+            min_slack[~used] -= delta
+
+            col = next_col
+            if row_for_col[col] == 0:
+                break
+
+        # flip the augmenting path
+        while col:
+            prev_col = way[col]
+            row_for_col[col] = row_for_col[prev_col]
+            col = prev_col
+
+    cols = np.nonzero(row_for_col[1:])[0]
+    rows = row_for_col[1:][cols] - 1
+    if transposed:
+        rows, cols = cols, rows
+    order = np.argsort(rows)
+    return rows[order], cols[order]
+
+def match_descriptions(left: List[str], right: List[str], threshold: float) -> List[Tuple[int, int, float]]:
+    """
+    globally optimal one-to-one pairing of left and right descriptions, keeping only pairs scoring >= threshold.
+    returns (left_index, right_index, score) tuples
+    """
+    if not left or not right:
+        return []
+
+    scores = similarity_matrix(left, right)
+    # pairs under the threshold can never be matched so they carry no weight in the assignment
+    eligible = np.where(scores >= threshold, scores, 0.0)
+    rows, cols = linear_sum_assignment(-eligible)
+    return [
+        (int(r), int(c), float(scores[r, c]))
+        for r, c in zip(rows, cols)
+        if scores[r, c] >= threshold
+    ]
+
+def attribute_lines(targets: List[str], lines: List[str], threshold: float) -> Tuple[Dict[int, List[int]], List[int]]:
+    """
+    many-to-one attribution of lines (e.g. pooled docket lines) to targets (e.g. invoice lines): an optimal
+    one-to-one pairing first, then every leftover line scoring >= threshold joins its most similar target.
+    returns ({target_index: [line_index, ...]}, unattributed line indices)
+    """
+    lines_for_target = {target: [line] for target, line, _ in match_descriptions(targets, lines, threshold)}
+    attributed = {line for indices in lines_for_target.values() for line in indices}
+
+    # the same item split over several documents leaves partial lines unpaired after the one-to-one pass
+    leftovers = [line for line in range(len(lines)) if line not in attributed]
+    unattributed = []
+    if leftovers and targets:
+        scores = similarity_matrix([lines[line] for line in leftovers], targets)
+        for row, line in enumerate(leftovers):
+            target = int(scores[row].argmax())
+            if scores[row, target] >= threshold:
+                lines_for_target.setdefault(target, []).append(line)
+            else:
+                unattributed.append(line)
+    else:
+        unattributed = leftovers
+    return lines_for_target, unattributed
@@ -0,0 +1,125 @@
+import atexit
+import os
+import smtplib
+import ssl
+from email.message import EmailMessage
+from pathlib import Path
+from typing import List, Optional
+from utils import metrics
+
+SMTP_HOST = "smtp.gmail.com"
+SMTP_PORT = 465
+
+# errors that mean the session itself is gone, anything else (refused recipients etc) is not retried
+RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError, ssl.SSLError)
+
+_default_mailer = None
+
+def build_message(subject: str, body: str, sender: str, recipient: str, attachment_paths=()) -> EmailMessage:
+    msg = EmailMessage()
+    msg["Subject"] = subject
+    msg["From"] = sender
+    msg["To"] = recipient
+    msg.set_content(body)
+
+    for attachment_path in attachment_paths:
+        if attachment_path and os.path.exists(attachment_path):
+            with open(attachment_path, "rb") as f:
+                msg.add_attachment(
+                    f.read(), maintype="application", subtype="octet-stream",
+                    filename=os.path.basename(attachment_path)
+                )
+    return msg
+
+class Mailer:
+    """
+    keeps one authenticated smtp session open across messages, reconnecting once if the server dropped it.
+    smtp_class=smtplib.SMTP with a local host/port works against an aiosmtpd style stand-in
+    """
+
+    def __init__(self, user: str = None, password: str = None, recipient: str = None,
+                 host: str = SMTP_HOST, port: int = SMTP_PORT, smtp_class=smtplib.SMTP_SSL):
+        self.user = user if user is not None else os.getenv("EMAIL_USER")
+        self.password = password if password is not None else os.getenv("EMAIL_PASS")
+        self.recipient = recipient if recipient is not None else os.getenv("EMAIL_RECEIVER")
+        self.host = host
+        self.port = port
+        self.smtp_class = smtp_class
+        self.smtp = None
+
+    def _connect(self):
+        self.smtp = self.smtp_class(self.host, self.port)
+        if self.user and self.password:
+            self.smtp.login(self.user, self.password)
+
+    def _reset(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.close()
+            except Exception:
+                pass
+        self.smtp = None
+
+    @metrics.timer("smtp_send")
+    def send_message(self, msg: EmailMessage):
+        for attempt in range(2):
+            if self.smtp is None:
+                self._connect()
+            try:
+                self.smtp.send_message(msg)
+                return
+            except RECONNECT_ERRORS:
+                metrics.increment("smtp_reconnects_total")
+                self._reset()
+                if attempt:
+                    raise
+
+    def send(self, subject: str, body: str, attachment_paths=()):
+        self.send_message(build_message(subject, body, self.user, self.recipient, attachment_paths))
+
+    def close(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except Exception:
+                pass
+        self.smtp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class DigestMailer:
+    """
+    collects reconciliation summaries and sends them as one email per batch, with every attachment included
+    """
+
+    def __init__(self, mailer: Mailer, subject: str = "Reconciliation digest"):
+        self.mailer = mailer
+        self.subject = subject
+        self.entries: List[tuple] = []
+
+    def add(self, subject: str, body: str, attachment_path: Optional[Path] = None):
+        self.entries.append((subject, body, attachment_path))
+
+    def flush(self) -> int:
+        if not self.entries:
+            return 0
+        count = len(self.entries)
+        body = "\n\n".join(f"{subject}\n{'-' * len(subject)}\n{body}" for subject, body, _ in self.entries)
+        attachments = [path for _, _, path in self.entries if path]
+        self.mailer.send(f"{self.subject}: {count} reconciliation(s)", body, attachments)
+        self.entries = []
+        return count
+
+def get_default_mailer() -> Mailer:
+    """
+    process wide mailer so a batch reuses one smtp session, closed at interpreter exit
+    """
+    global _default_mailer
+    if _default_mailer is None:
+        _default_mailer = Mailer()
+        atexit.register(_default_mailer.close)
+    return _default_mailer
@@ -0,0 +1,269 @@
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import ContextDecorator
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+
+# seconds, covers regex parsing (ms) up to slow GPT round trips
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+
+# METRICS_LOG: path to append json lines to, or "-" for stderr. unset disables the log
+# METRICS_PORT: serve prometheus text format on this port at /metrics. unset disables the endpoint
+METRICS_LOG_ENV = "METRICS_LOG"
+METRICS_PORT_ENV = "METRICS_PORT"
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+def _label_key(labels: dict) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def merge(self, other: "Histogram"):
+        self.sum += other.sum
+        self.count += other.count
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+
+class MetricsRegistry:
+    """
+    in-process counters and histograms keyed by name + labels, safe to update from several threads
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[str, Dict[LabelKey, float]] = {}
+        self.histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+
+    def increment(self, name: str, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, buckets=DURATION_BUCKETS, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram(buckets)
+            series[key].observe(value)
+
+    def drain(self) -> dict:
+        """
+        hands over everything recorded so far and starts empty, so a pool worker can return its metrics
+        with each result instead of keeping them in its own process
+        """
+        with self.lock:
+            state = {"counters": self.counters, "histograms": self.histograms}
+            self.counters, self.histograms = {}, {}
+        return state
+
+    def merge(self, state: dict):
+        """
+        adds a drained registry (e.g. from a pool worker) into this one
+        """
+        with self.lock:
+            for name, series in state["counters"].items():
+                target = self.counters.setdefault(name, {})
+                for key, value in series.items():
+                    target[key] = target.get(key, 0) + value
+            for name, series in state["histograms"].items():
+                target = self.histograms.setdefault(name, {})
+                for key, histogram in series.items():
+                    if key not in target:
+                        target[key] = Histogram(histogram.buckets)
+                    target[key].merge(histogram)
+
+    def snapshot(self) -> dict:
+        """
+        json friendly view: counters as values, histograms as count/sum/mean per label set
+        """
+        with self.lock:
+            return {
+                "counters": {
+                    name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                    for name, series in self.counters.items()
+                },
+                "histograms": {
+                    name: [
+                        {"labels": dict(key), "count": h.count, "sum": round(h.sum, 6),
+                         "mean": round(h.sum / h.count, 6) if h.count else None}
+                        for key, h in series.items()
+                    ]
+                    for name, series in self.histograms.items()
+                },
+            }
+
+    def render_prometheus(self) -> str:
+        """
+        prometheus text exposition format
+        """
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for key, h in series.items():
+                    for bound, count in zip(h.buckets, h.counts):
+                        lines.append(f"{name}_bucket{_format_labels(key + (('le', str(bound)),))} {count}")
+                    lines.append(f"{name}_bucket{_format_labels(key + (('le', '+Inf'),))} {h.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {h.sum}")
+                    lines.append(f"{name}_count{_format_labels(key)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+def _format_labels(key: LabelKey) -> str:
+    if not key:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in key)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(key, escaped)) + "}"
+
+REGISTRY = MetricsRegistry()
+
+_log_lock = threading.Lock()
+_log_file = None
+_server = None
+_configured = False
+
+def _log_target():
+    global _log_file
+    if _log_file is None:
+        target = os.getenv(METRICS_LOG_ENV)
+        if not target:
+            return None
+        _log_file = sys.stderr if target == "-" else open(target, "a", encoding="utf-8", buffering=1)
+    return _log_file
+
+def log_event(event: str, **fields):
+    """
+    writes one json line to the metrics log, a no-op when METRICS_LOG is unset
+    """
+    target = _log_target()
+    if target is None:
+        return
+    record = {"ts": datetime.now(timezone.utc).isoformat(), "event": event, "pid": os.getpid(), **fields}
+    with _log_lock:
+        target.write(json.dumps(record, default=str) + "\n")
+
+def reset():
+    """
+    drops everything recorded so far, e.g. what a forked pool worker inherited from its parent
+    """
+    REGISTRY.drain()
+
+def increment(name: str, amount: float = 1, **labels):
+    REGISTRY.increment(name, amount, **labels)
+
+def observe(name: str, value: float, buckets=DURATION_BUCKETS, **labels):
+    REGISTRY.observe(name, value, buckets, **labels)
+
+class timer(ContextDecorator):
+    """
+    times a pipeline stage into the stage_duration_seconds histogram and logs it, usable as
+    `with timer("extract"):` or `@timer("reconcile")`. failures are counted in stage_errors_total
+    """
+
+    def __init__(self, stage: str, **labels):
+        self.stage = stage
+        self.labels = labels
+        self._starts = threading.local()
+
+    def __enter__(self):
+        # a stack so the same decorator instance can be re-entered (recursion, threads)
+        starts = getattr(self._starts, "stack", None)
+        if starts is None:
+            starts = self._starts.stack = []
+        starts.append(time.perf_counter())
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._starts.stack.pop()
+        status = "error" if exc_type else "ok"
+        observe("stage_duration_seconds", elapsed, stage=self.stage, **self.labels)
+        if exc_type:
+            increment("stage_errors_total", stage=self.stage, error=exc_type.__name__, **self.labels)
+        log_event("stage", stage=self.stage, seconds=round(elapsed, 6), status=status, **self.labels)
+        return False
+
+def record_gpt_usage(response, model: str, stage: str):
+    """
+    counts requests and prompt/completion tokens from a chat completion's usage field
+    """
+    increment("gpt_requests_total", model=model, stage=stage)
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    increment("gpt_prompt_tokens_total", prompt_tokens, model=model, stage=stage)
+    increment("gpt_completion_tokens_total", completion_tokens, model=model, stage=stage)
+    observe("gpt_prompt_tokens", prompt_tokens, TOKEN_BUCKETS, model=model, stage=stage)
+    log_event("gpt_usage", model=model, stage=stage, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port: int, host: str = "0.0.0.0"):
+    """
+    serves /metrics from a daemon thread, returns None when the port is already taken (e.g. by a sibling worker)
+    """
+    global _server
+    if _server is not None:
+        return _server
+    try:
+        _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        print(f"⚠️ Metrics endpoint not started on port {port}: {e}")
+        return None
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
+
+def _log_summary():
+    log_event("metrics_summary", **REGISTRY.snapshot())
+
+def configure():
+    """
+    called from entry points: starts the prometheus endpoint when METRICS_PORT is set
+    and logs a summary of this process' metrics at exit when METRICS_LOG is set
+    """
+    global _configured
+    if _configured:
+        return
+    _configured = True
+    port = os.getenv(METRICS_PORT_ENV)
+    if port:
+        start_metrics_server(int(port))
+    if os.getenv(METRICS_LOG_ENV):
+        atexit.register(_log_summary)
@@ -0,0 +1,123 @@
+import hashlib
+import multiprocessing
+import os
+from functools import partial
+from pathlib import Path
+from typing import Dict, List, Tuple
+import pymupdf
+from utils.batch_utils import run_in_pool, default_worker_count
+
+OCR_CACHE_DIR = Path(".cache") / "ocr"
+OCR_DPI = 300
+OCR_LANGUAGE = "eng"
+
+# error text pymupdf gives when tesseract or its language data can't be found, as opposed to one page failing
+TESSERACT_MISSING_HINTS = ("tessdata", "tesseract is not installed", "ocr initialisation", "ocr initialization")
+
+# set once tesseract turned out to be missing so that is only reported once per process
+_ocr_unavailable = False
+_tesseract_checked = False
+
+def _tesseract_missing(error: Exception) -> bool:
+    message = str(error).lower()
+    return isinstance(error, (RuntimeError, OSError)) and any(hint in message for hint in TESSERACT_MISSING_HINTS)
+
+def tesseract_available() -> bool:
+    """
+    looks for tesseract once per process, before any pages are handed to OCR workers,
+    so a missing install is reported once here instead of by every worker
+    """
+    global _ocr_unavailable, _tesseract_checked
+    if not _tesseract_checked:
+        _tesseract_checked = True
+        try:
+            pymupdf.get_tessdata()
+        except RuntimeError as e:
+            _ocr_unavailable = True
+            print(f"!! OCR unavailable (is tesseract installed and TESSDATA_PREFIX set?): {e}")
+    return not _ocr_unavailable
+
+def page_needs_ocr(page, text: str) -> bool:
+    """
+    a page with images but no extractable text is treated as a scan
+    """
+    return not text.strip() and bool(page.get_images(full=False))
+
+def _cache_path(pixmap, language: str, dpi: int) -> Path:
+    digest = hashlib.sha256()
+    digest.update(f"{language}|{dpi}|{pixmap.width}x{pixmap.height}|".encode())
+    digest.update(pixmap.samples)
+    key = digest.hexdigest()
+    return OCR_CACHE_DIR / key[:2] / f"{key}.txt"
+
+def ocr_page(page, language: str = OCR_LANGUAGE, dpi: int = OCR_DPI) -> str:
+    """
+    OCRs one page through PyMuPDF's tesseract integration, cached by a hash of the rendered page image
+    so re-sent scans are never OCR'd twice. a missing tesseract disables OCR for the process, any other
+    error only skips this page (and isn't cached)
+    """
+    global _ocr_unavailable
+    if _ocr_unavailable:
+        return ""
+
+    pixmap = page.get_pixmap(dpi=dpi)
+    cache_path = _cache_path(pixmap, language, dpi)
+    if cache_path.exists():
+        return cache_path.read_text(encoding="utf-8")
+
+    try:
+        # renders to a one page pdf with a text layer, reusing the pixmap already rendered for the hash
+        with pymupdf.open("pdf", pixmap.pdfocr_tobytes(language=language)) as ocr_doc:
+            text = ocr_doc[0].get_text()
+    except Exception as e:
+        if _tesseract_missing(e):
+            _ocr_unavailable = True
+            print(f"!! OCR unavailable (is tesseract installed and TESSDATA_PREFIX set?): {e}")
+        else:
+            print(f"!! OCR failed for page {page.number + 1}, skipping it: {e}")
+        return ""
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(text, encoding="utf-8")
+    os.replace(tmp_path, cache_path)
+    return text
+
+def _limit_tesseract_threads():
+    # pool initializer: tesseract is multi threaded by default, which oversubscribes cores when pages run in parallel
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+def _ocr_page_worker(page_number: int, pdf_path: str, language: str, dpi: int):
+    with pymupdf.open(pdf_path) as doc:
+        return page_number, ocr_page(doc[page_number], language, dpi)
+
+def ocr_pages(pdf_path, page_numbers: List[int], workers: int = None,
+              language: str = OCR_LANGUAGE, dpi: int = OCR_DPI) -> Dict[int, str]:
+    """
+    OCRs the given pages in parallel across processes, returns page number -> text
+    """
+    if workers is None:
+        # already inside a batch worker process, the batch pool is using the cores
+        workers = 1 if multiprocessing.parent_process() is not None else default_worker_count()
+    workers = max(1, min(workers, len(page_numbers)))
+    worker = partial(_ocr_page_worker, pdf_path=str(pdf_path), language=language, dpi=dpi)
+    return dict(run_in_pool(worker, page_numbers, workers, initializer=_limit_tesseract_threads))
+
+def extract_page_texts(pdf_path, workers: int = None) -> Tuple[List[str], List[int]]:
+    """
+    text of every page, with scanned (text-less) pages filled in by parallel OCR.
+    also returns the scanned pages that still have no text, e.g. because OCR is unavailable or failed
+    """
+    with pymupdf.open(pdf_path) as doc:
+        texts = []
+        scanned = []
+        for page in doc:
+            text = page.get_text()
+            if page_needs_ocr(page, text):
+                scanned.append(page.number)
+            texts.append(text)
+
+    if scanned and tesseract_available():
+        for page_number, text in ocr_pages(pdf_path, scanned, workers).items():
+            texts[page_number] = text
+    return texts, [page_number for page_number in scanned if not texts[page_number].strip()]
@@ -0,0 +1,226 @@
+import os
+import sqlite3
+from pathlib import Path
+from typing import List
+import numpy as np
+import pandas as pd
+from utils.line_matching import TOKEN_PATTERN
+
+DEFAULT_HISTORY_PATH = Path(os.getenv("PRICE_HISTORY_PATH", "price_history.db"))
+
+# line_total may differ from quantity x unit_price by rounding, anything beyond this is an error
+LINE_TOTAL_TOLERANCE = 0.01
+# unit prices this far (relative) from the supplier's historical mean are flagged
+PRICE_DRIFT_THRESHOLD = 0.15
+# history needs this many observations of an item before drift is judged against it
+MIN_HISTORY_OBSERVATIONS = 3
+
+FRAME_COLUMNS = ["doc", "line", "supplier_name", "invoice_number", "description", "quantity", "unit_price", "line_total"]
+
+def normalise_descriptions(descriptions: pd.Series) -> pd.Series:
+    """
+    vectorised normalise_description, so reworded repeats of the same item share a key
+    """
+    return (
+        descriptions.fillna("").astype(str)
+        .str.normalize("NFKC").str.lower()
+        .str.findall(TOKEN_PATTERN).str.join(" ")
+    )
+
+def line_items_frame(invoices: List[dict]) -> pd.DataFrame:
+    """
+    one row per line item across every invoice in the batch, doc/line index back into the input
+    """
+    rows = [
+        (doc, line, invoice.get("supplier_name"), invoice.get("invoice_number"), item.get("description"),
+         item.get("quantity"), item.get("unit_price"), item.get("line_total"))
+        for doc, invoice in enumerate(invoices)
+        for line, item in enumerate(invoice.get("line_items") or [])
+    ]
+    frame = pd.DataFrame(rows, columns=FRAME_COLUMNS)
+    for column in ("quantity", "unit_price", "line_total"):
+        frame[column] = pd.to_numeric(frame[column], errors="coerce")
+    frame["supplier_key"] = frame["supplier_name"].fillna("").str.strip().str.lower()
+    frame["item_key"] = normalise_descriptions(frame["description"])
+    return frame
+
+def find_duplicate_charges(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    items charged on more than one line of the same invoice, one row per (doc, item) with its line numbers
+    """
+    repeated = frame[frame["item_key"].ne("") & frame.duplicated(["doc", "item_key"], keep=False)]
+    return (
+        repeated.groupby(["doc", "item_key"], sort=False)
+        .agg(description=("description", "first"), occurrences=("line", "size"),
+             lines=("line", list), total_quantity=("quantity", "sum"))
+        .reset_index()
+    )
+
+def find_line_total_errors(frame: pd.DataFrame, tolerance: float = LINE_TOTAL_TOLERANCE) -> pd.DataFrame:
+    """
+    lines whose line_total doesn't equal quantity x unit_price (beyond rounding)
+    """
+    expected = frame["quantity"] * frame["unit_price"]
+    difference = (frame["line_total"] - expected).abs()
+    allowed = np.maximum(tolerance, frame["line_total"].abs() * tolerance)
+    errors = frame[difference.gt(allowed)].copy()
+    errors["expected_total"] = expected[errors.index].round(2)
+    return errors
+
+class SupplierPriceHistory:
+    """
+    running count/mean/variance of unit prices per supplier and normalised item, kept in sqlite.
+    batches are merged in with the parallel (Chan et al.) update so the raw prices are never stored.
+    the merge runs inside sqlite so concurrent workers can't overwrite each other's updates, and every
+    (supplier, invoice number) folded in is recorded so a re-run or retry doesn't count an invoice twice
+    """
+
+    def __init__(self, db_path: Path = DEFAULT_HISTORY_PATH):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # several reconcile workers may update the history at once. autocommit mode, update opens its own
+        # BEGIN IMMEDIATE transaction
+        self.conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS price_history (
+                supplier_key TEXT NOT NULL,
+                item_key TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                mean REAL NOT NULL,
+                m2 REAL NOT NULL,
+                last_price REAL,
+                PRIMARY KEY (supplier_key, item_key)
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS price_history_invoices (
+                supplier_key TEXT NOT NULL,
+                invoice_number TEXT NOT NULL,
+                PRIMARY KEY (supplier_key, invoice_number)
+            )
+        """)
+
+    def load(self, supplier_keys) -> pd.DataFrame:
+        suppliers = sorted(set(supplier_keys))
+        if not suppliers:
+            return pd.DataFrame(columns=["supplier_key", "item_key", "count", "mean", "m2", "last_price"])
+        placeholders = ",".join("?" * len(suppliers))
+        return pd.read_sql_query(
+            f"SELECT supplier_key, item_key, count, mean, m2, last_price FROM price_history WHERE supplier_key IN ({placeholders})",
+            self.conn, params=suppliers
+        )
+
+    def update(self, frame: pd.DataFrame):
+        """
+        folds the batch's priced lines into the history, skipping invoices already folded in.
+        invoices without an invoice number can't be recognised again and are always folded in
+        """
+        priced = frame[frame["unit_price"].notna() & frame["supplier_key"].ne("") & frame["item_key"].ne("")]
+        if priced.empty:
+            return
+        priced = priced.assign(invoice_key=priced["invoice_number"].fillna("").astype(str).str.strip())
+        # the same invoice twice in one batch counts once
+        numbered = priced[priced["invoice_key"].ne("")]
+        first_doc = numbered.groupby(["supplier_key", "invoice_key"])["doc"].transform("min")
+        priced = priced.drop(numbered.index[numbered["doc"].ne(first_doc)])
+
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            invoices = priced.loc[priced["invoice_key"].ne(""), ["supplier_key", "invoice_key"]].drop_duplicates()
+            inserted = [
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO price_history_invoices (supplier_key, invoice_number) VALUES (?, ?)", invoice
+                ).rowcount == 1
+                for invoice in invoices.itertuples(index=False, name=None)
+            ]
+            seen = invoices[[not new for new in inserted]]
+            if not seen.empty:
+                priced = priced[~priced.set_index(["supplier_key", "invoice_key"]).index.isin(
+                    seen.set_index(["supplier_key", "invoice_key"]).index
+                )]
+
+            batch = (
+                priced.assign(price_squared=priced["unit_price"] ** 2)
+                .groupby(["supplier_key", "item_key"])
+                .agg(batch_count=("unit_price", "size"), batch_mean=("unit_price", "mean"),
+                     batch_sum_squares=("price_squared", "sum"), last_price=("unit_price", "last"))
+                .reset_index()
+            )
+            batch["batch_m2"] = (batch["batch_sum_squares"] - batch["batch_count"] * batch["batch_mean"] ** 2).clip(lower=0)
+
+            # chan et al. merge of the batch into the stored row, every right hand side sees the old values
+            self.conn.executemany(
+                """
+                INSERT INTO price_history (supplier_key, item_key, count, mean, m2, last_price) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (supplier_key, item_key) DO UPDATE SET
+                    mean = mean + (excluded.mean - mean) * excluded.count / (count + excluded.count),
+                    m2 = m2 + excluded.m2
+                        + (excluded.mean - mean) * (excluded.mean - mean) * count * excluded.count / (count + excluded.count),
+                    count = count + excluded.count,
+                    last_price = excluded.last_price
+                """,
+                batch[["supplier_key", "item_key", "batch_count", "batch_mean", "batch_m2", "last_price"]]
+                .astype({"batch_count": int}).itertuples(index=False, name=None)
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        self.conn.close()
+
+def find_price_drift(frame: pd.DataFrame, history: pd.DataFrame, threshold: float = PRICE_DRIFT_THRESHOLD,
+                     min_observations: int = MIN_HISTORY_OBSERVATIONS) -> pd.DataFrame:
+    """
+    priced lines whose unit price moved more than threshold from the supplier's historical mean for the item
+    """
+    known = history[history["count"] >= min_observations]
+    merged = frame[frame["unit_price"].notna()].merge(
+        known[["supplier_key", "item_key", "count", "mean"]], on=["supplier_key", "item_key"], how="inner"
+    )
+    merged["change"] = (merged["unit_price"] - merged["mean"]) / merged["mean"]
+    return merged[merged["change"].abs().gt(threshold) & merged["mean"].gt(0)]
+
+def detect_line_anomalies(invoices: List[dict], history: SupplierPriceHistory = None,
+                          drift_threshold: float = PRICE_DRIFT_THRESHOLD) -> List[List[dict]]:
+    """
+    duplicate charges, line total errors and (when a history is given) supplier price drift for a whole
+    batch of invoices in one pass. returns one list of discrepancies per invoice, in input order,
+    and folds the batch's prices into the history afterwards
+    """
+    anomalies = [[] for _ in invoices]
+    frame = line_items_frame(invoices)
+    if frame.empty:
+        return anomalies
+
+    for row in find_duplicate_charges(frame).itertuples(index=False):
+        anomalies[row.doc].append({
+            "description": row.description,
+            "occurrences": int(row.occurrences),
+            "line_numbers": [int(line) + 1 for line in row.lines],
+            "issue": "Duplicate charge"
+        })
+
+    for row in find_line_total_errors(frame).itertuples(index=False):
+        anomalies[row.doc].append({
+            "description": row.description,
+            "quantity": float(row.quantity),
+            "unit_price": float(row.unit_price),
+            "line_total": float(row.line_total),
+            "expected_total": float(row.expected_total),
+            "issue": "Line total mismatch"
+        })
+
+    if history is not None:
+        known = history.load(frame["supplier_key"])
+        for row in find_price_drift(frame, known, drift_threshold).itertuples(index=False):
+            anomalies[row.doc].append({
+                "description": row.description,
+                "unit_price": float(row.unit_price),
+                "historical_unit_price": round(float(row.mean), 2),
+                "change_pct": round(float(row.change) * 100, 1),
+                "issue": "Price drift from supplier history"
+            })
+        history.update(frame)
+    return anomalies
@@ -0,0 +1,215 @@
+import copy
+from typing import Dict, List, Optional
+from utils.line_matching import attribute_lines, normalise_description, similarity_matrix
+
+# bump when the state layout changes, older states are rebuilt from the stored result instead
+STATE_VERSION = 1
+
+# documents whose lines reduce what is owed instead of adding to what was delivered
+CREDIT_DOCUMENT_TYPES = {"credit_note"}
+
+# line level issues, native wording and the gpt "type" field. anything else (duplicate charges, price drift)
+# is about the invoice itself and is carried over unchanged
+MISSING_ISSUES = {"Missing from delivery document", "missing_item"}
+MISMATCH_ISSUES = {"Quantity mismatch", "quantity_mismatch"}
+EXTRA_ISSUES = {"Extra item in delivery not invoiced", "extra_item"}
+
+def total_quantity(quantities) -> Optional[float]:
+    quantities = [quantity for quantity in quantities if quantity is not None]
+    if not quantities:
+        return None
+    # summing float quantities across documents shouldn't turn 0.1 + 0.2 into a mismatch
+    return round(sum(quantities), 6)
+
+def _issue(entry: dict) -> Optional[str]:
+    return entry.get("issue") or entry.get("type")
+
+def _find_line(lines: Dict[str, dict], description: str, threshold: float) -> Optional[dict]:
+    """
+    the state line for a result entry: same normalised description, else the most similar one above threshold
+    (gpt results may quote a description slightly differently)
+    """
+    line = lines.get(normalise_description(description))
+    if line is not None or not lines or not description:
+        return line
+    keys = list(lines)
+    scores = similarity_matrix([description], [lines[key]["invoice_item"].get("description") or "" for key in keys])[0]
+    best = int(scores.argmax())
+    return lines[keys[best]] if scores[best] >= threshold else None
+
+def build_state(invoice_data: dict, result: dict, documents: List[str], threshold: float = 0.8) -> dict:
+    """
+    incremental state for a finished reconciliation: one entry per invoice line, keyed by normalised description,
+    with what has been delivered and credited against it so far, plus delivery lines that matched nothing.
+    works from native, grouped and gpt results alike. documents labels the delivery documents already included
+    """
+    lines = {}
+    for item in invoice_data.get("line_items") or []:
+        key = normalise_description(item.get("description"))
+        if key in lines:
+            # repeated invoice lines share a key, the duplicate charge itself stays flagged among the carried issues
+            lines[key]["invoice_qty"] = total_quantity([lines[key]["invoice_qty"], item.get("quantity")])
+            continue
+        lines[key] = {"invoice_item": item, "invoice_qty": item.get("quantity"), "deliveries": [], "credits": []}
+
+    # results without a per document breakdown came from a single delivery document
+    default_document = ", ".join(documents)
+    extra_lines = []
+    carried = []
+
+    for entry in result.get("matched_items") or []:
+        line = _find_line(lines, entry.get("invoice_description") or entry.get("description"), threshold)
+        if line is None:
+            continue
+        line["deliveries"].extend(entry.get("deliveries") or [{"document": default_document, "quantity": entry.get("quantity")}])
+
+    for entry in result.get("discrepancies") or []:
+        issue = _issue(entry)
+        if issue in MISSING_ISSUES:
+            continue
+        if issue in EXTRA_ISSUES:
+            extra_lines.append({
+                "description": entry.get("docket_description") or entry.get("description"),
+                "document": entry.get("document", default_document),
+                "quantity": entry.get("quantity", entry.get("found_quantity"))
+            })
+            continue
+        line = None
+        if issue in MISMATCH_ISSUES:
+            line = _find_line(lines, entry.get("invoice_description") or entry.get("description"), threshold)
+        if line is None:
+            carried.append(entry)
+            continue
+        delivered = entry.get("delivered_qty", entry.get("found_quantity"))
+        line["deliveries"].extend(entry.get("deliveries") or [{"document": default_document, "quantity": delivered}])
+
+    return {
+        "version": STATE_VERSION,
+        "lines": lines,
+        "extra_lines": extra_lines,
+        "unmatched_credits": [],
+        "carried_discrepancies": carried,
+        "documents": list(documents)
+    }
+
+def _expected_quantity(line: dict) -> Optional[float]:
+    if line["invoice_qty"] is None:
+        return None
+    credited = total_quantity(entry["quantity"] for entry in line["credits"]) or 0
+    return round(line["invoice_qty"] - credited, 6)
+
+def is_outstanding(line: dict) -> bool:
+    """
+    still waiting on deliveries (or a credit): less has arrived than is owed
+    """
+    expected = _expected_quantity(line)
+    delivered = total_quantity(entry["quantity"] for entry in line["deliveries"]) or 0
+    return expected is None or delivered < expected
+
+def apply_document(state: dict, doc: dict, label: str, threshold: float = 0.8) -> dict:
+    """
+    folds a late docket or credit note into a copy of state. its lines are matched against the outstanding
+    invoice lines only, so the work is proportional to the new document; a line naming an already settled
+    item is recorded against it (over delivery / over credit), anything else is an extra line.
+    a document whose label the state already includes is not counted twice, state is returned unchanged
+    """
+    if label in state["documents"]:
+        return state
+    state = copy.deepcopy(state)
+    items = doc.get("line_items") or []
+    credit = doc.get("document_type") in CREDIT_DOCUMENT_TYPES
+    field = "credits" if credit else "deliveries"
+
+    def quantity(item):
+        # credit notes may list credited quantities as negatives
+        value = item.get("quantity")
+        return abs(value) if credit and value is not None else value
+
+    outstanding = [key for key, line in state["lines"].items() if is_outstanding(line)]
+    lines_for_target, unattributed = attribute_lines(
+        [state["lines"][key]["invoice_item"].get("description") or "" for key in outstanding],
+        [item.get("description") or "" for item in items],
+        threshold
+    )
+    for target, indices in lines_for_target.items():
+        line = state["lines"][outstanding[target]]
+        line[field].extend({"document": label, "quantity": quantity(items[index])} for index in indices)
+
+    for index in unattributed:
+        item = items[index]
+        line = state["lines"].get(normalise_description(item.get("description")))
+        if line is not None:
+            line[field].append({"document": label, "quantity": quantity(item)})
+        else:
+            state["unmatched_credits" if credit else "extra_lines"].append(
+                {"description": item.get("description"), "document": label, "quantity": quantity(item)}
+            )
+
+    state["documents"].append(label)
+    return state
+
+def result_from_state(state: dict) -> dict:
+    """
+    matched_items, discrepancies, status and summary recomputed from the state, shaped like the native output.
+    a line is matched when what was delivered equals the invoice quantity less its credits, so a credit note
+    for goods that were delivered in full is a quantity mismatch: the goods were kept but no longer paid for
+    """
+    matched = []
+    discrepancies = []
+    for line in state["lines"].values():
+        item = line["invoice_item"]
+        expected = _expected_quantity(line)
+        delivered = total_quantity(entry["quantity"] for entry in line["deliveries"])
+        credits = {"credits": line["credits"]} if line["credits"] else {}
+
+        if not line["deliveries"] and expected != 0:
+            discrepancies.append({
+                "description": item.get("description"),
+                **credits,
+                "issue": "Missing from delivery document"
+            })
+        elif (delivered or 0) == expected:
+            matched.append({**item, "deliveries": line["deliveries"], **credits})
+        else:
+            discrepancies.append({
+                "description": item.get("description"),
+                "invoice_qty": line["invoice_qty"],
+                **({"credited_qty": line["invoice_qty"] - expected} if line["credits"] else {}),
+                "delivered_qty": delivered,
+                "deliveries": line["deliveries"],
+                **credits,
+                "issue": "Quantity mismatch"
+            })
+
+    for extra in state["extra_lines"]:
+        discrepancies.append({
+            "description": extra["description"],
+            "document": extra["document"],
+            "issue": "Extra item in delivery not invoiced"
+        })
+    for credit in state["unmatched_credits"]:
+        discrepancies.append({
+            "description": credit["description"],
+            "document": credit["document"],
+            "credited_qty": credit["quantity"],
+            "issue": "Credit for item not invoiced"
+        })
+    discrepancies.extend(state["carried_discrepancies"])
+
+    return {
+        "reconciliation_status": "mismatch" if discrepancies else "reconciled",
+        "matched_items": matched,
+        "discrepancies": discrepancies,
+        "summary": f"{len(matched)} matched, {len(discrepancies)} discrepancies across {len(state['documents'])} documents"
+    }
+
+def update_result(result: dict, invoice_data: dict, doc: dict, label: str, threshold: float = 0.8) -> dict:
+    """
+    a stored reconciliation result with doc folded in. results saved before the state existed have it
+    rebuilt from their matched items and discrepancies first
+    """
+    state = result.get("reconciliation_state")
+    if not state or state.get("version") != STATE_VERSION:
+        state = build_state(invoice_data, result, [result.get("comparison_doc_type") or "delivery document"], threshold)
+    state = apply_document(state, doc, label, threshold)
+    return {**result, **result_from_state(state), "reconciliation_state": state}
@@ -0,0 +1,40 @@
+from typing import List, Literal, Optional
+from pydantic import BaseModel, Field
+
+# response models for GPT structured outputs, field names match the free-form json the pipeline already writes
+
+class LineItem(BaseModel):
+    description: str
+    quantity: int
+    unit_price: Optional[float] = None
+    line_total: Optional[float] = None
+
+class ParsedDocument(BaseModel):
+    invoice_number: Optional[str] = Field(None, description="e.g. INV-1234")
+    supplier_name: Optional[str] = None
+    job_code: Optional[str] = None
+    document_type: Literal["invoice", "delivery_docket", "purchase_confirmation", "unknown"]
+    line_items: List[LineItem]
+
+class MatchedItem(BaseModel):
+    invoice_description: str
+    docket_description: str
+    quantity: int
+
+class Discrepancy(BaseModel):
+    type: Literal["missing_item", "extra_item", "quantity_mismatch", "price_mismatch", "duplicate"]
+    invoice_description: Optional[str] = None
+    docket_description: Optional[str] = None
+    expected_quantity: Optional[int] = None
+    found_quantity: Optional[int] = None
+    notes: Optional[str] = None
+
+class ReconciliationResult(BaseModel):
+    invoice_number: Optional[str] = None
+    job_code: Optional[str] = None
+    supplier_name: Optional[str] = None
+    reconciliation_status: Literal["reconciled", "mismatch"]
+    matched_items: List[MatchedItem]
+    discrepancies: List[Discrepancy]
+    summary: str = Field(description="e.g. 3 matched, 1 missing, 0 extra")
+    explanation: str = Field(description="max 200 words on the findings and judgment, for audit logging and human review")
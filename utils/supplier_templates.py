@@ -0,0 +1,78 @@
+import json
+import os
+import re
+from pathlib import Path
+from typing import Dict, List
+
+TEMPLATES_DIR = Path(os.getenv("SUPPLIER_TEMPLATES_DIR", Path(__file__).resolve().parent.parent / "supplier_templates"))
+
+# how much of the first page is looked at when fingerprinting a document
+FINGERPRINT_CHARS = 2000
+
+# every template pattern must capture its value with these group names
+DEFAULT_PATTERNS = {
+    "supplier_name": r"Supplier:\s*(?P<supplier_name>.+)",
+    "invoice_number": r"(?i:Invoice\s+(?:Number|No\.?):\s*(?P<invoice_number>INV-\d+))",
+    "bare_invoice_number": r"(?i:\b(?P<bare_invoice_number>INV-\d+)\b)",
+    "job_code": r"Job Code:\s*(?P<job_code>\S+)",
+    "line_item": (
+        r"(?i:\d+\.\s*(?P<description>.*?)\s*\|\s*Qty:\s*(?P<quantity>\d+)"
+        r"(?:\s*\|\s*Unit Price:\s*\$?(?P<unit_price>[\d.]+))?)"
+    ),
+}
+
+HEADER_FIELDS = ["supplier_name", "invoice_number", "bare_invoice_number", "job_code"]
+
+class SupplierTemplate:
+    """
+    compiled extraction patterns for one supplier layout.
+
+    scanner pulls header fields and line items out in a single finditer pass, item_scanner is used
+    on later pages once every header field has been found. header fields are zero-width lookaheads
+    so a greedy header value (e.g. supplier_name's .+) never consumes text another field or an item needs
+    """
+
+    def __init__(self, name: str, patterns: Dict[str, str] = None, fingerprint: str = None):
+        self.name = name
+        self.patterns = {**DEFAULT_PATTERNS, **(patterns or {})}
+        self.fingerprint = re.compile(fingerprint) if fingerprint else None
+        self.scanner = re.compile("|".join(
+            [f"(?=(?:{self.patterns[field]}))" for field in HEADER_FIELDS] + [f"(?:{self.patterns['line_item']})"]
+        ))
+        self.item_scanner = re.compile(self.patterns["line_item"])
+
+    def matches(self, first_page_text: str) -> bool:
+        return bool(self.fingerprint and self.fingerprint.search(first_page_text[:FINGERPRINT_CHARS]))
+
+DEFAULT_TEMPLATE = SupplierTemplate("default")
+
+def load_templates(templates_dir: Path = TEMPLATES_DIR) -> List[SupplierTemplate]:
+    """
+    loads every *.json template in templates_dir, e.g.
+    {"name": "acme", "fingerprint": "ACME Supplies", "patterns": {"job_code": "Project:\\s*(?P<job_code>\\S+)"}}
+    patterns left out fall back to the defaults
+    """
+    templates = []
+    if not templates_dir.is_dir():
+        return templates
+    for template_path in sorted(templates_dir.glob("*.json")):
+        with open(template_path) as f:
+            config = json.load(f)
+        templates.append(SupplierTemplate(
+            config.get("name", template_path.stem),
+            config.get("patterns"),
+            config.get("fingerprint")
+        ))
+    return templates
+
+# compiled once at import
+TEMPLATES = load_templates()
+
+def select_template(first_page_text: str) -> SupplierTemplate:
+    """
+    picks the first template whose fingerprint appears on the first page, falling back to the default
+    """
+    for template in TEMPLATES:
+        if template.matches(first_page_text):
+            return template
+    return DEFAULT_TEMPLATE
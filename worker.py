@@ -0,0 +1,216 @@
+import argparse
+import json
+import random
+import time
+import traceback
+from multiprocessing import Process
+from pathlib import Path
+from dotenv import load_dotenv
+from utils.batch_utils import resolve_pdf_paths
+from utils.document_matcher import get_document_index, group_documents, load_related_documents
+from utils.gpt_cache import GPTResponseCache
+from utils.job_queue import JobQueue, DEFAULT_QUEUE_PATH, DONE, PARSED, UNPAIRED
+from utils import metrics
+
+load_dotenv()
+
+# how long an unpaired document waits before looking for its partner again
+PARTNER_RETRY_DELAY = 30
+
+def output_dirs(method):
+    base_dir = Path(f"local_src_{method}_output")
+    parsed_dir = base_dir / "parsed"
+    reconciled_dir = base_dir / "reconciled"
+    parsed_dir.mkdir(parents=True, exist_ok=True)
+    reconciled_dir.mkdir(parents=True, exist_ok=True)
+    return parsed_dir, reconciled_dir
+
+def parse_job(job, response_cache=None):
+    """
+    parse stage: extract + parse one pdf into the method's parsed dir, returns the parsed json path.
+    response_cache is the worker process' GPT response cache, shared across its jobs
+    """
+    pdf_path = Path(job["pdf_path"])
+    parsed_dir, _ = output_dirs(job["method"])
+
+    # gpt modules build an api client at import, so only load them for gpt jobs
+    if job["method"] == "gpt":
+        from gpt_parse import extract_clean_text, parse_with_gpt, detect_document_type, write_to_file
+        _, text = extract_clean_text(pdf_path)
+        parsed = parse_with_gpt(text, response_cache)
+        if not parsed:
+            raise ValueError("GPT returned no parsable result")
+        parsed["document_type"] = detect_document_type(text)
+    else:
+        from parse_pdfs import extract_and_parse, write_to_file, PARSER_VERSION
+        from utils.extraction_cache import ExtractionCache
+        text, parsed = extract_and_parse(pdf_path, "batch_document", ExtractionCache(PARSER_VERSION))
+
+    parsed["document_position"] = "batch_document"
+    parsed["source_file"] = pdf_path.name
+    parsed_path = parsed_dir / f"{pdf_path.stem}_parsed.json"
+    write_to_file(text, parsed_dir / f"{pdf_path.stem}_text.txt")
+    write_to_file(json.dumps(parsed, indent=2), parsed_path)
+    get_document_index(parsed_dir).add(parsed_path, parsed)
+    return parsed_path
+
+def reconcile_group(method, group, reconciled_dir, token_budget=None, structured=False):
+    """
+    reconciles one (invoice_entry, [delivery_entries]) group, returns its result path or None while it only
+    has credit notes. an invoice with a stored result only has its new dockets/credit notes folded in.
+    gpt groups go through gpt_reconcile.reconcile_group, token_budget/structured are its prompt options
+    """
+    from reconcile import find_result_path, reconcile_parsed_groups
+    (invoice_path, invoice_data), entries = group
+
+    if method == "gpt":
+        import gpt_reconcile
+        result_path = gpt_reconcile.reconcile_group(
+            group, reconciled_dir, token_budget or gpt_reconcile.PROMPT_TOKEN_BUDGET, structured
+        )
+    else:
+        from utils.price_checks import SupplierPriceHistory
+        history = SupplierPriceHistory()
+        try:
+            result_paths, unmatched = reconcile_parsed_groups(
+                invoice_path.parent, reconciled_dir, history=history, parsed_docs=[group[0], *entries]
+            )
+        finally:
+            history.close()
+        if unmatched:
+            return None
+        result_path = result_paths[0] if result_paths else None
+    # nothing new in the group, the job still completes against the invoice's stored result
+    return result_path or find_result_path(reconciled_dir, invoice_data.get("invoice_number"))
+
+def reconcile_job(queue, job, token_budget=None, structured=False):
+    """
+    reconcile stage: reconciles the invoice group the job's document belongs to, with every docket and credit
+    note parsed for it so far, and marks the group's other waiting jobs done too.
+    returns False when the document has no counterpart yet
+    """
+    parsed_dir, reconciled_dir = output_dirs(job["method"])
+    parsed_path = Path(job["parsed_path"])
+    with open(parsed_path) as f:
+        doc = json.load(f)
+
+    groups, _ = group_documents(load_related_documents(parsed_dir, parsed_path, doc))
+    group = next(
+        (group for group in groups if parsed_path.name in {path.name for path, _ in [group[0], *group[1]]}),
+        None
+    )
+    if group is None:
+        return False
+
+    (invoice_path, _), entries = group
+    # two workers holding dockets of the same invoice would otherwise both rewrite its stored result
+    with queue.lock(f"reconcile:{job['method']}:{invoice_path.name}"):
+        result_path = reconcile_group(job["method"], group, reconciled_dir, token_budget, structured)
+    if result_path is None:
+        return False
+
+    queue.complete(job["id"], DONE, result_path=str(result_path))
+    queue.complete_parsed([str(path) for path, _ in [group[0], *entries]], str(result_path))
+    print(f"✅ Reconciled {Path(job['pdf_path']).name} into {Path(result_path).name} ({len(entries)} delivery documents)")
+    return True
+
+def run_worker(stage, queue_path, visibility_timeout, max_attempts, poll_interval, exit_when_idle, max_partner_waits=20,
+               token_budget=None, structured=False):
+    """
+    long running worker loop for one stage, run one per process
+    """
+    metrics.configure()
+    queue = JobQueue(queue_path, visibility_timeout, max_attempts, max_partner_waits)
+    # one sqlite connection per worker process, not per job
+    response_cache = GPTResponseCache() if stage == "parse" else None
+    try:
+        _work(stage, queue, response_cache, poll_interval, exit_when_idle, token_budget, structured)
+    finally:
+        if response_cache:
+            response_cache.close()
+        queue.close()
+
+def _work(stage, queue, response_cache, poll_interval, exit_when_idle, token_budget=None, structured=False):
+    while True:
+        job = queue.claim(stage)
+        if job is None:
+            if exit_when_idle:
+                break
+            time.sleep(poll_interval)
+            continue
+
+        metrics.increment("jobs_claimed_total", stage=stage)
+        try:
+            # ocr heavy parses and gpt retries can outlast the lease, so it is renewed while the job runs,
+            # together with the per-invoice lock a reconcile takes
+            with queue.keep_alive(job["id"]):
+                if stage == "parse":
+                    parsed_path = parse_job(job, response_cache)
+                else:
+                    reconciled = reconcile_job(queue, job, token_budget, structured)
+            if stage == "parse":
+                queue.complete(job["id"], PARSED, parsed_path=str(parsed_path))
+                print(f"✅ Parsed {Path(job['pdf_path']).name}")
+            elif not reconciled:
+                # jitter so two workers holding each other's partner don't keep colliding
+                if queue.release(job["id"], stage, PARTNER_RETRY_DELAY * random.uniform(0.5, 1.5)) == UNPAIRED:
+                    metrics.increment("jobs_unpaired_total", stage=stage)
+                    print(f"⚠️  No partner arrived for {Path(job['pdf_path']).name}, marked unpaired")
+        except Exception as e:
+            traceback.print_exc()
+            queue.fail(job["id"], stage, str(e))
+            metrics.increment("jobs_failed_total", stage=stage)
+            print(f"❌ {stage} failed for {Path(job['pdf_path']).name}: {e}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Durable parse -> reconcile job queue.")
+    parser.add_argument("--queue", type=Path, default=DEFAULT_QUEUE_PATH, help="sqlite queue file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    enqueue_parser = subparsers.add_parser("enqueue", help="queue pdfs for processing")
+    enqueue_parser.add_argument("input", help="pdf file, directory or glob")
+    enqueue_parser.add_argument("--method", choices=["gpt", "native"], default="native")
+
+    run_parser = subparsers.add_parser("run", help="run worker processes until interrupted")
+    run_parser.add_argument("--parse-workers", type=int, default=2)
+    run_parser.add_argument("--reconcile-workers", type=int, default=1)
+    run_parser.add_argument("--visibility-timeout", type=float, default=300, help="seconds before a crashed job is retried")
+    run_parser.add_argument("--max-attempts", type=int, default=3)
+    run_parser.add_argument("--max-partner-waits", type=int, default=20,
+                            help="times a document is put back to wait for its partner before it is marked unpaired")
+    run_parser.add_argument("--poll-interval", type=float, default=2)
+    run_parser.add_argument("--exit-when-idle", action="store_true", help="stop once no job is ready")
+    run_parser.add_argument("--token-budget", type=int, help="gpt reconcile: max prompt tokens")
+    run_parser.add_argument("--structured", action="store_true", help="gpt reconcile: use schema validated structured outputs")
+
+    subparsers.add_parser("status", help="show job counts per state")
+    args = parser.parse_args()
+
+    if args.command == "enqueue":
+        queue = JobQueue(args.queue)
+        paths = resolve_pdf_paths(args.input)
+        added = sum(queue.enqueue(path.resolve(), args.method) for path in paths)
+        print(f"📥 Queued {added} new of {len(paths)} pdfs")
+    elif args.command == "status":
+        for state, count in sorted(JobQueue(args.queue).counts().items()):
+            print(f"{state}: {count}")
+    else:
+        stages = ["parse"] * args.parse_workers + ["reconcile"] * args.reconcile_workers
+        processes = [
+            Process(target=run_worker, args=(
+                stage, args.queue, args.visibility_timeout, args.max_attempts, args.poll_interval, args.exit_when_idle,
+                args.max_partner_waits, args.token_budget, args.structured
+            ))
+            for stage in stages
+        ]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+
+if __name__ == "__main__":
+    main()